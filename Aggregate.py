@@ -0,0 +1,442 @@
+"""Gather the per-session data files of the RSVP local/global tasks into one
+table.
+
+Every CSV file under the given directories that has trial data (an 'exp'
+and a 'trial' column) is parsed, in parallel, into a NumPy structured array
+with the fixed schema AGGREGATE_FIELDS, and all of them are written to a
+single compressed columnar file: .npz (the format of TrialRecord.saveNPZ,
+read with TrialData.LoadTrialRecord) or, with pyarrow installed, .parquet
+(read in R with arrow::read_parquet).
+
+The three versions of the task differ in their files, and are normalized:
+
+    RSVPLG01  PsychoPy wide-text files from RSVPLG.py's TrialHandlers, with
+              .thisRepN/.thisIndex/... columns (dropped)
+    RSVPLG02  RSVPLG.py, session information last
+    RSVPLG03  TutuLG.py, session information first, different names for
+              the block type, trial type, date and experimenter
+
+Columns are renamed to the names in AGGREGATE_FIELDS (RENAMES), the main
+trials are trial_type 'main' in all versions, and lag is the T1-T2 SOA in
+ms, as in the 01-CleanData.Rmd scripts (t2_lag counts stream items of 150
+ms in RSVPLG01/02 and is already in ms in RSVPLG03). Columns a version does
+not have are empty strings or NaN.
+
+Re-running it only parses the files that are new or have changed since
+the last run (see UpdateAggregate):
+
+    python Aggregate.py rsvplg03/data -o rsvplg03/AllData.npz -j 4
+"""
+
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from TrialData import RSVPLG_TRIAL_FIELDS, TUTU_TRIAL_FIELDS
+
+# ms per unit of t2_lag, by experiment
+EXPERIMENTS = {
+    'RSVPLG01': {'lag_ms': 150},
+    'RSVPLG02': {'lag_ms': 150},
+    'RSVPLG03': {'lag_ms': 1}}
+
+RENAMES = {
+    'sess': 'session',
+    'blocktyp': 'block_type',
+    'blocktype': 'block_type',
+    'trialtype': 'trial_type',
+    'datetime': 'session_time',
+    'runtime': 'session_time',
+    'trialtime': 'trial_time',
+    'exp_initials': 'experimenter',
+    'mod-utc': 'modtime'}
+
+TRIAL_TYPES = {'exp': 'main'}
+
+# PsychoPy's TrialHandler bookkeeping, in RSVPLG01 files
+def DroppedColumn(name):
+    return name.startswith('.') or name.startswith('thisRow.') or name == 'notes'
+
+# columns every version has (after renaming), then the session columns
+# some have; session and seed are floats so they can be missing
+CORE_FIELDS = [
+    ('source', 'U160'),
+    ('exp', 'U16'),
+    ('ver', 'U16'),
+    ('modtime', 'U32'),
+    ('sub', 'i4'),
+    ('session', 'f8'),
+    ('experimenter', 'U16'),
+    ('room', 'U32'),
+    ('block_type', 'U16'),
+    ('session_time', 'U32'),
+    ('seed', 'f8'),
+    ('targets', 'U8'),
+    ('cuetype', 'f8'),
+    ('mode', 'U16'),
+    ('trial', 'i4'),
+    ('trial_type', 'U8'),
+    ('trial_time', 'U32'),
+    ('t1_level', 'U6'),
+    ('t2_level', 'U6'),
+    ('t2_lag', 'i4'),
+    ('lag', 'i4'),
+    ('t1', 'U8'),
+    ('t2', 'U8'),
+    ('t1_corr', 'U4'),
+    ('t2_corr', 'U4'),
+    ('t1_resp', 'U16'),
+    ('t1_acc', 'i1'),
+    ('t1_rt', 'f8'),
+    ('t2_resp', 'U16'),
+    ('t2_acc', 'i1'),
+    ('t2_rt', 'f8')]
+REQUIRED = ['exp', 'sub', 'trial', 't1_level', 't2_level', 't2_lag', 't1_acc',
+            't2_acc']
+
+def VersionFields():
+    # the remaining columns of either task, with integers as floats since
+    # the other task's files do not have them
+    names = set(name for name, dtype in CORE_FIELDS)
+    fields = []
+    for name, dtype in RSVPLG_TRIAL_FIELDS + TUTU_TRIAL_FIELDS:
+        if name in names:
+            continue
+        names.add(name)
+        fields.append((name, 'f8' if dtype[0] == 'i' else dtype))
+    return fields
+
+AGGREGATE_FIELDS = CORE_FIELDS + VersionFields()
+AGGREGATE_DTYPE = np.dtype(AGGREGATE_FIELDS)
+
+def EmptyRows(n):
+    data = np.zeros(n, dtype=AGGREGATE_DTYPE)
+    for name in AGGREGATE_DTYPE.names:
+        if AGGREGATE_DTYPE[name].kind == 'f':
+            data[name] = np.nan
+    return data
+
+def ConvertColumn(values, dtype, name):
+    """Strings from a CSV column as an array of dtype; raises ValueError if
+    they do not fit
+    """
+    x = np.array(values, dtype='U')
+    if dtype.kind == 'U':
+        if x.dtype.itemsize > dtype.itemsize:
+            s = "column {} has values longer than {}".format(name, dtype)
+            raise ValueError(s)
+        return x.astype(dtype)
+    empty = x == ''
+    if dtype.kind == 'f':
+        x = np.where(empty, 'nan', x)
+    elif np.any(empty):
+        s = "column {} has empty values".format(name)
+        raise ValueError(s)
+    try:
+        f = x.astype('f8')
+    except ValueError as e:
+        s = "column {}: {}".format(name, e)
+        raise ValueError(s)
+    if dtype.kind == 'f':
+        return f
+    if np.any(f != np.round(f)):
+        s = "column {} has values that are not integers".format(name)
+        raise ValueError(s)
+    return f.astype(dtype)
+
+def ReadSessionFile(filename, source=None):
+    """Parse a task data file into rows of AGGREGATE_DTYPE.
+
+    Returns (rows, ignored) where ignored lists the file's columns that are
+    not in the aggregate, or (None, []) if it is not a trial data file.
+    Raises ValueError if it is one but cannot be converted.
+    """
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        lines = [line for line in reader if any(v != '' for v in line)]
+    if header == None:
+        return None, []
+    names = [RENAMES.get(h, h) for h in header]
+    if 'exp' not in names or 'trial' not in names:
+        return None, []
+    missing = [k for k in REQUIRED if k not in names]
+    if len(missing) > 0:
+        s = 'missing columns: ' + ', '.join(missing)
+        raise ValueError(s)
+
+    rows = EmptyRows(len(lines))
+    rows['source'] = filename if source == None else source
+    ignored = []
+    for i, name in enumerate(names):
+        if DroppedColumn(name):
+            continue
+        if name not in AGGREGATE_DTYPE.names or name in ('source', 'lag'):
+            ignored.append(header[i])
+            continue
+        values = [line[i] if i < len(line) else '' for line in lines]
+        rows[name] = ConvertColumn(values, AGGREGATE_DTYPE[name], name)
+
+    # normalize across versions
+    for exp in np.unique(rows['exp']):
+        if exp not in EXPERIMENTS:
+            s = "unknown experiment '{}' (see EXPERIMENTS)".format(exp)
+            raise ValueError(s)
+        rows['lag'][rows['exp'] == exp] = (
+            rows['t2_lag'][rows['exp'] == exp] * EXPERIMENTS[exp]['lag_ms'])
+    for old, new in TRIAL_TYPES.items():
+        rows['trial_type'][rows['trial_type'] == old] = new
+    return rows, ignored
+
+def ParseFile(filename):
+    # for the process pool: errors come back as values so one bad file does
+    # not stop the rest
+    try:
+        rows, ignored = ReadSessionFile(filename)
+        return filename, rows, ignored, None
+    except (OSError, ValueError, csv.Error) as e:
+        return filename, None, [], str(e)
+
+def FindDataFiles(paths):
+    """CSV files in paths (files or directories, searched recursively)"""
+    files = []
+    for p in paths:
+        if os.path.isfile(p):
+            files.append(os.path.normpath(p))
+            continue
+        for dirpath, dirnames, filenames in os.walk(p):
+            dirnames.sort()
+            for f in sorted(filenames):
+                if f.lower().endswith('.csv'):
+                    files.append(os.path.normpath(os.path.join(dirpath, f)))
+    return files
+
+def ParseFiles(files, jobs=1):
+    """Parse files, in parallel with jobs > 1; returns the ParseFile()
+    result of each, in order
+    """
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            return list(pool.map(ParseFile, files, chunksize=8))
+    return [ParseFile(f) for f in files]
+
+def CollectRows(results, verbose=True):
+    """Rows of the ParseFile() results as one array, and the number of rows
+    from each file (None for files that failed)
+    """
+    parts = []
+    counts = {}
+    for filename, rows, ignored, error in results:
+        if error != None:
+            print('WARNING: skipping {}: {}'.format(filename, error))
+            counts[filename] = None
+        elif rows is None:
+            if verbose:
+                print('not a trial data file: {}'.format(filename))
+            counts[filename] = 0
+        else:
+            if len(ignored) > 0 and verbose:
+                print('{}: ignoring columns {}'.format(
+                    filename, ', '.join(ignored)))
+            parts.append(rows)
+            counts[filename] = len(rows)
+    if len(parts) == 0:
+        return EmptyRows(0), counts
+    return np.concatenate(parts), counts
+
+def Aggregate(files, jobs=1, verbose=True):
+    """One array with the rows of every trial data file in files"""
+    return CollectRows(ParseFiles(files, jobs), verbose)[0]
+
+def SaveAggregate(data, filename, info=None):
+    """Write the aggregate as .npz, or as .parquet (requires pyarrow)"""
+    info = dict(info) if info is not None else {}
+    info.update({'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                 'n_rows': len(data)})
+    dirname = os.path.dirname(filename)
+    if dirname != '' and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    if filename.endswith('.parquet'):
+        import pyarrow
+        import pyarrow.parquet
+        table = pyarrow.table({name: data[name] for name in data.dtype.names})
+        table = table.replace_schema_metadata({'info': json.dumps(info)})
+        pyarrow.parquet.write_table(table, filename, compression='zstd')
+    else:
+        columns = {name: data[name] for name in data.dtype.names}
+        columns['__info__'] = np.array(json.dumps(info, default=str))
+        np.savez_compressed(filename, **columns)
+
+def LoadAggregate(filename):
+    """Read a file written by SaveAggregate() back into an array"""
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(filename)
+        columns = {name: table[name].to_numpy() for name in table.column_names}
+    else:
+        with np.load(filename, allow_pickle=False) as f:
+            columns = {k: f[k] for k in f.files if k != '__info__'}
+    if set(columns.keys()) != set(AGGREGATE_DTYPE.names):
+        s = '{} does not have the current columns'.format(filename)
+        raise ValueError(s)
+    n = len(columns['source'])
+    data = EmptyRows(n)
+    for name in AGGREGATE_DTYPE.names:
+        data[name] = columns[name]
+    return data
+
+########################################################################
+# Incremental updates
+########################################################################
+
+def FileHash(filename, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            b = f.read(block_size)
+            if len(b) == 0:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+def SchemaSignature():
+    # a manifest is only good for aggregates with the same columns
+    return hashlib.sha256(str(AGGREGATE_DTYPE.descr).encode('utf-8')
+                          ).hexdigest()[:16]
+
+def ManifestFileName(output):
+    return os.path.splitext(output)[0] + '-manifest.json'
+
+def LoadManifest(filename):
+    """The manifest's file entries, or None if there is no usable manifest"""
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('schema') != SchemaSignature():
+        return None
+    return manifest['files']
+
+def SaveManifest(filename, entries):
+    with open(filename, 'w') as f:
+        json.dump({'schema': SchemaSignature(), 'files': entries}, f,
+                  indent=1, sort_keys=True)
+
+def UpdateAggregate(paths, output, jobs=1, verbose=True, full=False):
+    """Bring the aggregate in output up to date with the data files in
+    paths, and return it with the number of files in each state (unchanged,
+    new, changed, removed, failed, and stale: failed files that had been
+    aggregated before).
+
+    A manifest beside output records each file's SHA-256 hash, size,
+    modification time and number of rows. Files whose size and time match
+    their entry are taken as unchanged without reading them; the others
+    are hashed, and only new or changed files are parsed. The rows of
+    changed and removed files are dropped and the new rows appended, so the
+    cost of an update depends on what changed rather than on the number of
+    sessions. With full, or if there is no manifest or aggregate with the
+    current columns, everything is parsed. A changed file that fails to
+    parse, or no longer has any rows (e.g. one a running session is still
+    writing), keeps its old rows and manifest entry, and is tried again on
+    the next update.
+    """
+    manifest_file = ManifestFileName(output)
+    entries = None
+    if not full and os.path.isfile(output):
+        entries = LoadManifest(manifest_file)
+    if entries != None:
+        try:
+            old = LoadAggregate(output)
+        except (OSError, ValueError, KeyError) as e:
+            print('Rebuilding {}: {}'.format(output, e))
+            entries = None
+    if entries == None:
+        entries = {}
+        old = EmptyRows(0)
+
+    files = FindDataFiles(paths)
+    status = {'unchanged': 0, 'new': 0, 'changed': 0, 'removed': 0,
+              'failed': 0, 'stale': 0}
+    to_parse = []
+    hashes = {}
+    for f in files:
+        st = os.stat(f)
+        e = entries.get(f)
+        if e != None and e['size'] == st.st_size and e['mtime'] == st.st_mtime:
+            status['unchanged'] += 1
+            continue
+        hashes[f] = FileHash(f)
+        if e != None and e['sha256'] == hashes[f]:
+            # touched but not changed
+            e['size'] = st.st_size
+            e['mtime'] = st.st_mtime
+            status['unchanged'] += 1
+            continue
+        status['changed' if e != None else 'new'] += 1
+        to_parse.append(f)
+    found = set(files)
+    removed = [f for f in entries if f not in found]
+    status['removed'] = len(removed)
+    stale = [f for f in to_parse + removed if f in entries]
+    for f in removed:
+        del entries[f]
+
+    new, counts = CollectRows(ParseFiles(to_parse, jobs), verbose)
+    for f, n in counts.items():
+        if n == None:
+            status['failed'] += 1
+        if f in entries and (n == None or (n == 0 and entries[f]['rows'] > 0)):
+            # a file with rows that now has none or cannot be read is most
+            # likely being written: keep what it had, and since its entry no
+            # longer matches, try it again next time
+            print('WARNING: {} is stale: keeping its rows from the last '
+                  'update'.format(f))
+            status['stale'] += 1
+            stale.remove(f)
+            continue
+        if n == None:
+            # tried again next time
+            continue
+        st = os.stat(f)
+        entries[f] = {'sha256': hashes[f], 'size': st.st_size,
+                      'mtime': st.st_mtime, 'rows': n}
+    if len(stale) > 0:
+        old = old[~np.isin(old['source'], stale)]
+    data = np.concatenate([old, new]) if len(new) > 0 else old
+
+    if len(to_parse) > 0 or len(removed) > 0 or not os.path.isfile(output):
+        SaveAggregate(data, output, {
+            'paths': paths, 'n_files': len(np.unique(data['source']))})
+    SaveManifest(manifest_file, entries)
+    return data, status
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Gather task data files into one table, parsing only '
+        'files that are new or have changed since the last run')
+    parser.add_argument('paths', nargs='+',
+                        help='data files or directories of them')
+    parser.add_argument('-o', '--output', default='AllData.npz',
+                        help='.npz or .parquet file')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--full', action='store_true',
+                        help='parse every file again')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    data, status = UpdateAggregate(args.paths, args.output, args.jobs,
+                                   verbose=not args.quiet, full=args.full)
+    print(', '.join(['{} {}'.format(n, k) for k, n in status.items()]) +
+          ' files')
+    print('{} rows from {} files ({} sessions) in {:.2f} s -> {}'.format(
+        len(data), len(np.unique(data['source'])), len(np.unique(
+            data[['source', 'session_time']])) if len(data) > 0 else 0,
+        time.perf_counter() - t0, args.output))
@@ -0,0 +1,257 @@
+"""Attentional blink and signal detection measures of the RSVP local/global
+tasks.
+
+The functions take trials as columns: a NumPy structured array (a
+TrialRecord's data, or an aggregate from Aggregate.py) or a dict of arrays.
+They group trials with np.unique and count with np.bincount, so a whole
+aggregate of thousands of sessions takes about as long as reading it:
+
+    AccuracyByLag  T1 and T2|T1 accuracy per lag
+    BlinkMagnitude T2|T1 accuracy at the longest lag minus at the shortest
+    DPrime         hits, false alarms, d' and criterion, with one target
+                   letter as the signal
+
+The definitions follow the 11-Blink.Rmd and 07-SDT.Rmd analyses: only main
+trials of Experiment blocks on which both targets were scored count, T2|T1
+is T2 accuracy on trials with T1 correct, and hit and correct-rejection
+rates of 0 or 1 are moved to 1/(2n) or 1 - 1/(2n), with n the number of
+trials in the group. Aggregates mix experiments, whose lags differ, so the
+measures are always computed separately for each experiment (exp).
+
+The task scripts print Report() for each block as it ends. For an aggregate:
+
+    python BlinkMetrics.py rsvplg03/AllData.npz -o rsvplg03/blink
+"""
+
+import csv
+from statistics import NormalDist
+
+import numpy as np
+
+MAIN_TRIAL_TYPES = ('main', 'exp')
+MAIN_BLOCK_TYPE = 'Experiment'
+SIGNAL = 'H'
+
+_z = np.vectorize(NormalDist().inv_cdf, otypes=[float])
+
+def Z(p):
+    # inverse normal CDF, NaN where p is
+    p = np.asarray(p, dtype=float)
+    z = np.full(p.shape, np.nan)
+    ok = np.isfinite(p)
+    if np.any(ok):
+        z[ok] = _z(p[ok])
+    return z
+
+def Column(data, name):
+    return np.asarray(data[name])
+
+def HasColumn(data, name):
+    names = getattr(getattr(data, 'dtype', None), 'names', None)
+    if names is not None:
+        return name in names
+    return name in data
+
+def Scored(data, targets=('t1', 't2'), main_only=True):
+    """Mask of trials whose targets were all scored (acc 0 or 1), and that
+    are main trials if main_only: main trial types, and of Experiment blocks
+    where there is a block_type column (a TrialRecord holds a single block)
+    """
+    mask = np.ones(len(Column(data, 't1_acc')), dtype=bool)
+    for t in targets:
+        mask &= Column(data, t + '_acc') >= 0
+    if main_only:
+        mask &= np.isin(Column(data, 'trial_type'), MAIN_TRIAL_TYPES)
+        if HasColumn(data, 'block_type'):
+            mask &= Column(data, 'block_type') == MAIN_BLOCK_TYPE
+    return mask
+
+def GroupBy(data, by, mask):
+    """The distinct combinations of the by columns among the masked trials,
+    as a table, and the group of each masked trial
+    """
+    n = int(np.sum(mask))
+    if len(by) == 0:
+        return {}, np.zeros(n, dtype=int), 1
+    keys = np.rec.fromarrays([Column(data, k)[mask] for k in by], names=by)
+    groups, inverse = np.unique(keys, return_inverse=True)
+    return ({k: np.asarray(groups[k]) for k in by}, inverse.ravel(),
+            len(groups))
+
+def Ratio(k, n):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(n > 0, k / np.where(n > 0, n, 1), np.nan)
+
+def AccuracyByLag(data, by=(), lag='lag', main_only=True):
+    """T1 and T2|T1 accuracy for every combination of by and lag"""
+    mask = Scored(data, main_only=main_only)
+    table, g, n_groups = GroupBy(data, list(by) + [lag], mask)
+    t1 = Column(data, 't1_acc')[mask] == 1
+    t2 = Column(data, 't2_acc')[mask] == 1
+    n = np.bincount(g, minlength=n_groups)
+    n_t1 = np.bincount(g, weights=t1, minlength=n_groups)
+    n_t2t1 = np.bincount(g, weights=t1 & t2, minlength=n_groups)
+    table.update({
+        'n': n,
+        't1_acc': Ratio(n_t1, n),
+        'n_t1_correct': n_t1.astype(int),
+        't2t1_acc': Ratio(n_t2t1, n_t1)})
+    return table
+
+def BlinkMagnitude(accuracy, by=(), lag='lag', short_lag=None, long_lag=None):
+    """T2|T1 accuracy at long_lag minus at short_lag (default: the longest
+    and shortest lags of each group), for every combination of by in an
+    AccuracyByLag() table; positive when there is a blink
+    """
+    lags = np.asarray(accuracy[lag])
+    if len(lags) == 0:
+        return {}
+    table, g, n_groups = GroupBy(accuracy, list(by), np.ones(len(lags), bool))
+    short = np.full(n_groups, lags.max() if short_lag == None else short_lag)
+    long = np.full(n_groups, lags.min() if long_lag == None else long_lag)
+    if short_lag == None:
+        np.minimum.at(short, g, lags)
+    if long_lag == None:
+        np.maximum.at(long, g, lags)
+    t2t1 = np.asarray(accuracy['t2t1_acc'])
+    t2t1_short = np.full(n_groups, np.nan)
+    t2t1_long = np.full(n_groups, np.nan)
+    is_short = lags == short[g]
+    is_long = lags == long[g]
+    t2t1_short[g[is_short]] = t2t1[is_short]
+    t2t1_long[g[is_long]] = t2t1[is_long]
+    table.update({
+        'short_lag': short,
+        'long_lag': long,
+        't2t1_short': t2t1_short,
+        't2t1_long': t2t1_long,
+        'blink': t2t1_long - t2t1_short})
+    return table
+
+def DPrime(data, target='t1', by=(), signal=SIGNAL, given_t1=False,
+           main_only=True):
+    """Hits, false alarms, d' and criterion for target ('t1' or 't2'), with
+    the trials on which it was signal as signal trials, for every
+    combination of by. With given_t1, only trials with T1 correct count.
+    """
+    mask = Scored(data, (target,), main_only)
+    if given_t1:
+        mask &= Column(data, 't1_acc') == 1
+    table, g, n_groups = GroupBy(data, list(by), mask)
+    is_signal = Column(data, target)[mask] == signal
+    correct = Column(data, target + '_acc')[mask] == 1
+    n_signal = np.bincount(g, weights=is_signal, minlength=n_groups)
+    n_noise = np.bincount(g, weights=~is_signal, minlength=n_groups)
+    hits = np.bincount(g, weights=is_signal & correct, minlength=n_groups)
+    crs = np.bincount(g, weights=~is_signal & correct, minlength=n_groups)
+    n = n_signal + n_noise
+    hr = Ratio(hits, n_signal)
+    cr = Ratio(crs, n_noise)
+    # as in 07-SDT.Rmd
+    with np.errstate(divide='ignore', invalid='ignore'):
+        floor = 1 / (2 * n)
+    hr_c = np.where(hr == 0, floor, np.where(hr == 1, 1 - floor, hr))
+    cr_c = np.where(cr == 0, floor, np.where(cr == 1, 1 - floor, cr))
+    table.update({
+        'n_signal': n_signal.astype(int),
+        'hits': hits.astype(int),
+        'n_noise': n_noise.astype(int),
+        'false_alarms': (n_noise - crs).astype(int),
+        'hit_rate': hr,
+        'fa_rate': 1 - cr,
+        'dprime': Z(hr_c) + Z(cr_c),
+        'criterion': -0.5 * (Z(hr_c) + Z(1 - cr_c))})
+    return table
+
+def SaveTable(table, filename):
+    names = list(table.keys())
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(names)
+        for row in zip(*[table[k] for k in names]):
+            writer.writerow([v.item() if hasattr(v, 'item') else v
+                             for v in row])
+
+def FormatValue(v):
+    if isinstance(v, (float, np.floating)):
+        return '-' if np.isnan(v) else '{:.3f}'.format(v)
+    return str(v)
+
+def FormatTable(table):
+    names = list(table.keys())
+    rows = [[FormatValue(v) for v in row]
+            for row in zip(*[table[k] for k in names])]
+    widths = [max([len(k)] + [len(r[i]) for r in rows])
+              for i, k in enumerate(names)]
+    lines = ['  '.join([k.rjust(w) for k, w in zip(names, widths)])]
+    for r in rows:
+        lines.append('  '.join([v.rjust(w) for v, w in zip(r, widths)]))
+    return '\n'.join(lines)
+
+def ExperimentColumns(data):
+    # the columns that tell experiments apart, if data has them
+    return ['exp'] if HasColumn(data, 'exp') else []
+
+def Report(data, lag='lag', main_only=True, signal=SIGNAL):
+    """Accuracy by lag, blink magnitude and d' over all the trials in data,
+    for each experiment, as text, leaving out whatever was not tested; empty
+    if nothing was
+    """
+    lines = []
+    by = ExperimentColumns(data)
+    accuracy = AccuracyByLag(data, by, lag, main_only)
+    if len(accuracy[lag]) > 0:
+        blink = BlinkMagnitude(accuracy, by, lag)
+        lines.append(FormatTable(accuracy))
+        if len(blink['blink']) == 1:
+            lines.append(
+                'blink magnitude (T2|T1 at lag {} - lag {}): {}'.format(
+                    blink['long_lag'][0], blink['short_lag'][0],
+                    FormatValue(blink['blink'][0])))
+        else:
+            lines.append('blink magnitude (T2|T1 at the longest lag - the '
+                         'shortest)')
+            lines.append(FormatTable(blink))
+    t1 = DPrime(data, 't1', by + ['t1_level'], signal, main_only=main_only)
+    t2 = DPrime(data, 't2', by + ['t2_level', lag], signal, given_t1=True,
+                main_only=main_only)
+    for name, t in (('T1', t1), ('T2|T1', t2)):
+        if len(t['dprime']) > 0:
+            del t['hit_rate'], t['fa_rate']
+            lines.append("{} d' ({} = signal)".format(name, signal))
+            lines.append(FormatTable(t))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from Aggregate import LoadAggregate
+    parser = argparse.ArgumentParser(
+        description="Attentional blink and d' measures of an aggregate")
+    parser.add_argument('aggregate', help='.npz or .parquet from Aggregate.py')
+    parser.add_argument('-o', '--output', default='blink',
+                        help='prefix of the CSV files')
+    parser.add_argument('--by', nargs='*', default=['sub'],
+                        help='columns to compute them separately for (always '
+                        'separately for each experiment too)')
+    parser.add_argument('--signal', default=SIGNAL)
+    args = parser.parse_args()
+
+    data = LoadAggregate(args.aggregate)
+    t0 = time.perf_counter()
+    by = [k for k in ExperimentColumns(data) if k not in args.by] + args.by
+    accuracy = AccuracyByLag(data, by)
+    tables = {
+        'accuracy': accuracy,
+        'blink': BlinkMagnitude(accuracy, by),
+        'dprime-t1': DPrime(data, 't1', by + ['t1_level', 't2_level', 'lag'],
+                            args.signal),
+        'dprime-t2': DPrime(data, 't2', by + ['lag'], args.signal,
+                            given_t1=True)}
+    elapsed = time.perf_counter() - t0
+    for name, table in tables.items():
+        SaveTable(table, '{}-{}.csv'.format(args.output, name))
+    print(Report(data, signal=args.signal))
+    print('{} trials, {} groups: computed in {:.3f} s, written to {}-*.csv'
+          .format(len(data), len(tables['blink'].get('blink', [])), elapsed,
+                  args.output))
@@ -0,0 +1,406 @@
+"""Frame-based timing for the RSVP local/global tasks.
+
+Durations are converted to whole numbers of video frames and displays are
+driven by counting win.flip() calls, which block until the vertical blank.
+Every flip is timestamped so dropped frames can be counted afterwards, and
+FlipLog keeps the flips of a whole session to check every timed display.
+TimingPlan holds the frame count of every duration and T1-T2 lag of a
+session, worked out once after the window opens.
+
+PrecisionWaiter is the wait primitive shared by the task scripts.  Run this
+file directly to benchmark it on the current machine:
+
+    python FrameTiming.py --margins 0 .001 .002 --n 2000
+"""
+
+import csv
+import time
+import numpy as np
+
+def FramesFor(duration, frame_period, minimum=1):
+    """Number of whole frames closest to duration (seconds)"""
+    return max(int(np.round(duration / frame_period)), minimum)
+
+class TimingPlan:
+    """Every duration of a session, and every T1-T2 lag its trials use, as
+    a whole number of frames of frame_period.
+
+    add() durations and addLag() lags by name (a lag is named by its value
+    in the conditions, e.g. 300 ms or 3 items), then check() that none that
+    was asked for came out as zero frames. plan[name] and lagFrames() are
+    the frame counts; seconds() and lagSeconds() the durations they give.
+    """
+    def __init__(self, frame_period):
+        self.frame_period = frame_period
+        self.rows = {}
+
+    def _add(self, key, duration, frames):
+        if frames == None:
+            frames = int(np.round(duration / self.frame_period))
+        self.rows[key] = (duration, int(frames))
+        return int(frames)
+
+    def add(self, name, duration, frames=None):
+        """Plan duration (s) as the nearest whole number of frames, or as
+        frames if given; returns the frame count
+        """
+        return self._add(name, duration, frames)
+
+    def addLag(self, lag, duration, frames=None):
+        return self._add(('lag', lag), duration, frames)
+
+    def __getitem__(self, name):
+        return self.rows[name][1]
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def seconds(self, name):
+        return self.rows[name][1] * self.frame_period
+
+    def lagFrames(self, lag):
+        return self.rows[('lag', lag)][1]
+
+    def lagSeconds(self, lag):
+        return self.rows[('lag', lag)][1] * self.frame_period
+
+    def wait(self, name, lead=0.75):
+        """Seconds to wait after the flip that starts name before drawing
+        the display after it: lead frames short of its duration, so the
+        next flip still makes the right vertical blank
+        """
+        return max(self.rows[name][1] - lead, 0) * self.frame_period
+
+    def frames(self):
+        """Frame count of every duration, by name"""
+        return {k: v[1] for k, v in self.rows.items()
+                if not isinstance(k, tuple)}
+
+    def check(self):
+        """Raise ValueError if a duration or lag that was asked for got no
+        frames
+        """
+        zero = [self.label(k) for k, (d, n) in self.rows.items()
+                if d > 0 and n < 1]
+        if len(zero) > 0:
+            s = ('shorter than half a frame ({:.1f} ms): {}'.format(
+                1000 * self.frame_period, ', '.join(zero)))
+            raise ValueError(s)
+
+    def label(self, key):
+        if isinstance(key, tuple):
+            return 'lag {}'.format(key[1])
+        return key
+
+    def summary(self):
+        """One row per duration and lag: asked for and realized, in ms"""
+        rows = []
+        for k, (d, n) in self.rows.items():
+            realized = n * self.frame_period
+            rows.append({'name': self.label(k), 'frames': n,
+                         'requested_ms': round(1000 * d, 3),
+                         'realized_ms': round(1000 * realized, 3),
+                         'error_ms': round(1000 * (realized - d), 3) + 0.0})
+        return rows
+
+    def saveSummary(self, filename):
+        rows = self.summary()
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, list(rows[0].keys()),
+                                    lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def report(self):
+        lines = ['timing plan at {:.3f} ms/frame'.format(
+            1000 * self.frame_period),
+            '{:<16} {:>7} {:>9} {:>9} {:>8}'.format(
+                'duration', 'frames', 'asked ms', 'real ms', 'error')]
+        for r in self.summary():
+            lines.append('{:<16} {:>7} {:>9.1f} {:>9.1f} {:>+8.1f}'.format(
+                r['name'], r['frames'], r['requested_ms'], r['realized_ms'],
+                r['error_ms']))
+        return '\n'.join(lines)
+
+def RunFrameSchedule(win, schedule, flip_log=None, end_event=None,
+                     end_frames=None):
+    """Present a schedule of (draw, n_frames) events, one after another.
+
+    draw is called before every flip of its event (None for a blank screen),
+    and the event stays up for exactly n_frames flips.  A final blank flip
+    ends the last event.  Returns the timestamp of every flip, so
+    timestamps[i] is the onset of frame i and the last entry is the offset
+    of the final event.
+
+    With a FlipLog, every flip is logged: events are named by an optional
+    third element, (draw, n_frames, name), and the final blank flip starts
+    end_event, meant to last end_frames.
+    """
+    n = sum(event[1] for event in schedule) + 1
+    timestamps = np.zeros(n)
+    i = 0
+    for event in schedule:
+        draw, n_frames = event[:2]
+        for f in range(n_frames):
+            if draw is not None:
+                draw()
+            timestamps[i] = win.flip()
+            if flip_log is not None:
+                if f == 0:
+                    name = event[2] if len(event) > 2 else 'frame'
+                    flip_log.record(timestamps[i], name, n_frames)
+                else:
+                    flip_log.record(timestamps[i])
+            i += 1
+    timestamps[i] = win.flip()
+    if flip_log is not None:
+        flip_log.record(timestamps[i], end_event or 'end', end_frames)
+    return timestamps
+
+def EventOnsetFrames(schedule):
+    """Index into the RunFrameSchedule() timestamps of each event's onset"""
+    frames = [event[1] for event in schedule]
+    return np.concatenate([[0], np.cumsum(frames)[:-1]]).astype(int)
+
+def MissedFrames(timestamps, frame_period):
+    """Number of vertical blanks missed between consecutive flips"""
+    if len(timestamps) < 2:
+        return 0
+    n = np.round(np.diff(timestamps) / frame_period) - 1
+    return int(np.sum(np.maximum(n, 0)))
+
+class FlipLog:
+    """Timestamps of every flip of a session, in preallocated ring buffers.
+
+    Each flip either starts a new event (a cue, a mask, a blank, ...) with
+    the number of frames it is meant to stay up, or continues the current
+    event (frame-by-frame displays). frames=None marks an event with no
+    intended duration, such as a prompt waiting for a key. An event ends at
+    the first flip of the next one, so it can only be checked after that.
+
+    endTrial() checks the events that have ended since it was last called:
+    the actual number of frames each stayed up against the intended number.
+    It returns the trial's timing_* data columns: the number of timed events,
+    how many were off by a frame or more, the frames they ran over and the
+    largest timing error (s). Every event also goes into the session summary,
+    by event name. The last event of a trial ends during the next trial, so
+    it only counts towards the summary; call endTrial() once more at the end
+    of the session to include the last trial's.
+    """
+
+    def __init__(self, frame_period, capacity=65536, max_events=16384):
+        self.frame_period = frame_period
+        self.times = np.zeros(capacity)
+        self.ev_trial = np.zeros(max_events, dtype=np.int32)
+        self.ev_name = np.zeros(max_events, dtype=np.int32)
+        self.ev_frames = np.zeros(max_events, dtype=np.int32)
+        self.ev_first_flip = np.zeros(max_events, dtype=np.int64)
+        self.names = []
+        self.name_index = {}
+        self.trial = 0
+        self.n_flips = 0
+        self.n_events = 0
+        self.n_checked = 0
+        self.n_lost = 0
+        self.summary = {}
+
+    def startTrial(self, trial):
+        self.trial = trial
+
+    def flip(self, win, event=None, frames=None):
+        """win.flip(), logged; returns the flip time"""
+        t = win.flip()
+        self.record(t, event, frames)
+        return t
+
+    def record(self, t, event=None, frames=None):
+        if event is not None or self.n_events == 0:
+            if event not in self.name_index:
+                self.name_index[event] = len(self.names)
+                self.names.append(event)
+            e = self.n_events % len(self.ev_trial)
+            self.ev_trial[e] = self.trial
+            self.ev_name[e] = self.name_index[event]
+            self.ev_frames[e] = -1 if frames is None else frames
+            self.ev_first_flip[e] = self.n_flips
+            self.n_events += 1
+        self.times[self.n_flips % len(self.times)] = t
+        self.n_flips += 1
+
+    def endTrial(self):
+        n_events = 0
+        n_off = 0
+        dropped = 0
+        max_error = 0.0
+        n_ev = len(self.ev_trial)
+        n_times = len(self.times)
+        # events that have not been overwritten and have ended
+        first = max(self.n_checked, self.n_events - n_ev)
+        for k in range(first, self.n_events - 1):
+            e = k % n_ev
+            onset = self.ev_first_flip[e]
+            offset = self.ev_first_flip[(k + 1) % n_ev]
+            if self.n_flips - onset > n_times:
+                self.n_lost += 1
+                continue
+            intended = self.ev_frames[e]
+            if intended < 0:
+                continue
+            duration = (self.times[offset % n_times] -
+                        self.times[onset % n_times])
+            actual = int(np.round(duration / self.frame_period))
+            name = self.names[self.ev_name[e]]
+            s = self.summary.setdefault(name, {
+                'n': 0, 'intended': set(), 'exact': 0, 'long': 0, 'short': 0,
+                'dropped_frames': 0, 'duration': 0.0, 'max_error': 0.0})
+            error = duration - intended * self.frame_period
+            s['n'] += 1
+            s['intended'].add(int(intended))
+            s['duration'] += duration
+            s['max_error'] = max(s['max_error'], abs(error))
+            if actual == intended:
+                s['exact'] += 1
+            elif actual > intended:
+                s['long'] += 1
+                s['dropped_frames'] += actual - intended
+            else:
+                s['short'] += 1
+            if self.ev_trial[e] == self.trial:
+                n_events += 1
+                if actual != intended:
+                    n_off += 1
+                dropped += max(actual - intended, 0)
+                max_error = max(max_error, abs(error))
+        self.n_checked = max(self.n_events - 1, 0)
+        return {
+            'timing_events': n_events,
+            'timing_events_off': n_off,
+            'timing_dropped_frames': dropped,
+            'timing_max_error': max_error}
+
+    def summaryRows(self):
+        """Session summary, one dict per event name"""
+        rows = []
+        for name, s in self.summary.items():
+            intended = sorted(s['intended'])
+            rows.append({
+                'event': name,
+                'n': s['n'],
+                'intended_frames': ' '.join([str(x) for x in intended]),
+                'exact': s['exact'],
+                'long': s['long'],
+                'short': s['short'],
+                'dropped_frames': s['dropped_frames'],
+                'mean_duration_ms': 1000 * s['duration'] / s['n'],
+                'max_error_ms': 1000 * s['max_error'],
+                'frame_period_ms': 1000 * self.frame_period})
+        return rows
+
+    def report(self):
+        lines = ['{:<16} {:>6} {:>9} {:>6} {:>6} {:>6} {:>8} {:>9}'.format(
+            'event', 'n', 'frames', 'exact', 'long', 'short', 'mean ms',
+            'max err')]
+        for r in self.summaryRows():
+            lines.append(
+                '{:<16} {:>6} {:>9} {:>6} {:>6} {:>6} {:>8.1f} {:>9.1f}'.format(
+                    r['event'], r['n'], r['intended_frames'], r['exact'],
+                    r['long'], r['short'], r['mean_duration_ms'],
+                    r['max_error_ms']))
+        if self.n_lost > 0:
+            lines.append('{} events were overwritten before they were '
+                         'checked'.format(self.n_lost))
+        return '\n'.join(lines)
+
+    def saveSummary(self, filename):
+        rows = self.summaryRows()
+        if len(rows) == 0:
+            return
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, rows[0].keys(), lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(rows)
+
+class PrecisionWaiter:
+    """Hybrid sleep/spin wait.
+
+    waitUntil(t) sleeps until margin seconds before t, which is cheap but
+    only as precise as the OS scheduler, and then spins on get_time() for
+    the rest.  get_time must be the clock t is expressed in (e.g.
+    psychopy.clock.getTime).  Times returned by win.flip() are not on that
+    clock: PsychoPy's monotonic clock counts from the psychopy import, the
+    raw clock from boot, so a deadline computed from a flip time has
+    already passed.  With max_late set, waitUntil() raises a ValueError for
+    a deadline more than max_late seconds in the past, which in a benchmark
+    can only come from such a mix; leave it unset in a task, where a stall
+    must not end the session.  Returns how late it woke, in seconds.
+    """
+    def __init__(self, get_time=time.perf_counter, margin=0.002,
+                 sleep=time.sleep, max_late=None):
+        self.get_time = get_time
+        self.margin = margin
+        self.sleep = sleep
+        self.max_late = max_late
+        self.last_late = 0.0
+
+    def waitUntil(self, t):
+        remaining = t - self.get_time()
+        if self.max_late != None and remaining < -self.max_late:
+            s = ('deadline {:.3f} s is {:.1f} s in the past: is it on '
+                 'another clock than get_time (e.g. a win.flip() '
+                 'time)?'.format(t, -remaining))
+            raise ValueError(s)
+        if remaining > self.margin:
+            self.sleep(remaining - self.margin)
+        now = self.get_time()
+        while now < t:
+            now = self.get_time()
+        self.last_late = now - t
+        return self.last_late
+
+    def wait(self, duration):
+        return self.waitUntil(self.get_time() + duration)
+
+def BenchmarkWaiter(waiter, n=1000, min_wait=0.001, max_wait=0.050,
+                    rng=None):
+    """Wait n times for random intervals and return the overshoot of each"""
+    if rng is None:
+        rng = np.random.default_rng()
+    intervals = rng.uniform(min_wait, max_wait, n)
+    late = np.zeros(n)
+    for i in range(n):
+        late[i] = waiter.waitUntil(waiter.get_time() + intervals[i])
+    return late
+
+def TextHistogram(x, bins=20, width=50, scale=1000, unit='ms'):
+    """Render a histogram of x as lines of text"""
+    counts, edges = np.histogram(x * scale, bins=bins)
+    peak = max(counts.max(), 1)
+    lines = []
+    for c, lo, hi in zip(counts, edges[:-1], edges[1:]):
+        bar = '#' * int(np.ceil(width * c / peak))
+        lines.append('{:8.3f}-{:8.3f} {} {:6d} {}'.format(
+            lo, hi, unit, c, bar))
+    return '\n'.join(lines)
+
+def SummarizeOvershoot(late, scale=1000):
+    p = np.percentile(late * scale, [50, 95, 99])
+    return 'median {:.3f}, p95 {:.3f}, p99 {:.3f}, max {:.3f} ms'.format(
+        p[0], p[1], p[2], np.max(late) * scale)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark the sleep/spin precision waiter')
+    parser.add_argument('--margins', type=float, nargs='+',
+                        default=[0, 0.001, 0.002, 0.004],
+                        help='spin margins to compare (seconds)')
+    parser.add_argument('--n', type=int, default=1000,
+                        help='number of waits per margin')
+    parser.add_argument('--bins', type=int, default=20)
+    args = parser.parse_args()
+    for margin in args.margins:
+        late = BenchmarkWaiter(PrecisionWaiter(margin=margin), args.n)
+        print('margin = {:.1f} ms: {}'.format(
+            margin * 1000, SummarizeOvershoot(late)))
+        print(TextHistogram(late, args.bins))
+        print()
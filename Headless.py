@@ -0,0 +1,412 @@
+"""Headless mode for the RSVP local/global tasks.
+
+Install() puts minimal stand-ins for the parts of PsychoPy the task scripts
+use into sys.modules, so the scripts run unchanged without a display (or
+PsychoPy): an offscreen window whose flip() waits for a synthetic vertical
+blank, a simulated clock, a dialog that answers itself and a keyboard that
+responds like a participant. Run a script with --headless:
+
+    python TutuLG.py --headless --dialog "Block Type=Experiment" --speed 0
+
+Time is simulated: --speed 0 (the default) runs as fast as possible, 1 runs
+in real time, 10 runs ten times faster than real time. As in PsychoPy,
+win.flip() times count from the psychopy import while core.getTime() and
+clock.getTime() run --clock-offset seconds ahead (PsychoPy's raw clock
+counts from boot), so code that mixes the two fails here too. At exit every
+FlipLog is checked: with no dropped frames no timed display may end early,
+or the run exits with status 1. The scripts read
+images only through PsychoPy, so placeholder files are enough for headless
+runs; create them with
+
+    python Headless.py --placeholder-stimuli stim
+"""
+
+import argparse
+import atexit
+import itertools
+import os
+import socket
+import string
+import sys
+import time
+import types
+
+import numpy as np
+
+########################################################################
+# Simulated time
+########################################################################
+
+class SimClock:
+    """Simulated time, in seconds since Install(): the time base of
+    win.flip(). GetTime() adds sim.clock_offset to it.
+
+    Time moves forward when something waits (wait(), win.flip(), waitKeys())
+    and by read_cost on every read, so loops that spin on the clock finish.
+    With speed > 0, advancing also sleeps for real, speed times faster than
+    the simulated time.
+    """
+    def __init__(self, speed=0, read_cost=1e-6):
+        self.t = 0.0
+        self.speed = speed
+        self.read_cost = read_cost
+
+    def getTime(self):
+        self.t += self.read_cost
+        return self.t
+
+    def advance(self, dt):
+        if dt <= 0:
+            return
+        self.t += dt
+        if self.speed > 0:
+            time.sleep(dt / self.speed)
+
+    def advanceTo(self, t):
+        self.advance(t - self.t)
+
+class Clock:
+    """Stand-in for psychopy.core.Clock on the simulated time"""
+    def __init__(self):
+        self.t0 = sim.clock.t
+
+    def getTime(self):
+        return sim.clock.getTime() - self.t0
+
+    def reset(self, newT=0.0):
+        self.t0 = sim.clock.t + newT
+
+    def addTime(self, t):
+        self.t0 += t
+
+def GetTime():
+    return sim.clock.getTime() + sim.clock_offset
+
+def Wait(secs, hogCPUperiod=0.2):
+    sim.clock.advance(secs)
+
+def Quit():
+    for w in sim.windows:
+        w.close()
+    sys.exit(0)
+
+########################################################################
+# Window and stimuli
+########################################################################
+
+class NullWindow:
+    """Offscreen window: drawing does nothing, flip() waits for the next
+    synthetic vertical blank and returns its time. With drop_rate > 0 a flip
+    occasionally misses a blank, as a busy machine would.
+    """
+    def __init__(self, size=(800, 600), *args, **kwargs):
+        self.size = size
+        self.monitorFramePeriod = sim.frame_period
+        self.units = kwargs.get('units', 'pix')
+        self.color = kwargs.get('color')
+        self.mouseVisible = True
+        self.recordFrameIntervals = False
+        self.n_flips = 0
+        self.n_draws = 0
+        self.n_dropped = 0
+        self.last_vsync = 0
+        self.on_flip = []
+        self.closed = False
+        sim.windows.append(self)
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self.on_flip.append((function, args, kwargs))
+
+    def flip(self, clearBuffer=True):
+        # the next vertical blank, counted in whole frames so that rounding
+        # never puts two flips on the same one. The display's own period,
+        # whatever the script sets monitorFramePeriod to
+        period = sim.frame_period
+        n = max(int(np.floor(sim.clock.t / period + 1e-6)) + 1,
+                self.last_vsync + 1)
+        if sim.drop_rate > 0 and sim.rng.random() < sim.drop_rate:
+            n += 1
+            self.n_dropped += 1
+        self.last_vsync = n
+        t = n * period
+        sim.clock.advanceTo(t)
+        self.n_flips += 1
+        for function, args, kwargs in self.on_flip:
+            function(*args, **kwargs)
+        self.on_flip = []
+        return t
+
+    def clearBuffer(self, color=True, depth=False, stencil=False):
+        pass
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return 1 / sim.frame_period
+
+    def close(self):
+        self.closed = True
+
+class NullStim:
+    """Accepts any stimulus arguments; draw() and set*() do nothing"""
+    def __init__(self, win=None, *args, **kwargs):
+        self.win = win
+        self.autoDraw = False
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        w = win if win is not None else self.win
+        if w is not None:
+            w.n_draws += 1
+
+    def setText(self, text, log=None):
+        self.text = text
+
+    def setImage(self, image, log=None):
+        self.image = image
+
+    def setAutoDraw(self, value, log=None):
+        self.autoDraw = value
+
+    def __getattr__(self, name):
+        if name.startswith('set'):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+########################################################################
+# Dialog and keyboard
+########################################################################
+
+class DlgFromDict:
+    """Fills in the dialog from the --dialog answers: the first choice for
+    lists, and made-up participant details for empty fields
+    """
+    def __init__(self, dictionary, title='', fixed=None, order=None, **kwargs):
+        defaults = {'Participant': '999', 'Experimenter Initials': 'HL'}
+        for k, v in dictionary.items():
+            if k in sim.dialog:
+                dictionary[k] = sim.dialog[k]
+            elif type(v) in (list, tuple):
+                dictionary[k] = v[0]
+            elif v == '' and k in defaults:
+                dictionary[k] = defaults[k]
+        self.data = list(dictionary.values())
+        self.OK = True
+
+class KeyPress:
+    def __init__(self, name, rt, tDown):
+        self.name = name
+        self.value = name
+        self.rt = rt
+        self.tDown = tDown
+        self.duration = None
+
+class Keyboard:
+    """Responds like a participant: after a random response time it presses
+    a random key from keyList (never the quit key). With no keyList it
+    presses space, unless nothing has been shown since its last press,
+    which only happens on a screen that needs the quit key to go on.
+
+    Polled with getKeys(keyList), it keeps pressing keys from keyList, each
+    a random response time after the last one (or after clearEvents()), and
+    returns the ones whose time has come.
+
+    As with PsychoPy's ptb backend, KeyPress.rt is on self.clock and
+    KeyPress.tDown counts from when the keyboard was created, on neither
+    the flip times' clock nor GetTime()'s.
+    """
+    def __init__(self, *args, **kwargs):
+        self.clock = Clock()
+        self.t_created = sim.clock.t
+        self.last_flips = None
+        self.next_press = None
+
+    def _nFlips(self):
+        return sum([w.n_flips for w in sim.windows])
+
+    def _press(self, name, rt):
+        sim.clock.advance(rt)
+        self.last_flips = self._nFlips()
+        sim.n_keys += 1
+        return [KeyPress(name, self.clock.getTime(),
+                         sim.clock.t - self.t_created)]
+
+    def waitKeys(self, maxWait=float('inf'), keyList=None, waitRelease=True,
+                 clear=True, **kwargs):
+        rt = sim.rng.uniform(*sim.rt_range)
+        if rt > maxWait:
+            sim.clock.advance(maxWait)
+            return None
+        if keyList is None:
+            if self.last_flips == self._nFlips():
+                return self._press(sim.quit_key, rt)
+            return self._press('space', rt)
+        choices = [k for k in keyList if k != sim.quit_key]
+        return self._press(sim.rng.choice(choices), rt)
+
+    def getKeys(self, keyList=None, waitRelease=True, clear=True, **kwargs):
+        if keyList is None:
+            return []
+        choices = [k for k in keyList if k != sim.quit_key]
+        if len(choices) == 0:
+            return []
+        if self.next_press is None:
+            self.next_press = sim.clock.t + sim.rng.uniform(*sim.rt_range)
+        keys = []
+        while self.next_press <= sim.clock.t:
+            t = self.next_press
+            sim.n_keys += 1
+            keys.append(KeyPress(str(sim.rng.choice(choices)),
+                                 t - self.clock.t0, t - self.t_created))
+            self.next_press = t + sim.rng.uniform(*sim.rt_range)
+        return keys
+
+    def clearEvents(self, eventType=None):
+        self.next_press = sim.clock.t + sim.rng.uniform(*sim.rt_range)
+
+########################################################################
+# Installation
+########################################################################
+
+sim = types.SimpleNamespace()
+
+def GetDateStr(format='%Y-%m-%d_%Hh%M.%S.%f', fractionalSecondDigits=3):
+    s = time.strftime(format.replace('%f', '{f}'))
+    f = '{:06d}'.format(int((time.time() % 1) * 1e6))
+    return s.format(f=f[:fractionalSecondDigits])
+
+def RunTimeInfo(*args, **kwargs):
+    return {'systemHostName': socket.gethostname()}
+
+def ImportConditions(fileName, selection=''):
+    from TrialPlan import ReadConditions
+    return ReadConditions(fileName)
+
+def _Module(name, **attrs):
+    m = types.ModuleType(name)
+    m.__dict__.update(attrs)
+    sys.modules[name] = m
+    return m
+
+def ParseArgs(argv):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--frame-period', type=float, default=1 / 60,
+                        help='simulated refresh period (s)')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='0 = as fast as possible, 1 = real time')
+    parser.add_argument('--drop-rate', type=float, default=0,
+                        help='probability that a flip misses a frame')
+    parser.add_argument('--clock-offset', type=float, default=1000,
+                        help='how far core.getTime() runs ahead of the '
+                        'win.flip() times (s)')
+    parser.add_argument('--rt', type=float, nargs=2, default=[0.3, 0.9],
+                        help='range of simulated response times (s)')
+    parser.add_argument('--dialog', action='append', default=[],
+                        metavar='FIELD=VALUE', help='dialog box answer')
+    parser.add_argument('--headless-seed', type=int)
+    args, unknown = parser.parse_known_args(argv)
+    return args
+
+def Install(argv=None, quit_key='escape'):
+    """Replace PsychoPy with the headless stand-ins. Must be called before
+    the script imports psychopy. Options are read from argv (see ParseArgs).
+    """
+    args = ParseArgs(sys.argv[1:] if argv is None else argv)
+    sim.clock = SimClock(args.speed)
+    sim.clock_offset = args.clock_offset
+    sim.frame_period = args.frame_period
+    sim.drop_rate = args.drop_rate
+    sim.rt_range = args.rt
+    sim.dialog = dict([a.split('=', 1) for a in args.dialog])
+    sim.rng = np.random.default_rng(args.headless_seed)
+    sim.quit_key = quit_key
+    sim.windows = []
+    sim.n_keys = 0
+    sim.flip_logs = []
+    sim.t_start = time.perf_counter()
+
+    psychopy = _Module('psychopy', __version__='headless',
+                       useVersion=lambda *args, **kwargs: None)
+    psychopy.core = _Module('psychopy.core', Clock=Clock, MonotonicClock=Clock,
+                            getTime=GetTime, wait=Wait, quit=Quit)
+    psychopy.clock = _Module('psychopy.clock', Clock=Clock,
+                             MonotonicClock=Clock, getTime=GetTime, wait=Wait)
+    psychopy.visual = _Module(
+        'psychopy.visual', Window=NullWindow, ImageStim=NullStim,
+        GratingStim=NullStim, TextStim=NullStim, TextBox2=NullStim,
+        Rect=NullStim, Line=NullStim, Circle=NullStim, ShapeStim=NullStim)
+    psychopy.data = _Module('psychopy.data', getDateStr=GetDateStr,
+                            importConditions=ImportConditions)
+    psychopy.gui = _Module('psychopy.gui', DlgFromDict=DlgFromDict)
+    psychopy.info = _Module('psychopy.info', RunTimeInfo=RunTimeInfo)
+    psychopy.hardware = _Module('psychopy.hardware')
+    psychopy.hardware.keyboard = _Module('psychopy.hardware.keyboard',
+                                         Keyboard=Keyboard, KeyPress=KeyPress)
+    WatchFlipLogs()
+    atexit.register(Report)
+
+def WatchFlipLogs():
+    # keep every FlipLog the script creates, for CheckTiming()
+    import FrameTiming
+    init = FrameTiming.FlipLog.__init__
+    def __init__(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        sim.flip_logs.append(self)
+    FrameTiming.FlipLog.__init__ = __init__
+
+def CheckTiming():
+    """The timed displays that ended early, as 'event (n)' strings. Flips
+    only ever come late here, so with no dropped frames a display can only
+    end early if the script waited on the wrong clock.
+    """
+    short = {}
+    for log in sim.flip_logs:
+        for name, s in log.summary.items():
+            if s['short'] > 0:
+                short[name] = short.get(name, 0) + s['short']
+    return ['{} ({})'.format(k, v) for k, v in short.items()]
+
+def Report():
+    real = time.perf_counter() - sim.t_start
+    flips = sum([w.n_flips for w in sim.windows])
+    dropped = sum([w.n_dropped for w in sim.windows])
+    print('headless: {} flips ({} dropped), {} key presses, {:.1f} s '
+          'simulated in {:.2f} s real ({:.0f}x)'.format(
+              flips, dropped, sim.n_keys, sim.clock.t, real,
+              sim.clock.t / max(real, 1e-9)))
+    short = CheckTiming()
+    if sim.drop_rate == 0 and len(short) > 0:
+        print('headless: FAILED, displays ended early: {}'.format(
+            ', '.join(short)))
+        sys.stdout.flush()
+        os._exit(1)
+
+########################################################################
+# Placeholder stimuli
+########################################################################
+
+def MakePlaceholderStimuli(stim_dir, colors=('black', 'white'), n_masks=4,
+                           ext='png'):
+    """Create empty files under every stimulus name the tasks use:
+    {global}-{local}-{color} (RSVPLG), {global}-{local} and mask-{n}
+    (TutuLG)
+    """
+    if not os.path.isdir(stim_dir):
+        os.makedirs(stim_dir)
+    names = []
+    for g, l in itertools.product(string.ascii_uppercase, repeat=2):
+        names.append('{}-{}'.format(g, l))
+        names.extend(['{}-{}-{}'.format(g, l, c) for c in colors])
+    names.extend(['mask-{}'.format(i + 1) for i in range(n_masks)])
+    for name in names:
+        filename = os.path.join(stim_dir, '{}.{}'.format(name, ext))
+        if not os.path.exists(filename):
+            open(filename, 'w').close()
+    return len(names)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless mode utilities')
+    parser.add_argument('--placeholder-stimuli', metavar='DIR', required=True,
+                        help='create empty stimulus files in DIR')
+    args = parser.parse_args()
+    n = MakePlaceholderStimuli(args.placeholder_stimuli)
+    print('{} placeholder stimuli in {}'.format(n, args.placeholder_stimuli))
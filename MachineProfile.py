@@ -0,0 +1,150 @@
+"""Per-computer display settings for the RSVP local/global tasks.
+
+Each testing computer has a profile, machines/<hostname>.json, with its
+screen resolution, its frame period measured over many flips (with a 95%
+confidence interval) and, optionally, the results of TimingTest.py. The
+task scripts load it at startup instead of identifying the computer from
+its name and estimating the refresh rate every time they open a window;
+a short check of the frame period against the stored one catches a monitor
+that has been changed or set to a different refresh rate.
+
+Make or update the profile of the current computer with a one-time
+calibration run, repeated whenever its display changes:
+
+    python MachineProfile.py
+    python TimingTest.py --save-profile
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from Startup import HostName
+
+PROFILE_DIR = 'machines'
+
+def ProfileFileName(host=None, profile_dir=PROFILE_DIR):
+    if host == None:
+        host = HostName()
+    return os.path.join(profile_dir, '{}.json'.format(host))
+
+def LoadProfile(host=None, profile_dir=PROFILE_DIR):
+    """The profile of host (default: this computer), or None if it has not
+    been calibrated
+    """
+    filename = ProfileFileName(host, profile_dir)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r') as f:
+        profile = json.load(f)
+    for k in ('resolution', 'frame_period'):
+        if k not in profile:
+            s = "machine profile {} has no '{}'".format(filename, k)
+            raise ValueError(s)
+    return profile
+
+def SaveProfile(profile, profile_dir=PROFILE_DIR):
+    filename = ProfileFileName(profile['host'], profile_dir)
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=1)
+    return filename
+
+def FramePeriodFromFlips(timestamps):
+    """Frame period estimated from flip times, as (period, standard error,
+    number of vertical blanks missed).
+
+    Each flip is assigned the vertical blank it landed on, counting missed
+    ones, and the period is the slope of flip time against blank number, so
+    dropped frames do not bias it.
+    """
+    intervals = np.diff(timestamps)
+    frames = np.maximum(np.round(intervals / np.median(intervals)), 1)
+    k = np.concatenate([[0], np.cumsum(frames)])
+    slope, intercept = np.polyfit(k, timestamps, 1)
+    residuals = timestamps - (slope * k + intercept)
+    se = np.sqrt(np.sum(residuals ** 2) / max(len(k) - 2, 1) /
+                 np.sum((k - np.mean(k)) ** 2))
+    return float(slope), float(se), int(np.sum(frames - 1))
+
+def FlipTimes(win, n_frames):
+    timestamps = np.zeros(n_frames)
+    for i in range(n_frames):
+        timestamps[i] = win.flip()
+    return timestamps
+
+def MeasureFramePeriod(win, n_frames=1200, n_warmup=60):
+    """Flip a blank window n_frames times (after n_warmup untimed flips)
+    and return the frame period with its 95% confidence interval
+    """
+    FlipTimes(win, n_warmup)
+    period, se, missed = FramePeriodFromFlips(FlipTimes(win, n_frames))
+    return {
+        'frame_period': period,
+        'frame_period_ci': [period - 1.96 * se, period + 1.96 * se],
+        'refresh_rate': 1 / period,
+        'n_frames': n_frames,
+        'missed_frames': missed}
+
+def CheckFramePeriod(win, profile, n_frames=30, tolerance=0.02):
+    """Measure the frame period briefly and compare it to the profile's.
+    Returns None if they agree within tolerance (a proportion), or else
+    the measured period.
+    """
+    period, se, missed = FramePeriodFromFlips(FlipTimes(win, n_frames))
+    stored = profile['frame_period']
+    if abs(period - stored) > tolerance * stored:
+        return period
+    return None
+
+def FramePeriodChangedMessage(measured, profile):
+    return ('Refresh rate is {:.2f} Hz, but this computer was calibrated '
+            'at {:.2f} Hz; run python MachineProfile.py to recalibrate'.format(
+                1 / measured, 1 / profile['frame_period']))
+
+if __name__ == '__main__':
+    import sys
+    if '--headless' in sys.argv:
+        # simulated window and clock instead of PsychoPy (Headless.py)
+        import Headless
+        Headless.Install()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Calibrate this computer's display and save its profile")
+    parser.add_argument('--n-frames', type=int, default=1200,
+                        help='number of flips to time')
+    parser.add_argument('--size', type=int, nargs=2,
+                        help='screen resolution (default: as the full-screen '
+                        'window opens)')
+    parser.add_argument('--profile-dir', default=PROFILE_DIR)
+    args, unknown_args = parser.parse_known_args()
+
+    import psychopy
+    from psychopy import visual
+    win = visual.Window(
+        size=args.size or [1920, 1080], fullscr=True, screen=0,
+        winType='pyglet', allowStencil=False, monitor='Default',
+        color=[0, 0, 0], colorSpace='rgb255', useFBO=True, units='pix',
+        checkTiming=False)
+    win.mouseVisible = False
+    measured = MeasureFramePeriod(win, args.n_frames)
+    win.close()
+
+    # recalibrating keeps the benchmark results until TimingTest.py is run
+    # again
+    host = HostName()
+    profile = LoadProfile(host, args.profile_dir) or {}
+    profile.update({
+        'host': host,
+        'calibrated': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'psychopy': psychopy.__version__,
+        'resolution': [int(x) for x in (args.size or win.size)]})
+    profile.update(measured)
+    filename = SaveProfile(profile, args.profile_dir)
+    print('{}: {} x {}, {:.4f} Hz (95% CI {:.4f}-{:.4f}), {} missed frames'
+          .format(filename, profile['resolution'][0], profile['resolution'][1],
+                  profile['refresh_rate'], 1 / profile['frame_period_ci'][1],
+                  1 / profile['frame_period_ci'][0], profile['missed_frames']))
@@ -0,0 +1,163 @@
+"""Per-stage timing of the trial loop of the RSVP local/global tasks.
+
+StageProfiler records the wall-clock and CPU time of every run of each
+stage of a trial into fixed-bucket histograms, so profiling a session costs
+a few array increments per stage and no allocation. At the end it reports
+the median, 95th and 99th percentiles per stage. The task scripts enable it
+with --profile; otherwise they use NullProfiler, whose methods do nothing.
+
+Stages are timed either by wrapping a function (wrap) or by marking where
+inline sections begin (begin/end).
+"""
+
+import csv
+import math
+import time
+
+import numpy as np
+
+class StageProfiler:
+    """Wall and CPU time histograms per stage.
+
+    Buckets are logarithmic, buckets_per_decade per factor of 10 from
+    min_time to max_time seconds, so percentiles are accurate to about
+    12% with the default 20 per decade. Counts, totals and maxima are exact.
+    CPU time is that of the calling thread (the trial loop), so it leaves
+    out the background data writer.
+    """
+    def __init__(self, min_time=1e-6, max_time=100, buckets_per_decade=20):
+        n = int(np.round(np.log10(max_time / min_time) * buckets_per_decade))
+        self.edges = np.logspace(np.log10(min_time), np.log10(max_time), n + 1)
+        self.log_min = np.log10(min_time)
+        self.buckets_per_decade = buckets_per_decade
+        self.stages = {}
+        self.current = None
+        self.t0 = 0.0
+        self.c0 = 0.0
+
+    def _stage(self, name):
+        if name not in self.stages:
+            n = len(self.edges) + 1
+            self.stages[name] = {
+                'wall': np.zeros(n, dtype=np.int64),
+                'cpu': np.zeros(n, dtype=np.int64),
+                'n': 0, 'wall_total': 0.0, 'cpu_total': 0.0,
+                'wall_max': 0.0, 'cpu_max': 0.0}
+        return self.stages[name]
+
+    def _bucket(self, t):
+        # bucket 0 is below min_time, the last one above max_time
+        if t <= 0:
+            return 0
+        i = math.floor((math.log10(t) - self.log_min) *
+                       self.buckets_per_decade) + 1
+        return min(max(i, 0), len(self.edges))
+
+    def add(self, name, wall, cpu):
+        s = self._stage(name)
+        s['wall'][self._bucket(wall)] += 1
+        s['cpu'][self._bucket(cpu)] += 1
+        s['n'] += 1
+        s['wall_total'] += wall
+        s['cpu_total'] += cpu
+        if wall > s['wall_max']:
+            s['wall_max'] = wall
+        if cpu > s['cpu_max']:
+            s['cpu_max'] = cpu
+
+    def begin(self, name):
+        """End the current inline stage, if any, and start name"""
+        t = time.perf_counter()
+        c = time.thread_time()
+        if self.current is not None:
+            self.add(self.current, t - self.t0, c - self.c0)
+        self.current = name
+        self.t0 = t
+        self.c0 = c
+
+    def end(self):
+        if self.current is not None:
+            self.add(self.current, time.perf_counter() - self.t0,
+                     time.thread_time() - self.c0)
+            self.current = None
+
+    def wrap(self, func, name=None):
+        """func, timed as stage name (default: its own name) on every call"""
+        if name is None:
+            name = func.__name__
+        def profiled(*args, **kwargs):
+            t0 = time.perf_counter()
+            c0 = time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - t0,
+                         time.thread_time() - c0)
+        profiled.__name__ = func.__name__
+        profiled.__doc__ = func.__doc__
+        return profiled
+
+    def percentiles(self, counts, q=(50, 95, 99)):
+        """Upper bucket edges at the given percentiles of a histogram"""
+        cum = np.cumsum(counts)
+        edges = np.concatenate([self.edges, [np.inf]])
+        result = []
+        for p in q:
+            i = int(np.searchsorted(cum, p / 100 * cum[-1]))
+            result.append(edges[min(i, len(edges) - 1)])
+        return result
+
+    def summaryRows(self):
+        rows = []
+        for name, s in self.stages.items():
+            # a bucket's upper edge can be beyond the largest time in it
+            w = [min(x, s['wall_max']) for x in self.percentiles(s['wall'])]
+            c = [min(x, s['cpu_max']) for x in self.percentiles(s['cpu'])]
+            rows.append({
+                'stage': name, 'n': s['n'],
+                'wall_p50_ms': 1000 * w[0], 'wall_p95_ms': 1000 * w[1],
+                'wall_p99_ms': 1000 * w[2], 'wall_max_ms': 1000 * s['wall_max'],
+                'wall_total_s': s['wall_total'],
+                'cpu_p50_ms': 1000 * c[0], 'cpu_p95_ms': 1000 * c[1],
+                'cpu_p99_ms': 1000 * c[2], 'cpu_max_ms': 1000 * s['cpu_max'],
+                'cpu_total_s': s['cpu_total']})
+        return rows
+
+    def report(self):
+        lines = ['{:<26} {:>5} | {:>8} {:>8} {:>8} {:>8} | {:>8} {:>8} '
+                 '{:>8}'.format('stage (ms)', 'n', 'wall p50', 'p95', 'p99',
+                                'max', 'cpu p50', 'p95', 'p99')]
+        for r in self.summaryRows():
+            lines.append(
+                '{:<26} {:>5} | {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} | '
+                '{:>8.2f} {:>8.2f} {:>8.2f}'.format(
+                    r['stage'], r['n'], r['wall_p50_ms'], r['wall_p95_ms'],
+                    r['wall_p99_ms'], r['wall_max_ms'], r['cpu_p50_ms'],
+                    r['cpu_p95_ms'], r['cpu_p99_ms']))
+        return '\n'.join(lines)
+
+    def saveSummary(self, filename):
+        rows = self.summaryRows()
+        if len(rows) == 0:
+            return
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, rows[0].keys(), lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(rows)
+
+class NullProfiler:
+    """Stand-in for StageProfiler when profiling is off"""
+    def begin(self, name):
+        pass
+
+    def end(self):
+        pass
+
+    def wrap(self, func, name=None):
+        return func
+
+    def report(self):
+        return ''
+
+    def saveSummary(self, filename):
+        pass
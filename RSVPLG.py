@@ -28,7 +28,9 @@ color_space = 'rgb255'
 cue_color = 'white'
 font = 'Arial'
 font_size = 24
-rsvp_loop_granularity = .001 # break during loop for OS (milliseconds)
+use_atlas = False # draw stimuli from a prebuilt texture atlas
+atlas_dir = 'atlas-RSVPLG' # where the atlas and its manifest are kept
+data_flush_every = 10 # write data to disk every X trials and at breaks
 
 # timing setup
 dur = {
@@ -41,12 +43,31 @@ dur = {
     'feedback': 1.0,
     'post_trial': 0.25}
 
+import Startup
+startup = Startup.StartupTimer()
+import sys
+if '--headless' in sys.argv:
+    # simulated window, clock and keyboard instead of PsychoPy (Headless.py)
+    import Headless
+    Headless.Install()
 import psychopy
 psychopy.useVersion('2023.2.3')
-from psychopy import core, visual, data, gui, info
-from psychopy.hardware import keyboard
+# only what the dialog needs; the graphics modules are imported in the
+# background while it is up (see Startup.py)
+from psychopy import core, gui
 import numpy as np
-import math, os, random, time
+import argparse, os, time
+from MachineProfile import (CheckFramePeriod, FramePeriodChangedMessage,
+                            LoadProfile)
+from BlinkMetrics import Report as BlinkReport
+from FrameTiming import FlipLog, RunFrameSchedule, MissedFrames, TimingPlan
+from Profiling import NullProfiler, StageProfiler
+from Responses import ACC_QUIT, ResponseCollector, ScoreResponse
+from SessionStats import SessionStats, StatusFile
+from TrialData import (RSVPLG_CONDITION_COLUMNS, RSVPLG_TRIAL_FIELDS,
+                       BackgroundWriter, CSVRowWriter, TrialRecord)
+from TrialPlan import (CheckPlanSettings, LoadPlan, MakePlan, ParticipantSeed,
+                       PlanNavonKeys, SavePlan)
 
 clock = core.Clock()
 end_experiment = False
@@ -67,12 +88,9 @@ if stim_dir == None:
     print('Stimulus directory not found')
     core.quit()
 
-# initialize random number generator
-rng = np.random.default_rng()
-
 # timestamps: time at which this run started and the modification time of
 # this file
-RUNTIME = data.getDateStr()
+RUNTIME = Startup.DateStr()
 try:
     MODTIME = time.strftime('%Y-%m-%d-%H:%M:%S',
                             time.gmtime(os.path.getmtime(__file__)))
@@ -84,25 +102,19 @@ def quit_on_error(str):
     core.quit()
 
 class RSVP_Stream:
-    def __init__(self, win, stim_dir, stim_size, max_nframes):
+    def __init__(self, win, stim_cache, max_nframes):
         self.win = win
-        self.stim_dir = stim_dir
+        self.stim_cache = stim_cache
+        self.max_nframes = max_nframes
         self.frames = []
-        for i in range(max_nframes):
-            f = visual.ImageStim(win, size=stim_size)
-            f.setAutoDraw(False)
-            self.frames.append(f)
-        self.frame_index = None
 
     def initializeStream(self, global_letters, local_letters, colors):
+        # frames are references into the stimulus cache, so no image is
+        # loaded from disk here
         self.stream_length = len(global_letters)
-        for i in range(self.stream_length):
-            self.frames[i].setImage(os.path.join(
-                self.stim_dir,
-                '{}-{}-{}.{}'.format(
-                    global_letters[i], local_letters[i], colors[i],
-                    stim_file_ext)))
-        self.frame_index = 0
+        self.frames = [
+            self.stim_cache[(global_letters[i], local_letters[i], colors[i])]
+            for i in range(self.stream_length)]
 
     def preLoadStream(self, clear=True):
         # draw all the frames on top off one another to preload them
@@ -111,19 +123,13 @@ class RSVP_Stream:
         if clear:
             self.win.clearBuffer()
 
-    def drawCurrent(self):
-        if self.frame_index < len(self.frames):
-            self.frames[self.frame_index].draw()
-            return True
-        else:
-            return False
-
-    def nextFrame(self):
-        self.frame_index += 1
-        if self.frame_index < len(self.frames):
-            return True
-        else:
-            return False
+    def schedule(self, stim_frames, isi_frames):
+        # blank ISI before every item, each shown for a fixed number of frames
+        events = []
+        for f in self.frames:
+            events.append((None, isi_frames, 'isi'))
+            events.append((f.draw, stim_frames, 'stim'))
+        return events
 
 class Cue:
     def __init__(self, win):
@@ -234,47 +240,52 @@ class BreakDialog:
         self.textBox.setText(text)
         self.textBox.draw()
 
-def AdjustDurations(dur, frame_rate):
-    for k, d in dur.items():
-        nFrames = np.round(d / frame_rate)
-        dur[k] = frame_rate * (nFrames - .75)
-    return dur
-
 # function to process responses
 def ProcessResponse(keys=None, correct_responses=None, allowed_responses=None):
-    if keys == None:
-        return {
-            'acc': -5, 'rt': 0, 'resp': 'none',
-            'fdbk': None, 'fdbk_color': None}
-    elif keys[0].name == 'escape':
-        global end_experiment
+    global end_experiment
+    response_dict = ScoreResponse(
+        keys, correct_responses, allowed_responses, 'escape',
+        feedback_color_correct, feedback_color_error)
+    if response_dict['acc'] == ACC_QUIT:
         end_experiment = True
-        return {
-            'acc': -6, 'rt': 0, 'resp': 'none',
-            'fdbk': None, 'fdbk_color': None}
-    rt = keys[0].rt
-    resp = keys[0].name
-    fdbk_color = feedback_color_error
-    if len(keys) > 1:
-        # multiple keys pressed
-        acc = -2
-        resp = 'multiple'
-        fdbk = 'MULTIPLE KEYS PRESSED'
-    elif resp in correct_responses:
-        # correct
-        acc = 1
-        fdbk = 'CORRECT'
-        fdbk_color = feedback_color_correct
-    elif resp in allowed_responses:
-        # error
-        acc = 0
-        fdbk = 'ERROR'
-    else:
-        # some other non-allowed response
-        acc = -1
-        fdbk = 'BAD KEY PRESS'
-    return {'acc': acc, 'rt': rt, 'resp': resp,
-        'fdbk': fdbk, 'fdbk_color': fdbk_color}
+    return response_dict
+
+# set up trial i of a block: the values to record, and the stream pointed at
+# and preloaded with its images; run in the previous trial's feedback, so the
+# trial itself only has to copy the values into the record
+def PrepareTrial(block, i):
+    n_frames = block['n_frames'][i]
+    global_letters = block['global_letters'][i, :n_frames]
+    local_letters = block['local_letters'][i, :n_frames]
+    stream_colors = block['colors'][i, :n_frames]
+    fields = [(k, block[k][i]) for k in RSVPLG_CONDITION_COLUMNS if k in block]
+    fields += [
+        ('global_letters', ''.join(global_letters)),
+        ('local_letters', ''.join(local_letters)),
+        ('t1_pos', block['t1_pos'][i]),
+        ('t1', block['t1'][i]),
+        ('t2', block['t2'][i]),
+        ('t1_corr', block['t1_corr'][i]),
+        ('t2_corr', block['t2_corr'][i])]
+    rsvp_stream.initializeStream(global_letters, local_letters, stream_colors)
+    rsvp_stream.preLoadStream(clear=True)
+    return {'i': i, 'fields': fields,
+            't1_level': block['t1_level'][i],
+            't1_correct_resp': list(block['t1_corr'][i]),
+            't2_correct_resp': list(block['t2_corr'][i])}
+
+# command line options
+parser = argparse.ArgumentParser(description=EXPERIMENT)
+parser.add_argument('--plan',
+                    help='run the trials in this plan file (see TrialPlan.py)')
+parser.add_argument('--profile', action='store_true',
+                    help='time each section of every trial and report it at '
+                    'the end')
+args, unknown_args = parser.parse_known_args()
+if args.profile:
+    profiler = StageProfiler()
+else:
+    profiler = NullProfiler()
 
 # Present dialog box and process responses
 dlg_info = {
@@ -284,10 +295,16 @@ dlg_info = {
     'Block Type': ['Practice T1', 'Practice Both', 'Experiment'],
     'Version': VERSION
     }
+warmup = Startup.Warmup(
+    ['psychopy.visual', 'psychopy.hardware.keyboard', 'StimulusCache'],
+    [lambda: Startup.WarmDirectory(stim_dir)])
+warmup.start()
+startup.mark('dialog')
 dlg = gui.DlgFromDict(
     dlg_info, title=EXPERIMENT,
     order=['Participant', 'Experimenter Initials', 'Session', 'Block Type'],
     fixed='Version')
+startup.mark('dialog_closed')
 if not dlg.OK:
     print('Dialog box canceled')
     core.quit()
@@ -300,8 +317,22 @@ SUBJECT = int(dlg_info['Participant'])
 EXPERIMENTER = dlg_info['Experimenter Initials']
 SESSION = int(dlg_info['Session'])
 BLOCK_TYPE = dlg_info['Block Type']
-rti = info.RunTimeInfo(win=False, refreshTest=None)
-ROOM = rti['systemHostName']
+ROOM = Startup.HostName()
+
+# load the trial plan, or seed it from the participant so it can be
+# regenerated
+if args.plan:
+    try:
+        trial_plan, plan_info = LoadPlan(args.plan)
+    except (OSError, KeyError, ValueError) as e:
+        quit_on_error('Cannot read trial plan {}: {}'.format(args.plan, e))
+    if plan_info['task'] != 'RSVPLG' or plan_info['block_type'] != BLOCK_TYPE:
+        quit_on_error('Trial plan {} is for {} {}, not {}'.format(
+            args.plan, plan_info['task'], plan_info['block_type'], BLOCK_TYPE))
+    SEED = plan_info['seed']
+else:
+    trial_plan = None
+    SEED = ParticipantSeed(EXPERIMENT, SUBJECT, SESSION, BLOCK_TYPE)
 
 data_file_basename = os.path.join('data', u'%s-Data-%03d-%s-%s-%s' %
                                   (EXPERIMENT, SUBJECT, EXPERIMENTER, BLOCK_TYPE, RUNTIME))
@@ -314,45 +345,22 @@ extraInfo = {
     'room': ROOM,
     'sess': SESSION,
     'blocktyp': BLOCK_TYPE,
-    'datetime': RUNTIME}
+    'datetime': RUNTIME,
+    'seed': SEED}
 
 if BLOCK_TYPE == 'Practice T1':
     test_t1 = True
     test_t2 = False
-    trial_type_list = ['prac']
 elif BLOCK_TYPE == 'Practice T2':
     test_t1 = False
     test_t2 = True
-    trial_type_list = ['prac']
-elif BLOCK_TYPE == 'Practice Both':
-    test_t1 = True
-    test_t2 = True
-    trial_type_list = ['prac']
 else:
     test_t1 = True
     test_t2 = True
-    trial_type_list = ['warmup', 'exp']
-
-# open experiment handler
-exp_handler = data.ExperimentHandler(name=EXPERIMENT, version=VERSION,
-                                     extraInfo=extraInfo,
-                                     saveWideText=True,
-                                     dataFileName=data_file_basename)
-
-# set up trial handlers
-conditions_list = data.importConditions(conditions_file)
-warmup_trial_handler = data.TrialHandler(
-    conditions_list,
-    nReps=np.ceil(n_trials_warmup / len(conditions_list)),
-    method='fullRandom')
-prac_trial_handler = data.TrialHandler(
-    conditions_list,
-    nReps=np.ceil(n_trials_practice / len(conditions_list)),
-    method='fullRandom')
-exp_trial_handler = data.TrialHandler(
-    conditions_list,
-    nReps=n_trials_per_cell,
-    method='fullRandom')
+
+# completed trials are written to disk on a background thread as they finish
+data_writer = BackgroundWriter(CSVRowWriter(
+    data_file_basename + '.csv', flush_every=data_flush_every))
 
 # set up stimuli and responses
 distractor_letters = list(distractor_letters)
@@ -381,15 +389,66 @@ for c in t2_letters:
         distractor_letters.remove(c)
 t2_allowed_responses.append('escape')
 
-# set up screen based on computer
-if (ROOM in ('A122580', 'A126702', 'A124932', 'A124933', 'A122590', 'Yesun.local')):
-    screen_size = [1920, 1080]
-elif 'GoldenChild' in ROOM:
-    screen_size = [1792, 1120]
+# running accuracy and RTs, written to a status file after every trial (see
+# SessionStats.py)
+session_stats = SessionStats(
+    {'exp': EXPERIMENT, 'sub': SUBJECT, 'sess': SESSION,
+     'blocktyp': BLOCK_TYPE}, chance=1 / len(t1_letters))
+status_writer = BackgroundWriter(StatusFile(
+    data_file_basename + '-status.json'))
+
+# generate the trial order and every RSVP stream of every block up front,
+# unless they come from a plan file
+plan_settings = {
+    'conditions_file': conditions_file,
+    'n_trials_per_cell': n_trials_per_cell,
+    'n_trials_practice': n_trials_practice,
+    'n_trials_warmup': n_trials_warmup,
+    'stream_frames': rsvp_stream_frames,
+    'distractor_letters': ''.join(distractor_letters),
+    't1_letters': ''.join(t1_letters),
+    't2_letters': ''.join(t2_letters),
+    't1_pos_list': t1_pos_list,
+    'distractor_color': distractor_color,
+    't1_color': t1_color,
+    't2_color': t2_color}
+if trial_plan == None:
+    trial_plan, plan_info = MakePlan(
+        'RSVPLG', BLOCK_TYPE, SEED, settings=plan_settings)
 else:
-    # default
-    print('COMPUTER NOT IDENTIFIED: DEFAULT RESOLUTION SET')
+    changed = CheckPlanSettings(plan_info, plan_settings)
+    if len(changed) > 0:
+        print('WARNING: trial plan was made with different settings: ' +
+              ', '.join(changed))
+SavePlan(data_file_basename + '-plan.npz', trial_plan, plan_info)
+n_trials_planned = {
+    trial_type: len(block['condition'])
+    for trial_type, block in trial_plan.items()}
+
+# typed per-trial data (see TrialData.py), with the session information
+# (extraInfo) last, as in PsychoPy's wide-text files
+trial_record = TrialRecord(
+    RSVPLG_TRIAL_FIELDS,
+    sum(n_trials_planned.values()),
+    info=extraInfo, info_first=False)
+
+# set up screen from this computer's calibration (see MachineProfile.py)
+try:
+    machine = LoadProfile(ROOM)
+except (OSError, ValueError) as e:
+    quit_on_error('Cannot read machine profile: {}'.format(e))
+if machine == None:
+    # default, with the refresh rate estimated when the window opens
+    print('COMPUTER NOT CALIBRATED: DEFAULT RESOLUTION SET')
     screen_size = [1920, 1080]
+else:
+    screen_size = machine['resolution']
+
+# imported by the warmup during the dialog
+warmup_wait = warmup.wait()
+from psychopy import visual
+from psychopy.hardware import keyboard
+from StimulusCache import LoadNavonCache, LoadOrBuildAtlas, NavonFileName
 
 # open window and set up
 win = visual.Window(
@@ -398,18 +457,67 @@ win = visual.Window(
     monitor='Default', color=background_color, colorSpace=color_space,
     backgroundImage=None, backgroundFit=None,
     blendMode='avg', useFBO=True,
-    units='pix')
+    units='pix', checkTiming=(machine == None))
 win.mouseVisible = False
 keyboard = keyboard.Keyboard()
-
-# update timings to get as close to frame rate as possible
+t1_collector = ResponseCollector(keyboard, t1_allowed_responses)
+t2_collector = ResponseCollector(keyboard, t2_allowed_responses)
+if machine != None:
+    # use the calibrated frame period, after checking the refresh rate has
+    # not changed since
+    win.monitorFramePeriod = machine['frame_period']
+    measured = CheckFramePeriod(win, machine)
+    if measured != None:
+        win.close()
+        quit_on_error(FramePeriodChangedMessage(measured, machine))
+
+# every duration and lag as a whole number of frames, worked out once: the
+# RSVP stream is timed in frames, lags are counted in stream items, and the
+# other displays wait until just short of their last frame
 frame_rate = win.monitorFramePeriod
-dur = AdjustDurations(dur, frame_rate)
-dur_isi = dur['isi']
-dur_stim = dur['stim']
+timing_plan = TimingPlan(frame_rate)
+for k, d in dur.items():
+    timing_plan.add(k, d)
+stim_frames = timing_plan['stim']
+isi_frames = timing_plan['isi']
+for lag in np.unique(np.concatenate(
+        [block['t2_lag'] for block in trial_plan.values()])):
+    timing_plan.addLag(int(lag), lag * (dur['stim'] + dur['isi']),
+                       lag * (stim_frames + isi_frames))
+try:
+    timing_plan.check()
+except ValueError as e:
+    win.close()
+    quit_on_error('Durations too short for this display, ' + str(e))
+print(timing_plan.report())
+timing_plan.saveSummary(data_file_basename + '-timing-plan.csv')
+# every flip is logged to check that each display lasted as many frames as
+# intended
+frames = timing_plan.frames()
+flip_log = FlipLog(frame_rate)
+dur = {k: timing_plan.wait(k) for k in dur}
+
+# decode exactly the images this session's plan will show, once, before
+# the first trial
+navon_keys = PlanNavonKeys(trial_plan)
+try:
+    if use_atlas:
+        # packs this session's images the first time; later sessions that
+        # show no others just load the atlas pages
+        atlas = LoadOrBuildAtlas(
+            atlas_dir, [NavonFileName(stim_dir, g, l, c, stim_file_ext)
+                        for g, l, c in navon_keys], stim_size)
+    else:
+        atlas = None
+    stim_cache = LoadNavonCache(
+        win, stim_dir, stim_size, navon_keys, stim_file_ext, atlas)
+except FileNotFoundError as e:
+    win.close()
+    quit_on_error(str(e))
+stim_cache.preload(clear=True)
 
 # set up other objects
-rsvp_stream = RSVP_Stream(win, stim_dir, stim_size, np.max(rsvp_stream_frames))
+rsvp_stream = RSVP_Stream(win, stim_cache, np.max(rsvp_stream_frames))
 trial_cue = Cue(win)
 fixation = Fixation(win)
 feedback = Feedback(win)
@@ -433,138 +541,93 @@ self_paced_prompt.setAutoDraw(False)
 # set up accuracy tracking
 t1_correct_count = 0
 t2_correct_count = 0
+startup.mark('ready')
 
 trial = 0
-for trial_type in trial_type_list:
-    exec('trial_handler = {}_trial_handler'.format(trial_type))
-    exp_handler.addLoop(trial_handler)
-    for thisTrial in trial_handler:
+for trial_type, block in trial_plan.items():
+    block_start = trial_record.n
+    next_trial = None
+    for i in range(len(block['condition'])):
         trial += 1
-        trial_handler.addData('trial', trial)
-        trial_handler.addData('trial_type', trial_type)
-        trial_handler.addData('trial_time', data.getDateStr())
-        # set factor levels for this trial
-        t1_level = thisTrial['t1_level']
-        t2_level = thisTrial['t2_level']
-        t2_lag = int(thisTrial['t2_lag'])
-
-        if type(rsvp_stream_frames) in (list, tuple):
-            n_frames = rng.choice(rsvp_stream_frames)
-        else:
-            n_frames = rsvp_stream_frames
-
-        # set up stimuli
-        t1_pos = rng.choice(t1_pos_list)
-        trial_letters = np.array(distractor_letters)
-        # extend letters if needed
-        if len(trial_letters) < n_frames:
-            trial_letters = np.tile(
-                trial_letters, math.ceil(n_frames / len(trial_letters)))
-        global_letters = rng.permutation(trial_letters)[:n_frames]
-        local_letters = rng.permutation(trial_letters)[:n_frames]
-        # select t1 and t2
-        t1 = rng.choice(t1_letters)
-        t2 = rng.choice(t2_letters)
-        # insert T1 and T2
-        if t1_level == 'global':
-            global_letters[t1_pos - 1] = t1
-        else:
-            local_letters[t1_pos - 1] = t1
-        if t2_level == 'global':
-            global_letters[t1_pos + t2_lag - 1] = t2
-        else:
-            local_letters[t1_pos + t2_lag - 1] = t2
-        # set up colors
-        stream_colors = [distractor_color] * n_frames
-        stream_colors[t1_pos - 1] = t1_color
-        stream_colors[t1_pos + t2_lag - 1] = t2_color
-        # set up responses
-        if t1.lower() == t1.upper():
-            t1_correct_resp = t1
-        else:
-            t1_correct_resp = [t1.lower(), t1.upper()]
-        if t2.lower() == t2.upper():
-            t2_correct_resp = t2
-        else:
-            t2_correct_resp = [t2.lower(), t2.upper()]
-
-        # store stimulus information
-        trial_handler.addData('global_letters', ''.join(global_letters))
-        trial_handler.addData('local_letters', ''.join(local_letters))
-        trial_handler.addData('t1_pos', t1_pos)
-        trial_handler.addData('t1', t1)
-        trial_handler.addData('t2', t2)
-        trial_handler.addData('t1_corr', ''.join(t1_correct_resp))
-        trial_handler.addData('t2_corr', ''.join(t2_correct_resp))
-
-        rsvp_stream.initializeStream(global_letters, local_letters, stream_colors)
-
-        # load stimuli and do pre-trial pause
-        rsvp_stream.preLoadStream(clear=True)
-        win.flip()
+        startup.mark('first_trial')
+        profiler.begin('trial_setup')
+        # normally prepared during the last trial's feedback
+        if next_trial == None or next_trial['i'] != i:
+            next_trial = PrepareTrial(block, i)
+        this_trial, next_trial = next_trial, None
+        for k, v in this_trial['fields']:
+            trial_record.set(k, v)
+        trial_record.set('trial', trial)
+        trial_record.set('trial_type', trial_type)
+        trial_record.set('trial_time', Startup.DateStr())
+        t1_level = this_trial['t1_level']
+        t1_correct_resp = this_trial['t1_correct_resp']
+        t2_correct_resp = this_trial['t2_correct_resp']
+
+        # pre-trial pause
+        profiler.begin('pre_trial')
+        flip_log.startTrial(trial)
+        flip_log.flip(win, 'pre_trial', frames['pre_trial'])
         core.wait(dur['pre_trial'])
 
         # wait for input if self-paced
         if self_paced:
+            profiler.begin('self_paced')
             win.clearBuffer()
             self_paced_prompt.setText('Press any button to begin trial {}'.format(trial))
             self_paced_prompt.draw()
             trial_cue.draw(t1_level)
-            win.flip()
+            flip_log.flip(win, 'self_paced')
             keys = keyboard.waitKeys()
             if keys[0].name == 'escape':
                 end_experiment = True
                 break
 
         # draw cue
+        profiler.begin('cue')
         win.clearBuffer()
         trial_cue.draw(t1_level)
-        win.flip()
+        flip_log.flip(win, 'cue', frames['cue'])
         core.wait(dur['cue'])
 
         # draw fixation
+        profiler.begin('fixation')
         win.clearBuffer()
         fixation.draw()
         trial_cue.draw(t1_level)
-        win.flip()
+        flip_log.flip(win, 'fixation', frames['fixation'])
         core.wait(dur['fixation'])
 
-        # RSVP stream
-        rsvp_ISI = True
-        last_frame = False
+        # RSVP stream, locked to the vertical blank
+        profiler.begin('stream')
         win.clearBuffer()
-        win.flip()
-        t_next = clock.getTime()
-        while True:
-            if clock.getTime() >= t_next:
-                win.flip()
-                t_flip = clock.getTime()
-                win.clearBuffer()
-                if last_frame:
-                    break
-                elif rsvp_ISI:
-                    t_next = t_flip + dur_isi
-                    rsvp_stream.drawCurrent()
-                    rsvp_ISI = False
-                else:
-                    t_next = t_flip + dur_stim
-                    rsvp_ISI = True
-                    if not rsvp_stream.nextFrame():
-                        last_frame = True
-            core.wait(rsvp_loop_granularity) # break for the OS
+        flip_log.flip(win, 'pre_stream', 1)
+        stream_flips = RunFrameSchedule(
+            win, rsvp_stream.schedule(stim_frames, isi_frames), flip_log,
+            'response_gap', frames['response_gaps'])
+        trial_record.set('stream_onset', stream_flips[0])
+        trial_record.set('stream_dur', stream_flips[-1] - stream_flips[0])
+        trial_record.set('stream_missed_frames',
+                         MissedFrames(stream_flips, frame_rate))
 
         # pause before response collection
+        profiler.begin('response_gap')
         core.wait(dur['response_gaps'])
         win.clearBuffer()
 
         if test_t1:
             # T1 response
+            profiler.begin('t1_response')
+            # prompt redrawn every frame until a key comes in, with the RT
+            # from its flip
             t1_response_prompt.draw()
-            win.flip()
-            keyboard.clock.reset()
-            keys = keyboard.waitKeys(keyList=t1_allowed_responses)
+            t1_collector.start(win)
+            flip_log.flip(win, 't1_prompt')
+            while not t1_collector.poll():
+                t1_response_prompt.draw()
+                flip_log.flip(win)
             t1_response_dict = ProcessResponse(
-                keys, t1_correct_resp, t1_allowed_responses)
+                t1_collector.keys(), t1_correct_resp, t1_allowed_responses)
             # pause
             core.wait(dur['response_gaps'])
             win.clearBuffer()
@@ -574,21 +637,26 @@ for trial_type in trial_type_list:
         if t1_response_dict['acc'] == 1:
             t1_correct_count += 1
 
-        trial_handler.addData('t1_resp', t1_response_dict['resp'])
-        trial_handler.addData('t1_acc', t1_response_dict['acc'])
-        trial_handler.addData('t1_rt', t1_response_dict['rt'])
+        trial_record.set('t1_resp', t1_response_dict['resp'])
+        trial_record.set('t1_acc', t1_response_dict['acc'])
+        trial_record.set('t1_rt', t1_response_dict['rt'])
 
         if end_experiment:
             break
 
         if test_t2:
             # T2 response
+            profiler.begin('t2_response')
+            # prompt redrawn every frame until a key comes in, with the RT
+            # from its flip
             t2_response_prompt.draw()
-            win.flip()
-            keyboard.clock.reset()
-            keys = keyboard.waitKeys(keyList=t2_allowed_responses)
+            t2_collector.start(win)
+            flip_log.flip(win, 't2_prompt')
+            while not t2_collector.poll():
+                t2_response_prompt.draw()
+                flip_log.flip(win)
             t2_response_dict = ProcessResponse(
-                keys, t2_correct_resp, t2_allowed_responses)
+                t2_collector.keys(), t2_correct_resp, t2_allowed_responses)
             # pause
             core.wait(dur['response_gaps'])
             win.clearBuffer()
@@ -598,14 +666,15 @@ for trial_type in trial_type_list:
         if t2_response_dict['acc'] == 1:
             t2_correct_count += 1
 
-        trial_handler.addData('t2_resp', t2_response_dict['resp'])
-        trial_handler.addData('t2_acc', t2_response_dict['acc'])
-        trial_handler.addData('t2_rt', t2_response_dict['rt'])
+        trial_record.set('t2_resp', t2_response_dict['resp'])
+        trial_record.set('t2_acc', t2_response_dict['acc'])
+        trial_record.set('t2_rt', t2_response_dict['rt'])
 
         if end_experiment:
             break
 
         # feedback
+        profiler.begin('feedback')
         feedback.prepare(trial,
             t1AccText=t1_response_dict['fdbk'],
             t1Color=t1_response_dict['fdbk_color'],
@@ -613,37 +682,71 @@ for trial_type in trial_type_list:
             t2Color=t2_response_dict['fdbk_color'])
         win.clearBuffer()
         feedback.draw()
-        win.flip()
-        core.wait(dur['feedback'])
+        flip_log.flip(win, 'feedback', frames['feedback'])
+        # core.getTime() is not on the clock of the flip times
+        feedback_start = core.getTime()
+        # set up the next trial while the feedback is up
+        if i + 1 < len(block['condition']):
+            next_trial = PrepareTrial(block, i + 1)
+        core.wait(dur['feedback'] - (core.getTime() - feedback_start))
 
         # post-trial pause
+        profiler.begin('post_trial')
         win.clearBuffer()
-        win.flip()
+        flip_log.flip(win, 'post_trial', frames['post_trial'])
         core.wait(dur['post_trial'])
 
         # advance trials
-        exp_handler.nextEntry()
-        if ((trial_type == 'warmup' and trial >= n_trials_warmup) or
-            (trial_type == 'prac' and trial >= n_trials_practice)):
-            # end warmup
-            break
+        profiler.begin('save_data')
+        for k, v in flip_log.endTrial().items():
+            trial_record.set(k, v)
+        data_writer.write(trial_record.endTrial())
+        session_stats.add(t1_level, block['t2_level'][i], block['t2_lag'][i],
+                          t1_response_dict, t2_response_dict)
+        status_writer.write(session_stats.summary())
 
         if trial % break_every == 0:
+            profiler.begin('break')
+            data_writer.flush()
             win.clearBuffer()
             breakDialog.draw(trial)
-            win.flip()
+            flip_log.flip(win, 'break')
             keys = keyboard.waitKeys()
             if keys[0].name == 'escape':
                 end_experiment = True
                 break
 
-    exp_handler.loopEnded(trial_handler)
+    block_report = BlinkReport(trial_record.data[block_start:trial_record.n],
+                               lag='t2_lag', main_only=False)
+    if block_report != '':
+        print('{} block:\n{}'.format(trial_type, block_report))
     if end_experiment:
         break
+profiler.end()
 
-# save data
-exp_handler.saveAsWideText(data_file_basename, delim=',')
-exp_handler.abort()
+# display timing summary, with the last trial's final display ended by
+# this flip
+win.clearBuffer()
+flip_log.flip(win, 'end')
+flip_log.endTrial()
+flip_log.saveSummary(data_file_basename + '-timing.csv')
+print(flip_log.report())
+if args.profile:
+    profiler.saveSummary(data_file_basename + '-profile.csv')
+    print(profiler.report())
+print(startup.report())
+startup.saveRow(os.path.join('data', EXPERIMENT + '-startup.csv'), {
+    'host': ROOM, 'datetime': RUNTIME, 'sub': SUBJECT,
+    'blocktyp': BLOCK_TYPE, 'warmup': round(warmup.duration, 4),
+    'warmup_wait': round(warmup_wait, 4)})
+
+# save data, including any partial trial left by an escape
+if trial > trial_record.n:
+    data_writer.write(trial_record.endTrial())
+data_writer.close()
+status_writer.close()
+trial_record.saveNPZ(data_file_basename + '.npz')
+print(session_stats.report())
 
 # Feedback/exit screen
 end_of_block_feedback_text = 'Completed {} trials'.format(trial)
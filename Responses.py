@@ -0,0 +1,197 @@
+"""Response collection and scoring shared by the RSVP local/global tasks.
+
+ScoreResponse() is the scoring behind ProcessResponse() in RSVPLG.py and
+TutuLG.py, and is used as-is by the simulated participants in Simulate.py.
+ResponseCollector gathers the keys for it without blocking: the task polls
+it once a frame, and RTs are the keyboard's own (KeyPress.rt), from its
+clock reset on the flip that started the response period.
+"""
+
+import collections
+
+# accuracy codes written to the t1_acc/t2_acc columns
+ACC_CORRECT = 1
+ACC_ERROR = 0
+ACC_BAD_KEY = -1
+ACC_MULTIPLE = -2
+ACC_NO_RESPONSE = -3
+ACC_NOT_TESTED = -5
+ACC_QUIT = -6
+
+def ScoreResponse(keys=None, correct_responses=None, allowed_responses=None,
+                  quit_key='escape', color_correct=None, color_error=None):
+    """Score the keys from keyboard.waitKeys() (anything with .name and .rt)
+    against the correct and allowed responses. keys is None when the target
+    was not tested. Returns a dict with the accuracy code (acc), rt, response
+    (resp) and the feedback text (fdbk) and color (fdbk_color).
+    """
+    if keys == None:
+        return {
+            'acc': ACC_NOT_TESTED, 'rt': 0, 'resp': 'none',
+            'fdbk': None, 'fdbk_color': None}
+    elif len(keys) == 0:
+        # no key before the response deadline
+        return {
+            'acc': ACC_NO_RESPONSE, 'rt': 0, 'resp': 'none',
+            'fdbk': 'TOO SLOW', 'fdbk_color': color_error}
+    elif keys[0].name == quit_key:
+        return {
+            'acc': ACC_QUIT, 'rt': 0, 'resp': 'none',
+            'fdbk': None, 'fdbk_color': None}
+    rt = keys[0].rt
+    resp = keys[0].name
+    fdbk_color = color_error
+    if len(keys) > 1:
+        # multiple keys pressed
+        acc = ACC_MULTIPLE
+        resp = 'multiple'
+        fdbk = 'MULTIPLE KEYS PRESSED'
+    elif resp in correct_responses:
+        # correct
+        acc = ACC_CORRECT
+        fdbk = 'CORRECT'
+        fdbk_color = color_correct
+    elif resp in allowed_responses:
+        # error
+        acc = ACC_ERROR
+        fdbk = 'ERROR'
+    else:
+        # some other non-allowed response
+        acc = ACC_BAD_KEY
+        fdbk = 'BAD KEY PRESS'
+    return {'acc': acc, 'rt': rt, 'resp': resp,
+        'fdbk': fdbk, 'fdbk_color': fdbk_color}
+
+def ResponseKeys(letters, quit_key=None):
+    """Keys accepted for the given target letters: both cases of every
+    letter, plus the quit key if given
+    """
+    keys = []
+    for c in letters:
+        if c.lower() == c.upper():
+            keys.append(c)
+        else:
+            keys.extend([c.lower(), c.upper()])
+    if quit_key != None:
+        keys.append(quit_key)
+    return keys
+
+# a key press as ScoreResponse() wants it: rt relative to the flip that
+# started the response period
+KeyResponse = collections.namedtuple('KeyResponse', ['name', 'rt'])
+
+class ResponseCollector:
+    """Collects n_responses key presses from keyList on kb (a PsychoPy
+    keyboard.Keyboard) without blocking.
+
+    start(win) right before the flip of the display that starts the
+    response period, then poll() at least once a frame until it returns
+    True: once every response is in or past its deadline, or the quit key
+    is pressed. Nothing is read before that flip. RTs come from the
+    keyboard (KeyPress.rt, from kb.clock, which start() resets on the flip),
+    not from when the presses were polled. KeyPress.tDown is no use here: on
+    the ptb backend it is offset by the keyboard's own start time, so it is
+    on neither win.flip()'s clock nor core.getTime()'s.
+
+    Responses are taken in the order they come, and the presses picked up
+    by one poll count as one response, as they would from a single
+    waitKeys(). Alternatively response_keys gives the keys of each response
+    (e.g. one set of keys per target), and response n is the first press of
+    any of its keys while it is open: from its onset, in seconds after the
+    start flip (start(win, onsets), or open(n, onset) once it is known),
+    until deadline seconds after it. Presses before the onset are
+    anticipations and presses after the deadline are too late; both are
+    dropped. Without response_keys every response opens at the start flip.
+    """
+    def __init__(self, kb, keyList, n_responses=1, deadline=None,
+                 quit_key='escape', response_keys=None):
+        self.kb = kb
+        self.response_keys = response_keys
+        if response_keys != None:
+            n_responses = len(response_keys)
+            keyList = [k for keys in response_keys for k in keys]
+            if quit_key != None:
+                keyList.append(quit_key)
+        self.keyList = keyList
+        self.n_responses = n_responses
+        self.deadline = deadline
+        self.quit_key = quit_key
+        self.onsets = [0] * n_responses
+        self.responses = [None] * n_responses
+        self.quit = None
+        self.running = False
+
+    def start(self, win, onsets=None):
+        self.kb.clearEvents()
+        win.callOnFlip(self.begin)
+        if onsets == None:
+            onsets = [0] * self.n_responses
+        self.onsets = list(onsets)
+        self.responses = [None] * self.n_responses
+        self.quit = None
+        self.running = False
+
+    def begin(self):
+        # on the start flip
+        self.kb.clock.reset()
+        self.running = True
+
+    def open(self, n, onset):
+        self.onsets[n] = onset
+
+    def stop(self):
+        self.running = False
+
+    def isOpen(self, n, t):
+        onset = self.onsets[n]
+        return (onset != None and t >= onset and
+                (self.deadline == None or t - onset < self.deadline))
+
+    def poll(self):
+        """Read the presses since the last poll; True when collection is
+        over
+        """
+        if not self.running:
+            return False
+        presses = self.kb.getKeys(keyList=self.keyList, waitRelease=False)
+        if len(presses) > 0:
+            batch = [KeyResponse(k.name, k.rt) for k in presses]
+            for k in batch:
+                if k.name == self.quit_key:
+                    self.quit = k
+            if self.response_keys == None:
+                batch = [k for k in batch if k.rt >= 0]
+                if None in self.responses and len(batch) > 0:
+                    self.responses[self.responses.index(None)] = batch
+            else:
+                for k in batch:
+                    for n, keys in enumerate(self.response_keys):
+                        if (k.name in keys and self.responses[n] == None and
+                                self.isOpen(n, k.rt)):
+                            self.responses[n] = [k]
+        return self.done()
+
+    def done(self):
+        if self.quit != None:
+            return True
+        if not self.running:
+            return False
+        now = self.kb.clock.getTime()
+        for n, r in enumerate(self.responses):
+            onset = self.onsets[n]
+            if r == None and (onset == None or self.deadline == None or
+                              now - onset < self.deadline):
+                return False
+        return True
+
+    def keys(self, n=0):
+        """The presses of response n, for ScoreResponse(): the quit key if
+        it was pressed, empty if there was no response n. RTs are relative
+        to the response's onset.
+        """
+        if self.quit != None:
+            return [self.quit]
+        if self.responses[n] == None:
+            return []
+        return [k._replace(rt=k.rt - self.onsets[n])
+                for k in self.responses[n]]
@@ -0,0 +1,248 @@
+"""Running statistics of a session of the RSVP local/global tasks.
+
+SessionStats is updated once per trial with the scored responses (see
+Responses.ScoreResponse) and keeps T1, T2 and T2|T1 accuracy, RT mean and
+variance (Welford's algorithm), accuracy over the last few trials and counts
+per t1_level x t2_level x t2_lag cell, each in constant time per trial. The
+task scripts write its summary to a JSON status file after every trial,
+through a BackgroundWriter, so the experimenter can follow a session from
+another terminal:
+
+    python SessionStats.py --follow
+    python SessionStats.py data/RSVPLG02-Data-101-...-status.json
+
+It flags a participant who seems not to be engaging (accuracy at chance or
+the same key over the last trials) and cells with no correct responses.
+"""
+
+import collections
+import glob
+import json
+import os
+import time
+
+from Responses import ACC_CORRECT, ACC_ERROR
+
+class RunningStats:
+    """Count, mean, variance, minimum and maximum of a stream of values"""
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        if self.min == None or x < self.min:
+            self.min = x
+        if self.max == None or x > self.max:
+            self.max = x
+
+    def variance(self):
+        if self.n < 2:
+            return None
+        return self.m2 / (self.n - 1)
+
+    def summary(self):
+        v = self.variance()
+        return {'n': self.n, 'mean': self.mean if self.n > 0 else None,
+                'sd': v ** 0.5 if v != None else None,
+                'min': self.min, 'max': self.max}
+
+def Scored(response):
+    # a response that was tested and made with an allowed key
+    return response['acc'] in (ACC_CORRECT, ACC_ERROR)
+
+def Proportion(k, n):
+    return k / n if n > 0 else None
+
+class SessionStats:
+    """Per-trial statistics of a session.
+
+    chance is the T1 accuracy expected from guessing; window is the number
+    of recent trials that the engagement checks look at, and min_cell_n the
+    number of trials a cell needs before it is checked.
+    """
+    def __init__(self, info=None, chance=None, window=20, min_cell_n=5):
+        self.info = dict(info) if info is not None else {}
+        self.chance = chance
+        self.window = window
+        self.min_cell_n = min_cell_n
+        self.n_trials = 0
+        self.t1 = [0, 0] # correct, scored
+        self.t2 = [0, 0]
+        self.t2_given_t1 = [0, 0]
+        self.t1_rt = RunningStats()
+        self.t2_rt = RunningStats()
+        self.recent_t1 = collections.deque(maxlen=window)
+        self.recent_keys = collections.deque(maxlen=window)
+        self.cells = {}
+
+    def add(self, t1_level, t2_level, t2_lag, t1_response, t2_response):
+        self.n_trials += 1
+        cell = self.cells.setdefault((t1_level, t2_level, int(t2_lag)), {
+            'n': 0, 't1_correct': 0, 't1_n': 0, 't2_correct': 0, 't2_n': 0,
+            't2_given_t1_correct': 0, 't2_given_t1_n': 0})
+        cell['n'] += 1
+        if Scored(t1_response):
+            correct = t1_response['acc'] == ACC_CORRECT
+            self.t1[0] += correct
+            self.t1[1] += 1
+            cell['t1_correct'] += correct
+            cell['t1_n'] += 1
+            self.t1_rt.add(t1_response['rt'])
+            self.recent_t1.append(correct)
+            self.recent_keys.append(t1_response['resp'].lower())
+        if Scored(t2_response):
+            correct = t2_response['acc'] == ACC_CORRECT
+            self.t2[0] += correct
+            self.t2[1] += 1
+            cell['t2_correct'] += correct
+            cell['t2_n'] += 1
+            self.t2_rt.add(t2_response['rt'])
+            if t1_response['acc'] == ACC_CORRECT:
+                self.t2_given_t1[0] += correct
+                self.t2_given_t1[1] += 1
+                cell['t2_given_t1_correct'] += correct
+                cell['t2_given_t1_n'] += 1
+
+    def warnings(self):
+        w = []
+        n = len(self.recent_t1)
+        if n == self.window:
+            acc = sum(self.recent_t1) / n
+            if self.chance != None and acc <= self.chance:
+                w.append('T1 accuracy over the last {} trials is {:.0f}% '
+                         '(chance {:.0f}%)'.format(n, 100 * acc,
+                                                   100 * self.chance))
+            if len(set(self.recent_keys)) == 1:
+                w.append("same T1 response '{}' on the last {} trials".format(
+                    self.recent_keys[0], n))
+        for key, c in self.cells.items():
+            for t in ('t1', 't2'):
+                if c[t + '_n'] >= self.min_cell_n and c[t + '_correct'] == 0:
+                    w.append('cell {}: no correct {} responses in {} '
+                             'trials'.format('/'.join(map(str, key)),
+                                             t.upper(), c[t + '_n']))
+        return w
+
+    def summary(self):
+        cells = []
+        for (t1_level, t2_level, t2_lag), c in sorted(self.cells.items()):
+            row = {'t1_level': t1_level, 't2_level': t2_level,
+                   't2_lag': t2_lag}
+            row.update(c)
+            cells.append(row)
+        s = dict(self.info)
+        s.update({
+            'updated': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'trials': self.n_trials,
+            't1_acc': Proportion(*self.t1),
+            't2_acc': Proportion(*self.t2),
+            't2_given_t1_acc': Proportion(*self.t2_given_t1),
+            'recent_t1_acc': Proportion(sum(self.recent_t1),
+                                        len(self.recent_t1)),
+            't1_rt': self.t1_rt.summary(),
+            't2_rt': self.t2_rt.summary(),
+            'cells': cells,
+            'warnings': self.warnings()})
+        return s
+
+    def report(self):
+        return Report(self.summary())
+
+def Percent(p):
+    return '  -' if p == None else '{:3.0f}'.format(100 * p)
+
+def Report(s):
+    """Text version of a SessionStats summary"""
+    lines = []
+    who = ', '.join(['{} {}'.format(k, v) for k, v in s.items() if k not in (
+        'updated', 'trials', 't1_acc', 't2_acc', 't2_given_t1_acc',
+        'recent_t1_acc', 't1_rt', 't2_rt', 'cells', 'warnings')])
+    if who != '':
+        lines.append(who)
+    lines.append('{} trials at {}: T1 {}%, T2 {}%, T2|T1 {}%, last trials '
+                 'T1 {}%'.format(s['trials'], s['updated'],
+                                 Percent(s['t1_acc']), Percent(s['t2_acc']),
+                                 Percent(s['t2_given_t1_acc']),
+                                 Percent(s['recent_t1_acc'])))
+    for t in ('t1_rt', 't2_rt'):
+        rt = s[t]
+        if rt['n'] > 0:
+            lines.append('{} RT mean {:.3f} s, sd {}, range {:.3f}-{:.3f}'.format(
+                t[:2].upper(), rt['mean'],
+                '-' if rt['sd'] == None else '{:.3f}'.format(rt['sd']),
+                rt['min'], rt['max']))
+    lines.append('{:<8} {:<8} {:>5} {:>5} {:>6} {:>6} {:>7}'.format(
+        't1_level', 't2_level', 'lag', 'n', 'T1 %', 'T2 %', 'T2|T1 %'))
+    for c in s['cells']:
+        lines.append('{:<8} {:<8} {:>5} {:>5} {:>6} {:>6} {:>7}'.format(
+            c['t1_level'], c['t2_level'], c['t2_lag'], c['n'],
+            Percent(Proportion(c['t1_correct'], c['t1_n'])),
+            Percent(Proportion(c['t2_correct'], c['t2_n'])),
+            Percent(Proportion(c['t2_given_t1_correct'], c['t2_given_t1_n']))))
+    for w in s['warnings']:
+        lines.append('WARNING: ' + w)
+    return '\n'.join(lines)
+
+class StatusFile:
+    """Writer for BackgroundWriter: each write() replaces the file with a
+    summary, atomically, so a reader never sees a partial one
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def write(self, summary):
+        dirname = os.path.dirname(self.filename)
+        if dirname != '' and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(summary, f, indent=1)
+        os.replace(tmp, self.filename)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def LatestStatusFile(data_dir='data'):
+    files = glob.glob(os.path.join(data_dir, '*-status.json'))
+    if len(files) == 0:
+        return None
+    return max(files, key=os.path.getmtime)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Show the running statistics of a session')
+    parser.add_argument('status_file', nargs='?',
+                        help='default: the latest one in data/')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='show it again whenever it changes')
+    parser.add_argument('--interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    last = None
+    while True:
+        filename = args.status_file or LatestStatusFile()
+        if filename != None and os.path.isfile(filename):
+            mtime = os.path.getmtime(filename)
+            if (filename, mtime) != last:
+                last = (filename, mtime)
+                with open(filename) as f:
+                    s = json.load(f)
+                if args.follow:
+                    print('\n' + filename)
+                print(Report(s))
+        elif not args.follow:
+            print('No status file found')
+        if not args.follow:
+            break
+        time.sleep(args.interval)
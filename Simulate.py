@@ -0,0 +1,343 @@
+"""Simulated participants for the RSVP local/global tasks.
+
+Runs whole sessions without a window: the trials come from the same plans
+the task scripts run (TrialPlan.py), a response model stands in for the
+participant, responses are scored with the scripts' own ScoreResponse(), and
+every session is written as a CSV file in the task's real data format.
+Sessions are spread over a pool of processes:
+
+    python Simulate.py TutuLG 1000 --block-types Practice Experiment -o sim
+    python Simulate.py RSVPLG 1000 --model blink --param blink_depth=0.4
+
+Response models are classes with a respond(rng, trial) method (see
+ResponseModel); --model takes the name of one below or module:Class.
+"""
+
+import argparse
+import concurrent.futures
+import importlib
+import os
+import time
+
+import numpy as np
+
+from Responses import ResponseKeys, ScoreResponse
+from TrialData import (RSVPLG_CONDITION_COLUMNS, RSVPLG_TRIAL_FIELDS,
+                       TUTU_TRIAL_FIELDS, CSVRowWriter, TrialRecord)
+from TrialPlan import MakePlan, ParticipantSeed
+
+# Session settings, as at the top of RSVPLG.py and TutuLG.py
+TASKS = {
+    'RSVPLG': {
+        'experiment': 'RSVPLG02',
+        'version': '2.3',
+        'block_types': ['Practice T1', 'Practice Both', 'Experiment'],
+        'item_soa': 0.150}, # stim + isi, to convert lags to seconds
+    'TutuLG': {
+        'experiment': 'RSVPLG03',
+        'version': '1.0.2',
+        'block_types': ['Introduction', 'Practice', 'Experiment']}
+    }
+
+########################################################################
+# Response models
+########################################################################
+
+class SimulatedKey:
+    """The parts of a PsychoPy KeyPress that ScoreResponse() uses"""
+    def __init__(self, name, rt):
+        self.name = name
+        self.rt = rt
+
+class ResponseModel:
+    """Base class for simulated participants.
+
+    respond(rng, trial) is called once per trial and returns the (key, rt)
+    pressed for T1 and for T2. trial is a dict with the targets' levels
+    (t1_level, t2_level), the T1-T2 lag in seconds (lag), the correct keys
+    for each target (t1_corr, t2_corr, e.g. 'hH') and the allowed keys
+    (allowed, without the quit key). Subclasses usually only need
+    pCorrect(); parameters are passed as keyword arguments.
+    """
+    def __init__(self, rt_median=0.6, rt_sigma=0.3):
+        self.rt_median = rt_median
+        self.rt_sigma = rt_sigma
+
+    def pCorrect(self, trial, t1_correct=None):
+        """Probability of getting T1 right (t1_correct is None) or T2 right
+        given whether T1 was right
+        """
+        return 0.5
+
+    def rt(self, rng):
+        return self.rt_median * np.exp(rng.normal(0, self.rt_sigma))
+
+    def key(self, rng, correct, corr, allowed):
+        if correct:
+            return corr[0]
+        return rng.choice([k for k in allowed if k not in corr])
+
+    def respond(self, rng, trial):
+        t1_correct = rng.random() < self.pCorrect(trial)
+        t2_correct = rng.random() < self.pCorrect(trial, t1_correct)
+        return (
+            (self.key(rng, t1_correct, trial['t1_corr'], trial['allowed']),
+             self.rt(rng)),
+            (self.key(rng, t2_correct, trial['t2_corr'], trial['allowed']),
+             self.rt(rng)))
+
+class GuessingModel(ResponseModel):
+    """Presses an allowed key at random"""
+    pass
+
+class BlinkModel(ResponseModel):
+    """Attentional blink: T2 accuracy, given T1 was right, drops by up to
+    blink_depth for lags around blink_lag (s), and by switch_cost more when
+    T2 is at a different level from T1
+    """
+    def __init__(self, p_t1=0.85, p_t2=0.85, blink_depth=0.3, blink_lag=0.3,
+                 blink_width=0.2, switch_cost=0.05, **kwargs):
+        ResponseModel.__init__(self, **kwargs)
+        self.p_t1 = p_t1
+        self.p_t2 = p_t2
+        self.blink_depth = blink_depth
+        self.blink_lag = blink_lag
+        self.blink_width = blink_width
+        self.switch_cost = switch_cost
+
+    def pCorrect(self, trial, t1_correct=None):
+        if t1_correct is None:
+            return self.p_t1
+        p = self.p_t2
+        if t1_correct:
+            p -= self.blink_depth * np.exp(
+                -((trial['lag'] - self.blink_lag) / self.blink_width) ** 2)
+        if trial['t1_level'] != trial['t2_level']:
+            p -= self.switch_cost
+        return min(max(p, 0.5), 1)
+
+MODELS = {
+    'guess': GuessingModel,
+    'blink': BlinkModel,
+    }
+
+def LoadModel(spec, params=None):
+    """Response model from a name in MODELS or module:Class"""
+    if ':' in spec:
+        module, name = spec.split(':', 1)
+        model_class = getattr(importlib.import_module(module), name)
+    elif spec in MODELS:
+        model_class = MODELS[spec]
+    else:
+        s = "unknown response model '{}' (use one of {} or module:Class)".format(
+            spec, ', '.join(sorted(MODELS)))
+        raise ValueError(s)
+    return model_class(**(params or {}))
+
+########################################################################
+# Sessions
+########################################################################
+
+def SimulatedResponses(model, rng, trial, test_t1, test_t2):
+    # scored exactly like the task scripts score real key presses
+    (k1, rt1), (k2, rt2) = model.respond(rng, trial)
+    allowed = trial['allowed']
+    if test_t1:
+        r1 = ScoreResponse([SimulatedKey(k1, rt1)], trial['t1_corr'], allowed)
+    else:
+        r1 = ScoreResponse(None)
+    if test_t2:
+        r2 = ScoreResponse([SimulatedKey(k2, rt2)], trial['t2_corr'], allowed)
+    else:
+        r2 = ScoreResponse(None)
+    return r1, r2
+
+def AddResponses(record, r1, r2):
+    record.set('t1_resp', r1['resp'])
+    record.set('t1_acc', r1['acc'])
+    record.set('t1_rt', r1['rt'])
+    record.set('t2_resp', r2['resp'])
+    record.set('t2_acc', r2['acc'])
+    record.set('t2_rt', r2['rt'])
+
+def SimulateRSVPLG(subject, block_type, model, rng, out_dir, session=1):
+    """One RSVPLG.py session; returns the data file name and trial count"""
+    task = TASKS['RSVPLG']
+    runtime = time.strftime('%Y-%m-%d_%Hh%M.%S.000')
+    seed = ParticipantSeed(task['experiment'], subject, session, block_type)
+    blocks, plan_info = MakePlan('RSVPLG', block_type, seed)
+    test_t1 = block_type != 'Practice T2'
+    test_t2 = block_type != 'Practice T1'
+    info = {
+        'exp': task['experiment'],
+        'ver': task['version'],
+        'mod-utc': 'simulated',
+        'sub': subject,
+        'experimenter': 'SIM',
+        'room': 'simulation',
+        'sess': session,
+        'blocktyp': block_type,
+        'datetime': runtime,
+        'seed': seed}
+    n_trials = sum([len(b['condition']) for b in blocks.values()])
+    record = TrialRecord(RSVPLG_TRIAL_FIELDS, n_trials, info,
+                         info_first=False)
+    filename = os.path.join(out_dir, '%s-Data-%03d-%s-%s-%s.csv' % (
+        task['experiment'], subject, 'SIM', block_type, runtime))
+    writer = CSVRowWriter(filename, flush_every=n_trials)
+    s = plan_info['settings']
+    allowed = ResponseKeys(sorted(set(s['t1_letters'] + s['t2_letters'])))
+    trial = 0
+    for trial_type, block in blocks.items():
+        for i in range(len(block['condition'])):
+            trial += 1
+            for k in RSVPLG_CONDITION_COLUMNS:
+                if k in block:
+                    record.set(k, block[k][i])
+            n_frames = block['n_frames'][i]
+            record.set('trial', trial)
+            record.set('trial_type', trial_type)
+            record.set('trial_time', runtime)
+            record.set('global_letters',
+                       ''.join(block['global_letters'][i, :n_frames]))
+            record.set('local_letters',
+                       ''.join(block['local_letters'][i, :n_frames]))
+            for k in ('t1_pos', 't1', 't2', 't1_corr', 't2_corr'):
+                record.set(k, block[k][i])
+            r1, r2 = SimulatedResponses(model, rng, {
+                't1_level': str(block['t1_level'][i]),
+                't2_level': str(block['t2_level'][i]),
+                'lag': block['t2_lag'][i] * task['item_soa'],
+                't1_corr': str(block['t1_corr'][i]),
+                't2_corr': str(block['t2_corr'][i]),
+                'allowed': allowed}, test_t1, test_t2)
+            AddResponses(record, r1, r2)
+            writer.write(record.endTrial())
+    writer.close()
+    return filename, trial
+
+def SimulateTutuLG(subject, block_type, model, rng, out_dir, targets='Both',
+                   session=1):
+    """One TutuLG.py block, appended to the participant's data file like the
+    script does; returns the data file name and trial count
+    """
+    task = TASKS['TutuLG']
+    runtime = time.strftime('%Y%m%d-%H%M%S')
+    seed = ParticipantSeed(task['experiment'], subject, session, block_type,
+                           targets)
+    blocks, plan_info = MakePlan('TutuLG', block_type, seed)
+    n_trials = sum([len(b['condition']) for b in blocks.values()])
+    record = TrialRecord(TUTU_TRIAL_FIELDS, n_trials)
+    for k, v in [('exp', task['experiment']), ('exp_initials', 'SIM'),
+                 ('runtime', runtime), ('ver', task['version']),
+                 ('modtime', 'simulated'), ('sub', subject),
+                 ('sess', session), ('blocktype', block_type), ('targets', targets),
+                 ('cuetype', 1), ('mode', 'Automatic'), ('seed', seed)]:
+        record.setInfo(k, v)
+    filename = os.path.join(out_dir, '%s-Data-%03d.csv' % (
+        task['experiment'], subject))
+    writer = CSVRowWriter(filename, flush_every=n_trials)
+    allowed = ResponseKeys(plan_info['settings']['target_letters'])
+    trial = 0
+    for trial_type in ('warmup', 'main'):
+        record.setInfo('trialtype', trial_type)
+        block = blocks.get(trial_type)
+        if block is None:
+            continue
+        for i in range(len(block['condition'])):
+            trial += 1
+            record.set('trial', trial)
+            record.set('trialtime', runtime)
+            for k in ('t1_level', 't2_level', 't2_lag', 't1', 't2',
+                      'distractor1', 'distractor2', 'stimfile1', 'stimfile2',
+                      't1_corr', 't2_corr', 'maskfile1', 'maskfile2'):
+                record.set(k, block[k][i])
+            r1, r2 = SimulatedResponses(model, rng, {
+                't1_level': str(block['t1_level'][i]),
+                't2_level': str(block['t2_level'][i]),
+                'lag': block['t2_lag'][i] / 1000,
+                't1_corr': str(block['t1_corr'][i]),
+                't2_corr': str(block['t2_corr'][i]),
+                'allowed': allowed}, True, targets != 'T1')
+            AddResponses(record, r1, r2)
+            writer.write(record.endTrial())
+    writer.close()
+    return filename, trial
+
+def SimulateParticipant(job):
+    """Run all the requested blocks of one participant; job is a dict so it
+    can be sent to a worker process
+    """
+    model = LoadModel(job['model'], job['params'])
+    rng = np.random.default_rng([job['subject'], job['seed']])
+    files = []
+    n_trials = 0
+    for block_type in job['block_types']:
+        if job['task'] == 'RSVPLG':
+            f, n = SimulateRSVPLG(job['subject'], block_type, model, rng,
+                                  job['out_dir'])
+        else:
+            f, n = SimulateTutuLG(job['subject'], block_type, model, rng,
+                                  job['out_dir'], job['targets'])
+        if f not in files:
+            files.append(f)
+        n_trials += n
+    return files, n_trials
+
+def ParseParams(params):
+    # name=value pairs, with numbers converted
+    d = {}
+    for p in params:
+        k, v = p.split('=', 1)
+        try:
+            d[k] = float(v)
+        except ValueError:
+            d[k] = v
+    return d
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Simulate participants in RSVPLG.py or TutuLG.py')
+    parser.add_argument('task', choices=sorted(TASKS.keys()))
+    parser.add_argument('n_participants', type=int)
+    parser.add_argument('--first', type=int, default=1,
+                        help='first participant number')
+    parser.add_argument('--block-types', nargs='+', default=['Experiment'])
+    parser.add_argument('--targets', default='Both', choices=['T1', 'Both'],
+                        help='TutuLG targets')
+    parser.add_argument('--model', default='blink',
+                        help='response model: {} or module:Class'.format(
+                            ', '.join(sorted(MODELS))))
+    parser.add_argument('--param', action='append', default=[],
+                        metavar='NAME=VALUE', help='response model parameter')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('-o', '--output', default='sim',
+                        help='directory for the data files')
+    args = parser.parse_args()
+    for b in args.block_types:
+        if b not in TASKS[args.task]['block_types']:
+            parser.error("{} has no block type '{}'".format(args.task, b))
+    params = ParseParams(args.param)
+    # fail here rather than in every worker
+    LoadModel(args.model, params)
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    jobs = [{
+        'task': args.task, 'subject': s, 'block_types': args.block_types,
+        'targets': args.targets, 'model': args.model, 'params': params,
+        'seed': args.seed, 'out_dir': args.output}
+        for s in range(args.first, args.first + args.n_participants)]
+    t0 = time.perf_counter()
+    n_files = 0
+    n_trials = 0
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        chunksize = max(1, len(jobs) // (4 * args.jobs))
+        for files, n in pool.map(SimulateParticipant, jobs,
+                                 chunksize=chunksize):
+            n_files += len(files)
+            n_trials += n
+    print('{} participants, {} trials in {} files in {:.1f} s'.format(
+        len(jobs), n_trials, n_files, time.perf_counter() - t0))
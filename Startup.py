@@ -0,0 +1,137 @@
+"""Startup of the RSVP local/global tasks.
+
+The experimenter waits for the dialog box at every block launch, so the task
+scripts load only what the dialog needs before showing it. Warmup then
+imports the heavy modules (PsychoPy's graphics and keyboard) and reads the
+stimulus files into the OS file cache on a background thread while the
+dialog is filled in. StartupTimer measures the time to the dialog and to the
+first trial.
+
+HostName() and DateStr() stand in for info.RunTimeInfo() and
+data.getDateStr(), which import and probe far more than the scripts use.
+"""
+
+import csv
+import datetime
+import importlib
+import os
+import platform
+import threading
+import time
+
+# when the task script started, as near as can be measured from Python
+T0 = time.perf_counter()
+
+def HostName():
+    """The computer's name, as RunTimeInfo's systemHostName"""
+    return platform.node()
+
+def DateStr():
+    """psychopy.data.getDateStr() with its default format"""
+    return datetime.datetime.now().strftime('%Y-%m-%d_%Hh%M.%S.%f')[:-3]
+
+def WarmFiles(filenames, block_size=1 << 20):
+    """Read files so later loads come from the OS cache; returns the number
+    of bytes read. Missing files are skipped.
+    """
+    n = 0
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as f:
+                while True:
+                    b = f.read(block_size)
+                    if len(b) == 0:
+                        break
+                    n += len(b)
+        except OSError:
+            continue
+    return n
+
+def WarmDirectory(dirname):
+    """WarmFiles() on every file in a directory, if it exists"""
+    if not os.path.isdir(dirname):
+        return 0
+    return WarmFiles([os.path.join(dirname, f)
+                      for f in sorted(os.listdir(dirname))])
+
+class Warmup:
+    """Imports modules and runs functions on a background thread.
+
+    start() returns at once. wait() blocks until everything is done and
+    raises the first error, so a failure shows up where the scripts need
+    the module, as it would have without the warmup.
+    """
+    def __init__(self, modules=(), tasks=()):
+        self.modules = list(modules)
+        self.tasks = list(tasks)
+        self.error = None
+        self.duration = None
+        self.thread = None
+
+    def _run(self):
+        t0 = time.perf_counter()
+        try:
+            for name in self.modules:
+                importlib.import_module(name)
+            for task in self.tasks:
+                task()
+        except BaseException as e:
+            self.error = e
+        self.duration = time.perf_counter() - t0
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self._run, name='Warmup', daemon=True)
+        self.thread.start()
+        return self
+
+    def wait(self):
+        """Time spent waiting for the warmup to finish, in seconds"""
+        t0 = time.perf_counter()
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return time.perf_counter() - t0
+
+class StartupTimer:
+    """Named marks during startup, in seconds since T0.
+
+    Only the first mark of each name counts, so mark('first_trial') can be
+    called on every trial.
+    """
+    def __init__(self, t0=T0):
+        self.t0 = t0
+        self.marks = {}
+
+    def mark(self, name):
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.t0
+
+    def report(self):
+        # each mark with the time since the one before it
+        parts = []
+        last = 0.0
+        for name, t in self.marks.items():
+            parts.append('{} {:.2f} s (+{:.2f})'.format(name, t, t - last))
+            last = t
+        return 'startup: ' + ', '.join(parts)
+
+    def saveRow(self, filename, info=None):
+        """Append the marks as one row of a CSV file, after info"""
+        row = dict(info) if info is not None else {}
+        row.update({k: round(t, 4) for k, t in self.marks.items()})
+        dirname = os.path.dirname(filename)
+        if dirname != '' and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # keep the columns of an existing file
+        header = None
+        if os.path.isfile(filename):
+            with open(filename, 'r', newline='') as f:
+                header = next(csv.reader(f), None)
+        with open(filename, 'a', newline='') as f:
+            writer = csv.DictWriter(f, header or list(row.keys()), restval='',
+                                    extrasaction='ignore', lineterminator='\n')
+            if header == None:
+                writer.writeheader()
+            writer.writerow(row)
@@ -0,0 +1,338 @@
+"""Preloaded stimulus images shared by the RSVP local/global tasks.
+
+Every image a session can need is decoded and uploaded to the graphics card
+once, right after the window opens.  Trials then draw the cached ImageStim
+objects directly, so setting up a trial never touches the disk.
+
+Optionally the images can come from a texture atlas: the images a session
+shows packed into a few large textures and saved to disk with a manifest
+(see BuildAtlas), so later sessions that show the same images do not decode
+the PNGs at all. The tasks build their atlas from their trial plan the
+first time; one holding every image of a directory can also be built ahead
+of time, at the cost of more pages, with
+
+    python StimulusCache.py atlas-RSVPLG stim --size 190 250
+"""
+
+import json
+import os
+
+import numpy as np
+from psychopy import visual
+
+ATLAS_VERSION = 2
+ATLAS_MANIFEST = 'manifest.json'
+
+class StimulusCache:
+    """Ready-to-draw ImageStims keyed by an arbitrary (hashable) key.
+
+    The key is whatever naturally names the image for the caller, e.g.
+    (global, local, color) for the RSVPLG Navon letters.
+    """
+    def __init__(self, win, size, atlas=None):
+        self.win = win
+        self.size = size
+        self.atlas = atlas
+        self.images = {}
+        self.files = {}
+
+    def add(self, key, filename):
+        if key in self.images:
+            return self.images[key]
+        if self.atlas is not None and self.atlas.contains(filename):
+            # draws straight out of the atlas texture
+            stim = AtlasImage(self.atlas, self.win, self.size, filename)
+            self.images[key] = stim
+            self.files[key] = filename
+            return stim
+        if not os.path.isfile(filename):
+            s = "stimulus file '%s' not found" % filename
+            raise FileNotFoundError(s)
+        # ImageStim decodes the file and creates its texture on creation, so
+        # this is the only time the image is read from disk
+        stim = visual.ImageStim(self.win, image=filename, size=self.size,
+                                autoLog=False)
+        stim.autoDraw = False
+        self.images[key] = stim
+        self.files[key] = filename
+        return stim
+
+    def get(self, key):
+        return self.images[key]
+
+    def filename(self, key):
+        return self.files[key]
+
+    def preload(self, clear=True):
+        # draw every image once so the driver has all the textures resident
+        for stim in self.images.values():
+            stim.draw()
+        if clear:
+            self.win.clearBuffer()
+
+    def __getitem__(self, key):
+        return self.images[key]
+
+    def __contains__(self, key):
+        return key in self.images
+
+    def __len__(self):
+        return len(self.images)
+
+def NavonFileName(stim_dir, global_letter, local_letter, color, ext):
+    return os.path.join(stim_dir, '{}-{}-{}.{}'.format(
+        global_letter, local_letter, color, ext))
+
+def LoadNavonCache(win, stim_dir, size, keys, ext, atlas=None):
+    """Decode the (global, local, color) images in keys from stim_dir: the
+    ones the session can show (see TrialPlan.PlanNavonKeys), not every
+    combination of its letters and colors, so a session neither decodes
+    images it never shows nor needs their files.  Images found in atlas (if
+    given) are drawn from the atlas instead of being decoded.
+    """
+    cache = StimulusCache(win, size, atlas)
+    for g, l, c in keys:
+        cache.add((g, l, c), NavonFileName(stim_dir, g, l, c, ext))
+    return cache
+
+def LoadImagePool(win, stim_dir, size, files, atlas=None):
+    """Decode the given image files of stim_dir (e.g. the TutuLG composites
+    or masks), keyed by file name
+    """
+    cache = StimulusCache(win, size, atlas)
+    for f in files:
+        cache.add(str(f), os.path.join(stim_dir, str(f)))
+    return cache
+
+def ImageSchedule(cache, files):
+    """The cached image for each of a block's per-trial file names, so that
+    setting up trial i is a lookup of item i
+    """
+    return [cache[str(f)] for f in files]
+
+########################################################################
+# Texture atlas
+########################################################################
+
+class TextureAtlas:
+    """All the images from one or more stimulus directories packed into a few
+    large textures (pages), as written by BuildAtlas().
+
+    Every image occupies one cell of cell_size pixels.  A page is drawn with
+    a single GratingStim whose spatial frequency and phase select the cell,
+    so changing which image is shown only changes texture coordinates.
+    """
+    def __init__(self, atlas_dir, manifest):
+        self.atlas_dir = atlas_dir
+        self.manifest = manifest
+        self.cell_size = manifest['cell_size']
+        self.page_size = manifest['page_size']
+        self.images = manifest['images']
+        self.page_stims = {}
+
+    def contains(self, filename):
+        return AtlasKey(filename) in self.images
+
+    def locate(self, filename):
+        """Return (page, phase) for the cell holding filename"""
+        try:
+            page, x, y = self.images[AtlasKey(filename)]
+        except KeyError:
+            s = "image '%s' is not in the atlas in '%s'" % (
+                filename, self.atlas_dir)
+            raise KeyError(s)
+        pw, ph = self.page_size
+        cw, ch = self.cell_size
+        # texture coordinates of the cell center; pages are stored top-down
+        # but OpenGL puts v = 0 at the bottom
+        u = (x + cw / 2) / pw
+        v = 1 - (y + ch / 2) / ph
+        return page, (0.5 - u, 0.5 - v)
+
+    def pageStim(self, win, page):
+        # pages are uploaded on first use, once per session
+        if page not in self.page_stims:
+            tex = np.load(os.path.join(
+                self.atlas_dir, self.manifest['pages'][page]))
+            tex = np.flipud(tex).astype(np.float32) / 127.5 - 1
+            stim = visual.GratingStim(
+                win, tex=tex, mask=None, size=self.cell_size, units='pix',
+                sf=(1 / self.page_size[0], 1 / self.page_size[1]),
+                colorSpace='rgb', color=[1, 1, 1], interpolate=False,
+                autoLog=False)
+            stim.autoDraw = False
+            self.page_stims[page] = stim
+        return self.page_stims[page]
+
+class AtlasImage:
+    """Stand-in for an ImageStim that draws one cell of a TextureAtlas.
+
+    setImage() only looks the file up in the atlas manifest; nothing is read
+    from disk or uploaded to the graphics card.
+    """
+    def __init__(self, atlas, win, size, filename=None):
+        self.atlas = atlas
+        self.win = win
+        self.size = size
+        self.image = None
+        self.page = None
+        self.phase = None
+        cw, ch = atlas.cell_size
+        pw, ph = atlas.page_size
+        # cycles per pixel needed to show exactly one cell at this size
+        self.sf = (cw / pw / size[0], ch / ph / size[1])
+        if filename is not None:
+            self.setImage(filename)
+
+    def setImage(self, filename):
+        self.page, self.phase = self.atlas.locate(filename)
+        self.image = filename
+
+    def draw(self):
+        stim = self.atlas.pageStim(self.win, self.page)
+        stim.size = self.size
+        stim.sf = self.sf
+        stim.phase = self.phase
+        stim.draw()
+
+def AtlasKey(filename):
+    return os.path.normpath(filename)
+
+def ListStimulusFiles(stim_dirs, ext):
+    files = []
+    for d in stim_dirs:
+        if not os.path.isdir(d):
+            continue
+        for f in sorted(os.listdir(d)):
+            if f.lower().endswith('.' + ext.lower()):
+                files.append(AtlasKey(os.path.join(d, f)))
+    return files
+
+def FileSignature(filename):
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime]
+
+def PowerOfTwo(n):
+    p = 1
+    while p < n:
+        p *= 2
+    return p
+
+def BuildAtlas(atlas_dir, files, cell_size, max_page=2048, padding=2):
+    """Pack the image files (e.g. the ones a session's plan shows) into
+    pages of at most max_page pixels and write them to atlas_dir along with
+    a manifest.  Images are resized to cell_size, the size they are drawn
+    at.
+    """
+    from PIL import Image
+
+    files = sorted(set([AtlasKey(f) for f in files]))
+    if len(files) == 0:
+        s = 'no images to put in the atlas in {}'.format(atlas_dir)
+        raise FileNotFoundError(s)
+    for f in files:
+        if not os.path.isfile(f):
+            s = "stimulus file '%s' not found" % f
+            raise FileNotFoundError(s)
+    cw, ch = [int(x) for x in cell_size]
+    step_x = cw + padding
+    step_y = ch + padding
+    page_w = PowerOfTwo(min(max_page, step_x * len(files)))
+    cols = page_w // step_x
+    rows = max_page // step_y
+    if cols == 0 or rows == 0:
+        s = 'cell size {} does not fit in a {} pixel page'.format(
+            cell_size, max_page)
+        raise ValueError(s)
+    per_page = cols * rows
+    n_pages = int(np.ceil(len(files) / per_page))
+    if n_pages == 1:
+        page_h = PowerOfTwo(step_y * int(np.ceil(len(files) / cols)))
+    else:
+        page_h = max_page
+
+    if not os.path.isdir(atlas_dir):
+        os.makedirs(atlas_dir)
+    images = {}
+    pages = []
+    for p in range(n_pages):
+        page = np.zeros((page_h, page_w, 4), dtype=np.uint8)
+        for i, f in enumerate(files[p * per_page:(p + 1) * per_page]):
+            x = (i % cols) * step_x
+            y = (i // cols) * step_y
+            with Image.open(f) as img:
+                img = img.convert('RGBA').resize((cw, ch), Image.LANCZOS)
+                page[y:y + ch, x:x + cw, :] = np.asarray(img)
+            images[f] = [p, x, y]
+        page_file = 'page-{:03d}.npy'.format(p)
+        np.save(os.path.join(atlas_dir, page_file), page)
+        pages.append(page_file)
+
+    manifest = {
+        'version': ATLAS_VERSION,
+        'cell_size': [cw, ch],
+        'page_size': [page_w, page_h],
+        'pages': pages,
+        'images': images,
+        'sources': {f: FileSignature(f) for f in files}}
+    with open(os.path.join(atlas_dir, ATLAS_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return TextureAtlas(atlas_dir, manifest)
+
+def LoadAtlas(atlas_dir, files=None, cell_size=None):
+    """Load the atlas in atlas_dir.  Returns None if there is none, or if
+    files/cell_size are given and the atlas does not hold all of those
+    files as they are now, or has another cell size.
+    """
+    try:
+        with open(os.path.join(atlas_dir, ATLAS_MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != ATLAS_VERSION:
+        return None
+    if cell_size is not None and (
+            manifest['cell_size'] != [int(x) for x in cell_size]):
+        return None
+    if files is not None:
+        sources = manifest['sources']
+        for f in files:
+            f = AtlasKey(f)
+            if f not in sources:
+                return None
+            try:
+                if FileSignature(f) != sources[f]:
+                    return None
+            except OSError:
+                return None
+    return TextureAtlas(atlas_dir, manifest)
+
+def LoadOrBuildAtlas(atlas_dir, files, cell_size):
+    """The atlas in atlas_dir if it holds every one of files, or else a new
+    one of just those files
+    """
+    atlas = LoadAtlas(atlas_dir, files, cell_size)
+    if atlas is None:
+        print('Building texture atlas in {}'.format(atlas_dir))
+        atlas = BuildAtlas(atlas_dir, files, cell_size)
+    return atlas
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Pack stimulus images into a texture atlas')
+    parser.add_argument('atlas_dir')
+    parser.add_argument('stim_dirs', nargs='+')
+    parser.add_argument('--size', type=int, nargs=2, default=[190, 250],
+                        help='cell size in pixels (width height)')
+    parser.add_argument('--ext', default='png')
+    parser.add_argument('--max-page', type=int, default=2048)
+    args = parser.parse_args()
+    files = ListStimulusFiles(args.stim_dirs, args.ext)
+    if len(files) == 0:
+        parser.error('no .{} files found in {}'.format(
+            args.ext, ', '.join(args.stim_dirs)))
+    atlas = BuildAtlas(args.atlas_dir, files, args.size, args.max_page)
+    print('{} images in {} page(s) of {}x{}'.format(
+        len(atlas.images), len(atlas.manifest['pages']),
+        atlas.page_size[0], atlas.page_size[1]))
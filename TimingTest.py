@@ -1,70 +1,354 @@
 #!/usr/bin/env python3
+"""Display timing benchmarks.
 
+Presents a stimulus on and off for thousands of frames at each of the
+durations the experiments use, with each kind of stimulus they draw, and
+with both ways they time displays: counting flips (RSVPLG.py's stream) and
+waiting for deadlines between flips (TutuLG.py). For every run it reports
+the distribution of frame periods, missed vertical blanks and the onset
+and duration errors, and writes all the results to a JSON file plus a CSV
+file with one row per run, so machines can be compared over time:
+
+    python TimingTest.py
+    python TimingTest.py --durations stim mask --stim-types shape png \\
+        --methods deadline --n-frames 5000 -o timing/lab1.json
+"""
+
+import sys
+if '--headless' in sys.argv:
+    # simulated window, clock and keyboard instead of PsychoPy (Headless.py)
+    import Headless
+    Headless.Install()
 import psychopy
 psychopy.useVersion('2024.2.4')
-from psychopy import core, visual, clock, info
+from psychopy import core, visual, clock
+from psychopy.hardware import keyboard
 import numpy as np
-import re
+import argparse, csv, json, os, time
+from FrameTiming import FramesFor, PrecisionWaiter
+from MachineProfile import (CheckFramePeriod, FramePeriodChangedMessage,
+                            LoadProfile, SaveProfile)
+from Startup import HostName
+from StimulusCache import StimulusCache
 
-def AdjustDurations(x, win):
-    frame_rate = win.monitorFramePeriod
-    n_frames = max(np.round(x / frame_rate), 1)
-    return frame_rate * (n_frames - .75)
+# (on, off) durations in seconds: the display durations of the experiments
+# shown on and off, and the T2 lags as the onset asynchrony of a 50 ms
+# stimulus
+DURATIONS = {
+    'stim': (0.050, 0.050), # TutuLG dur_stim
+    'rsvp_stim': (0.067, 0.067), # RSVPLG stim
+    'isi': (0.083, 0.083), # RSVPLG isi
+    'mask': (0.050, 0.050), # TutuLG dur_mask
+    'lag300': (0.050, 0.250),
+    'lag750': (0.050, 0.700)}
+STIM_TYPES = ['shape', 'texture', 'png', 'textbox']
+METHODS = ['frames', 'deadline']
 
-wait_granularity = 0.001
-wait_maximum = .010
+stim_size = [190, 250]
+wait_spin_margin = 0.002
+# clock.wait with no CPU hogging is a plain sleep, but on PsychoPy's clock.
+# A deadline 10 s in the past can only be on the wrong clock (a win.flip()
+# time), which would make every run meaningless, so it stops the benchmark
+waiter = PrecisionWaiter(clock.getTime, wait_spin_margin,
+                         lambda s: clock.wait(s, hogCPUperiod=0), max_late=10)
 def WaitUntil(t):
-    pass
-
-def GetScreenResolution():
-    # identify screen resolution based on the computer
-    default_res = [1920, 1080]
-    rti = info.RunTimeInfo(win=False, refreshTest=None)
-    comp = rti['systemHostName']
-    if re.match('A[0-9]{6}', comp) != None or 'Yesun' in comp:
-        # this is a computer with a CSUEB asset tag, usually one of our
-        # testing computers, or my smaller work laptop
-        return default_res
-    elif 'GoldenChild' in comp:
-        # larger laptop
-        return [1792, 1120]
-    else:
+    # t is on clock.getTime(), never a win.flip() time (see PrecisionWaiter)
+    return waiter.waitUntil(t)
+
+def GetScreenResolution(machine):
+    if machine == None:
         # default
-        print('COMPUTER NOT IDENTIFIED: DEFAULT RESOLUTION SET')
+        print('COMPUTER NOT CALIBRATED: DEFAULT RESOLUTION SET')
         return [800, 600]
+    return machine['resolution']
+
+########################################################################
+# Stimuli: prepare(i) sets up presentation i, draw() draws it
+########################################################################
+
+class ShapeStimulus:
+    def __init__(self, win, files):
+        self.dot = visual.Circle(
+            win, radius=100, lineColor=None, fillColor='purple',
+            units='pix', colorSpace='rgb255')
+
+    def prepare(self, i):
+        pass
+
+    def draw(self):
+        self.dot.draw()
+
+class TextureStimulus:
+    """Cycles through images decoded once up front, as the tasks do"""
+    def __init__(self, win, files):
+        self.cache = StimulusCache(win, stim_size)
+        for f in files:
+            self.cache.add(f, f)
+        self.cache.preload()
+        self.images = [self.cache[f] for f in files]
+        self.current = self.images[0]
+
+    def prepare(self, i):
+        self.current = self.images[i % len(self.images)]
+
+    def draw(self):
+        self.current.draw()
+
+class PNGStimulus:
+    """Loads the next image from disk for every presentation"""
+    def __init__(self, win, files):
+        self.files = files
+        self.image = visual.ImageStim(win, size=stim_size, autoLog=False)
+
+    def prepare(self, i):
+        self.image.setImage(self.files[i % len(self.files)])
+
+    def draw(self):
+        self.image.draw()
+
+class TextStimulus:
+    """New text for every presentation, like the prompts and feedback"""
+    def __init__(self, win, files):
+        self.box = visual.TextBox2(
+            win, text='', font='Arial', letterHeight=24,
+            alignment='center', colorSpace='rgb255', color=[0, 0, 0])
+
+    def prepare(self, i):
+        self.box.setText('Trial {}'.format(i + 1))
+
+    def draw(self):
+        self.box.draw()
 
-stimOn = 0.3
-stimOff = 0.1
+STIMULI = {
+    'shape': ShapeStimulus,
+    'texture': TextureStimulus,
+    'png': PNGStimulus,
+    'textbox': TextStimulus}
+
+########################################################################
+# Runs
+########################################################################
+
+def RunFrames(win, stim, on_frames, off_frames, n_cycles):
+    """Flip every frame, counting flips. Returns the time of every flip,
+    the number of frames each flip was meant to stay up, the index of each
+    onset flip and the time each onset should have come.
+    """
+    n = n_cycles * (on_frames + off_frames) + 1
+    flips = np.zeros(n)
+    intended = np.ones(n, dtype=int)
+    onsets = np.arange(n_cycles) * (on_frames + off_frames) + 1
+    i = 0
+    win.clearBuffer()
+    flips[i] = win.flip()
+    for c in range(n_cycles):
+        stim.prepare(c)
+        for f in range(on_frames):
+            stim.draw()
+            i += 1
+            flips[i] = win.flip()
+        for f in range(off_frames):
+            i += 1
+            flips[i] = win.flip()
+    # counting frames, each onset is due a fixed number of frames after
+    # the one before it
+    t_on = flips[onsets]
+    targets = np.concatenate([t_on[:1], t_on[:-1] + (on_frames + off_frames) *
+                              win.monitorFramePeriod])
+    return flips, intended, onsets, targets
+
+def RunDeadlines(win, stim, on_frames, off_frames, n_cycles):
+    """Flip only at onsets and offsets, waiting for deadlines on the clock
+    in between as TutuLG.py does. Returns the same as RunFrames().
+    """
+    period = win.monitorFramePeriod
+    pre_flip_window = period * 0.5
+    on_dur = on_frames * period
+    soa = (on_frames + off_frames) * period
+    n = 2 * n_cycles + 1
+    flips = np.zeros(n)
+    intended = np.zeros(n, dtype=int)
+    intended[0::2] = off_frames
+    intended[1::2] = on_frames
+    onsets = np.arange(n_cycles) * 2 + 1
+    win.clearBuffer()
+    flips[0] = win.flip()
+    # win.flip() times are not on the clock WaitUntil() reads, so the
+    # deadlines count from the clock right after the first flip
+    t0 = clock.getTime() + off_frames * period
+    for c in range(n_cycles):
+        stim.prepare(c)
+        stim.draw()
+        WaitUntil(t0 + c * soa - pre_flip_window)
+        flips[2 * c + 1] = win.flip()
+        win.clearBuffer()
+        WaitUntil(t0 + c * soa + on_dur - pre_flip_window)
+        flips[2 * c + 2] = win.flip()
+    targets = flips[0] + off_frames * period + np.arange(n_cycles) * soa
+    return flips, intended, onsets, targets
+
+def Percentiles(x, scale=1000, q=(50, 95, 99)):
+    if len(x) == 0:
+        return [float('nan')] * (len(q) + 1)
+    return [float(v) for v in np.percentile(x * scale, q)] + [
+        float(np.max(x) * scale)]
+
+def Analyze(flips, intended, onsets, targets, period, on_frames):
+    """Timing statistics of one run, times in ms"""
+    frames = np.diff(flips) / period
+    actual = np.round(frames).astype(int)
+    # frame periods measured by every interval, per frame
+    periods = np.diff(flips) / np.maximum(actual, 1)
+    missed = int(np.sum(np.maximum(actual - intended[:-1], 0)))
+    off_by = int(np.sum(actual != intended[:-1]))
+    t_on = flips[onsets]
+    onset_error = t_on - targets
+    offsets = onsets + (on_frames if np.all(intended == 1) else 1)
+    duration_error = flips[offsets] - t_on - on_frames * period
+    r = {
+        'n_flips': len(flips),
+        'n_onsets': len(onsets),
+        'period_mean_ms': float(np.mean(periods) * 1000),
+        'period_sd_ms': float(np.std(periods) * 1000)}
+    p = np.percentile(periods * 1000, [1, 50, 99])
+    r.update({'period_p1_ms': float(p[0]), 'period_p50_ms': float(p[1]),
+              'period_p99_ms': float(p[2])})
+    r['missed_vsyncs'] = missed
+    r['intervals_off'] = off_by
+    for name, x in [('onset_error', np.abs(onset_error)),
+                    ('duration_error', np.abs(duration_error))]:
+        p50, p95, p99, pmax = Percentiles(x)
+        r.update({name + '_p50_ms': p50, name + '_p95_ms': p95,
+                  name + '_p99_ms': p99, name + '_max_ms': pmax})
+    r['late_onsets'] = int(np.sum(np.abs(onset_error) > period / 2))
+    return {k: round(v, 4) if isinstance(v, float) else v
+            for k, v in r.items()}
+
+def FindStimulusFiles(stim_dir, ext='png', n=32):
+    if not os.path.isdir(stim_dir):
+        return []
+    files = sorted([f for f in os.listdir(stim_dir) if f.endswith('.' + ext)])
+    return [os.path.join(stim_dir, f) for f in files[:n]]
+
+########################################################################
+# Main
+########################################################################
+
+parser = argparse.ArgumentParser(description='Display timing benchmarks')
+parser.add_argument('--durations', nargs='+', default=list(DURATIONS),
+                    choices=list(DURATIONS))
+parser.add_argument('--stim-types', nargs='+', default=STIM_TYPES,
+                    choices=STIM_TYPES)
+parser.add_argument('--methods', nargs='+', default=METHODS, choices=METHODS)
+parser.add_argument('--n-frames', type=int, default=2000,
+                    help='length of each run, in frames')
+parser.add_argument('--stim-dir', default='stim',
+                    help='images for the texture and png stimuli')
+parser.add_argument('-o', '--output',
+                    help='results file (.json, with a .csv beside it)')
+parser.add_argument('--save-profile', action='store_true',
+                    help="add the results to this computer's profile (see "
+                    "MachineProfile.py)")
+args, unknown_args = parser.parse_known_args()
+
+host = HostName()
+machine = LoadProfile(host)
+if args.save_profile and machine == None:
+    print('Run python MachineProfile.py first to calibrate this computer')
+    core.quit()
+if args.output == None:
+    args.output = os.path.join('timing', 'TimingTest-{}-{}.json'.format(
+        host, time.strftime('%Y%m%d-%H%M%S')))
 
 win = visual.Window(
-    size=GetScreenResolution(), fullscr=True, screen=0,
+    size=GetScreenResolution(machine), fullscr=True, screen=0,
     winType='pyglet', allowStencil=False, monitor='Default',
     color=[200, 200, 200], colorSpace='rgb255',
     backgroundImage=None, backgroundFit=None,
-    blendMode='avg', useFBO=True, units='pix')
-
-dot = visual.Circle(win, radius=100, lineColor=None, fillColor="purple",
-    units='pix', colorSpace='rgb255')
+    blendMode='avg', useFBO=True, units='pix',
+    checkTiming=(machine == None))
+win.mouseVisible = False
+if machine != None:
+    win.monitorFramePeriod = machine['frame_period']
+    measured = CheckFramePeriod(win, machine)
+    if measured != None:
+        win.close()
+        print(FramePeriodChangedMessage(measured, machine))
+        core.quit()
+kb = keyboard.Keyboard()
+period = win.monitorFramePeriod
 
-stimOn = AdjustDurations(stimOn, win)
-stimOff = AdjustDurations(stimOff, win)
+stim_files = FindStimulusFiles(args.stim_dir)
+n_runs = len(args.durations) * len(args.stim_types) * len(args.methods)
+print('{} runs of {} frames, about {:.0f} minutes'.format(
+    n_runs, args.n_frames, n_runs * args.n_frames * period / 60))
 
-n = 5
-t = np.zeros(n)
-win.clearBuffer()
-dot.draw()
-for i in range(n):
-    clock.wait(stimOff)
-    t[i] = win.flip()
-    win.clearBuffer()
-    clock.wait(stimOn)
-    win.flip()
-    dot.draw()
+results = []
+for stim_type in args.stim_types:
+    if stim_type in ('texture', 'png') and len(stim_files) == 0:
+        print('skipping {}: no .png files in {}'.format(
+            stim_type, args.stim_dir))
+        continue
+    stim = STIMULI[stim_type](win, stim_files)
+    for d in args.durations:
+        on_frames = FramesFor(DURATIONS[d][0], period)
+        off_frames = FramesFor(DURATIONS[d][1], period)
+        n_cycles = max(args.n_frames // (on_frames + off_frames), 2)
+        for method in args.methods:
+            if method == 'frames':
+                run = RunFrames
+            else:
+                run = RunDeadlines
+            flips, intended, onsets, targets = run(
+                win, stim, on_frames, off_frames, n_cycles)
+            r = {'stim_type': stim_type, 'duration': d, 'method': method,
+                 'on_frames': on_frames, 'off_frames': off_frames}
+            r.update(Analyze(flips, intended, onsets, targets, period,
+                             on_frames))
+            results.append(r)
+            print('{:<8} {:<10} {:<9} period {:.3f} ms, {} missed, onset '
+                  'error p95 {:.2f} ms'.format(
+                      stim_type, d, method, r['period_p50_ms'],
+                      r['missed_vsyncs'], r['onset_error_p95_ms']))
+            if len(kb.getKeys(keyList=['escape'])) > 0:
+                break
+        else:
+            continue
+        break
+    else:
+        continue
+    break
 
 win.clearBuffer()
 win.flip()
-
 win.close()
 
-print(t)
-print(np.diff(t))
\ No newline at end of file
+dirname = os.path.dirname(args.output)
+if dirname != '' and not os.path.isdir(dirname):
+    os.makedirs(dirname)
+with open(args.output, 'w') as f:
+    json.dump({
+        'host': host,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'psychopy': psychopy.__version__,
+        'resolution': list(win.size),
+        'frame_period_ms': period * 1000,
+        'n_frames': args.n_frames,
+        'runs': results}, f, indent=1)
+if len(results) > 0:
+    with open(os.path.splitext(args.output)[0] + '.csv', 'w',
+              newline='') as f:
+        writer = csv.DictWriter(f, ['host'] + list(results[0].keys()),
+                                lineterminator='\n')
+        writer.writeheader()
+        for r in results:
+            writer.writerow(dict(r, host=host))
+print('results written to {}'.format(args.output))
+if args.save_profile:
+    machine['benchmark'] = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results_file': args.output,
+        'n_frames': args.n_frames,
+        'runs': results}
+    print('results added to {}'.format(SaveProfile(machine)))
+core.quit()
@@ -0,0 +1,344 @@
+"""Trial data output for the RSVP local/global tasks.
+
+TrialRecord holds the session's trials in a preallocated NumPy structured
+array with a fixed, typed schema, and saves them as a binary columnar .npz
+file. CSVRowWriter appends one row per trial to a CSV file that stays open
+for the whole session. BackgroundWriter runs any such writer on its own
+thread, so the trial loop only hands a finished row to a queue and carries
+on.
+"""
+
+import atexit
+import csv
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+# Trial columns of the task data files, in output order. RSVPLG.py puts the
+# conditions file columns first and the session information last; TutuLG.py
+# puts the session information first. Both end with the per-trial display
+# timing checks of FrameTiming.FlipLog.
+TIMING_FIELDS = [
+    ('timing_events', 'i4'),
+    ('timing_events_off', 'i4'),
+    ('timing_dropped_frames', 'i4'),
+    ('timing_max_error', 'f8')]
+
+RSVPLG_CONDITION_COLUMNS = ['row', 't1_level', 't2_level', 't2_lag']
+RSVPLG_TRIAL_FIELDS = [
+    ('row', 'i4'),
+    ('t1_level', 'U6'),
+    ('t2_level', 'U6'),
+    ('t2_lag', 'i4'),
+    ('trial', 'i4'),
+    ('trial_type', 'U8'),
+    ('trial_time', 'U32'),
+    ('global_letters', 'U32'),
+    ('local_letters', 'U32'),
+    ('t1_pos', 'i4'),
+    ('t1', 'U8'),
+    ('t2', 'U8'),
+    ('t1_corr', 'U4'),
+    ('t2_corr', 'U4'),
+    ('stream_onset', 'f8'),
+    ('stream_dur', 'f8'),
+    ('stream_missed_frames', 'i4'),
+    ('t1_resp', 'U16'),
+    ('t1_acc', 'i1'),
+    ('t1_rt', 'f8'),
+    ('t2_resp', 'U16'),
+    ('t2_acc', 'i1'),
+    ('t2_rt', 'f8')] + TIMING_FIELDS
+
+TUTU_TRIAL_FIELDS = [
+    ('trial', 'i4'),
+    ('trialtime', 'U15'),
+    ('t1_level', 'U6'),
+    ('t2_level', 'U6'),
+    ('t2_lag', 'i4'),
+    ('t1', 'U1'),
+    ('t2', 'U1'),
+    ('distractor1', 'U1'),
+    ('distractor2', 'U1'),
+    ('stimfile1', 'U32'),
+    ('stimfile2', 'U32'),
+    ('t1_corr', 'U4'),
+    ('t2_corr', 'U4'),
+    ('maskfile1', 'U32'),
+    ('maskfile2', 'U32'),
+    ('t1_resp', 'U16'),
+    ('t1_acc', 'i1'),
+    ('t1_rt', 'f8'),
+    ('t2_resp', 'U16'),
+    ('t2_acc', 'i1'),
+    ('t2_rt', 'f8'),
+    ('t1_dur', 'f8'),
+    ('t2_dur', 'f8'),
+    ('t1mask_soa', 'f8'),
+    ('t2mask_soa', 'f8'),
+    ('t1t2_soa', 'f8'),
+    ('t1_onset', 'f8'),
+    ('t1_offset', 'f8'),
+    ('mask1_onset', 'f8'),
+    ('t2_onset', 'f8'),
+    ('t2_offset', 'f8'),
+    ('mask2_onset', 'f8')] + TIMING_FIELDS
+
+class TrialRecord:
+    """Typed per-trial data with a fixed schema.
+
+    fields is a list of (name, dtype) pairs, one per column, in output order.
+    Storage for n_trials rows is allocated up front (and doubled if a session
+    runs longer). Float columns start out as NaN and are written to CSV as
+    empty cells when never set.
+
+    info holds session-level values (participant, version, ...) that are the
+    same on every row; they are stored once and put before (info_first) or
+    after the trial columns in CSV rows.
+    """
+    def __init__(self, fields, n_trials=1, info=None, info_first=True):
+        self.dtype = np.dtype(fields)
+        self.names = self.dtype.names
+        self.info = dict(info) if info is not None else {}
+        self.info_first = info_first
+        self.n = 0
+        self.data = self._empty(max(n_trials, 1))
+
+    def _empty(self, n):
+        data = np.zeros(n, dtype=self.dtype)
+        for name in self.names:
+            if self.dtype[name].kind == 'f':
+                data[name] = np.nan
+        return data
+
+    def allocate(self, n_trials):
+        # make sure there is room for n_trials more trials
+        needed = self.n + n_trials
+        if needed > len(self.data):
+            data = self._empty(max(needed, 2 * len(self.data)))
+            data[:self.n] = self.data[:self.n]
+            self.data = data
+
+    def set(self, name, value):
+        if self.n >= len(self.data):
+            self.allocate(1)
+        if self.dtype[name].kind == 'U':
+            value = str(value)
+            if len(value) > self.dtype[name].itemsize // 4:
+                s = "value '{}' is too long for data column {} ({})".format(
+                    value, name, self.dtype[name])
+                raise ValueError(s)
+        self.data[name][self.n] = value
+
+    def get(self, name):
+        return self.data[name][self.n].item()
+
+    def setInfo(self, name, value):
+        self.info[name] = value
+
+    def columns(self):
+        if self.info_first:
+            return list(self.info.keys()) + list(self.names)
+        return list(self.names) + list(self.info.keys())
+
+    def row(self, i):
+        """Trial i as a dict of plain Python values, in column order"""
+        trial = {}
+        for name in self.names:
+            v = self.data[name][i].item()
+            if isinstance(v, float) and v != v:
+                v = ''
+            trial[name] = v
+        if self.info_first:
+            row = dict(self.info)
+            row.update(trial)
+        else:
+            row = trial
+            row.update(self.info)
+        return row
+
+    def endTrial(self):
+        """Finish the current trial and return it as a row"""
+        row = self.row(self.n)
+        self.n += 1
+        return row
+
+    def saveNPZ(self, filename):
+        """Save completed trials as one array per column, with the session
+        info as a JSON string; load with LoadTrialRecord()
+        """
+        columns = {name: self.data[name][:self.n] for name in self.names}
+        columns['__info__'] = np.array(json.dumps(self.info, default=str))
+        dirname = os.path.dirname(filename)
+        if dirname != '' and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        np.savez_compressed(filename, **columns)
+
+def LoadTrialRecord(filename):
+    """Read a file written by TrialRecord.saveNPZ() and return (columns,
+    info), where columns maps column names to arrays
+    """
+    with np.load(filename, allow_pickle=False) as f:
+        columns = {k: f[k] for k in f.files if k != '__info__'}
+        info = json.loads(str(f['__info__'])) if '__info__' in f.files else {}
+    return columns, info
+
+class CSVRowWriter:
+    """Append-only CSV output with a fixed set of columns.
+
+    The file is opened on the first write(), and its columns are fixed at
+    that point: the header of an existing file (e.g. earlier blocks for the
+    same participant), or else the keys of the first row. Rows are held in
+    memory and written, flushed and fsync'ed every flush_every rows and on
+    flush(), so a crash loses at most the unflushed rows and never leaves a
+    partial line.
+    """
+    def __init__(self, filename, sep=',', flush_every=10):
+        self.filename = filename
+        self.sep = sep
+        self.flush_every = flush_every
+        self.file = None
+        self.writer = None
+        self.header = None
+        self.buffer = []
+        self.n_written = 0
+
+    def initializeDirectory(self):
+        # check if the data directory exists, and if not create it
+        dirname = os.path.dirname(self.filename)
+        if dirname == '' or os.path.isdir(dirname):
+            return
+        elif os.path.exists(dirname):
+            s = "data directory '%s' is an existing file" % dirname
+            raise NotADirectoryError(s)
+        else:
+            os.makedirs(dirname)
+
+    def open(self, fields):
+        # open the data file for appending, reading the header from it if it
+        # already exists or writing one if not
+        self.initializeDirectory()
+        if os.path.exists(self.filename) and not os.path.isfile(self.filename):
+            s = "data file '%s' is an existing directory" % self.filename
+            raise IsADirectoryError(s)
+        self.header = None
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'r', newline='') as f:
+                line = f.readline().rstrip('\r\n')
+            if len(line) > 0:
+                self.header = line.split(self.sep)
+        self.file = open(self.filename, 'a', newline='')
+        self.writer = csv.writer(self.file, delimiter=self.sep,
+                                 lineterminator='\n')
+        if self.header == None:
+            self.header = list(fields)
+            self.writer.writerow(self.header)
+        missing = [k for k in fields if k not in self.header]
+        if len(missing) > 0:
+            print('WARNING: columns not in the header of {} will not be '
+                  'saved: {}'.format(self.filename, ', '.join(missing)))
+
+    def write(self, row):
+        if len(row) == 0:
+            return
+        if self.file == None:
+            self.open(row.keys())
+        self.buffer.append([row.get(k, '') for k in self.header])
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.file == None:
+            return
+        if len(self.buffer) > 0:
+            self.writer.writerows(self.buffer)
+            self.n_written += len(self.buffer)
+            self.buffer = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file == None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+class BackgroundWriter:
+    """Runs a writer's write()/flush()/close() on a dedicated thread.
+
+    write() copies the row onto a bounded queue and returns; it only blocks
+    if the writer thread has fallen maxsize rows behind. close() (also run
+    at exit, so it covers core.quit) drains the queue and raises if any row
+    failed to be written.
+    """
+    _stop = object()
+
+    def __init__(self, writer, maxsize=256):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize)
+        self.n_submitted = 0
+        self.n_done = 0
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(
+            target=self._run, name='BackgroundWriter', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is self._stop:
+                    return
+                method, row = item
+                if method == 'write':
+                    self.writer.write(row)
+                    self.n_done += 1
+                elif method == 'flush':
+                    self.writer.flush()
+            except Exception as e:
+                if self.error == None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _put(self, item):
+        if self.closed:
+            raise RuntimeError('BackgroundWriter is closed')
+        self.queue.put(item)
+
+    def write(self, row):
+        self._put(('write', dict(row)))
+        self.n_submitted += 1
+
+    def flush(self):
+        self._put(('flush', None))
+
+    def drain(self):
+        self.queue.join()
+        self.check()
+
+    def check(self):
+        if self.error != None:
+            s = 'error writing data to {}: {}'.format(
+                getattr(self.writer, 'filename', 'data file'), self.error)
+            raise RuntimeError(s)
+        if self.n_done != self.n_submitted:
+            s = '{} of {} data rows were not written'.format(
+                self.n_submitted - self.n_done, self.n_submitted)
+            raise RuntimeError(s)
+
+    def close(self):
+        if self.closed:
+            return
+        self._put(('flush', None))
+        self.drain()
+        self.queue.put(self._stop)
+        self.thread.join()
+        self.closed = True
+        self.writer.close()
@@ -0,0 +1,368 @@
+"""Trial plans for the RSVP local/global tasks.
+
+A block's trial order and every stimulus in it are generated up front as
+NumPy arrays, one row per trial, so the trial loop only reads row i. Plans
+are generated from a seed derived from the participant, so a session can be
+regenerated exactly, and are saved next to the data.
+
+Plans can also be made ahead of time and replayed by the task scripts:
+
+    python TrialPlan.py RSVPLG Experiment --seed 1234 -o plans/s1234.npz
+    python RSVPLG.py --plan plans/s1234.npz
+"""
+
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Defaults for the command line, matching the settings at the top of
+# RSVPLG.py and TutuLG.py. A script replaying a plan checks that the plan
+# was made with its own settings.
+TASK_SETTINGS = {
+    'RSVPLG': {
+        'conditions_file': 'RSVPLGTrials.csv',
+        'n_trials_per_cell': 20,
+        'n_trials_practice': 16,
+        'n_trials_warmup': 5,
+        'stream_frames': 12,
+        'distractor_letters': 'ACEFLMNPTUXYZ',
+        't1_letters': 'HS',
+        't2_letters': 'HS',
+        't1_pos_list': [4, 5, 6],
+        'distractor_color': 'black',
+        't1_color': 'white',
+        't2_color': 'white'},
+    'TutuLG': {
+        'conditions_file': 'TrialList.csv',
+        'n_trials_per_cell': 12,
+        'n_trials_practice': 16,
+        'n_trials_warmup': 4,
+        'target_letters': 'HS',
+        'distractor_letters': 'AE',
+        'n_mask_files': 4,
+        'mask_file_prefix': 'mask-',
+        'mask_file_ext': 'png',
+        'stim_file_ext': 'png',
+        'intro_t2_lag': 750}
+    }
+
+def ParticipantSeed(*args):
+    """Deterministic 32-bit seed from the session identifiers (experiment,
+    participant, session, block type, ...)
+    """
+    s = '-'.join([str(a) for a in args])
+    return int(hashlib.sha256(s.encode('utf-8')).hexdigest()[:8], 16)
+
+def ReadConditions(filename):
+    """Read a conditions CSV file into a list of dicts, converting numbers,
+    like psychopy.data.importConditions()
+    """
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        conditions = [dict(row) for row in csv.DictReader(f)]
+    for row in conditions:
+        for k, v in row.items():
+            row[k] = ConvertNumber(v)
+    return conditions
+
+def ConvertNumber(s):
+    for f in (int, float):
+        try:
+            return f(s)
+        except ValueError:
+            pass
+    return s
+
+def FullRandomOrder(rng, n_conditions, n_trials):
+    """Condition indices for n_trials trials: whole sets of every condition,
+    shuffled all together (PsychoPy's 'fullRandom'), truncated to n_trials
+    """
+    n_reps = int(np.ceil(n_trials / n_conditions))
+    order = rng.permutation(np.tile(np.arange(n_conditions), n_reps))
+    return order[:n_trials]
+
+def CorrectResponses(letters):
+    """Accepted response keys for each target letter, as strings ('hH')"""
+    keys = {}
+    for c in np.unique(letters):
+        if c.lower() == c.upper():
+            keys[c] = c
+        else:
+            keys[c] = c.lower() + c.upper()
+    return np.array([keys[c] for c in letters])
+
+def GenerateRSVPBlock(rng, conditions, n_trials, stream_frames,
+                      distractor_letters, t1_letters, t2_letters, t1_pos_list,
+                      distractor_color, t1_color, t2_color):
+    """Generate every trial of an RSVPLG block.
+
+    conditions is the list of condition dicts from the conditions file (with
+    t1_level, t2_level and t2_lag). stream_frames is the stream length, or a
+    list of lengths to choose from on each trial. Returns a dict of arrays
+    with one row per trial; the letter and color arrays have shape
+    (n_trials, max stream length), and only the first n_frames[i] entries of
+    row i are used.
+    """
+    n = int(n_trials)
+    rows = np.arange(n)
+    condition = FullRandomOrder(rng, len(conditions), n)
+    block = {'condition': condition}
+    for k in conditions[0].keys():
+        block[k] = np.array([conditions[c][k] for c in condition])
+    t1_level = block['t1_level']
+    t2_level = block['t2_level']
+    t2_lag = block['t2_lag'].astype(int)
+
+    if type(stream_frames) in (list, tuple):
+        n_frames = rng.choice(stream_frames, n)
+    else:
+        n_frames = np.full(n, stream_frames)
+    max_frames = int(np.max(n_frames))
+
+    # each row is an independent permutation of the distractors, repeated if
+    # there are fewer distractors than frames
+    letters = np.array(distractor_letters)
+    if len(letters) < max_frames:
+        letters = np.tile(letters, int(np.ceil(max_frames / len(letters))))
+    letters = np.tile(letters, (n, 1))
+    global_letters = rng.permuted(letters, axis=1)[:, :max_frames]
+    local_letters = rng.permuted(letters, axis=1)[:, :max_frames]
+
+    # insert T1 and T2
+    t1_pos = rng.choice(t1_pos_list, n)
+    t1 = rng.choice(t1_letters, n)
+    t2 = rng.choice(t2_letters, n)
+    t1_index = t1_pos - 1
+    t2_index = t1_pos + t2_lag - 1
+    if np.any(t2_index >= n_frames):
+        raise ValueError('T2 falls after the end of the stream')
+    g = t1_level == 'global'
+    global_letters[rows[g], t1_index[g]] = t1[g]
+    local_letters[rows[~g], t1_index[~g]] = t1[~g]
+    g = t2_level == 'global'
+    global_letters[rows[g], t2_index[g]] = t2[g]
+    local_letters[rows[~g], t2_index[~g]] = t2[~g]
+
+    colors = np.full((n, max_frames), distractor_color,
+                     dtype='U{}'.format(max(len(distractor_color),
+                                            len(t1_color), len(t2_color))))
+    colors[rows, t1_index] = t1_color
+    colors[rows, t2_index] = t2_color
+
+    block.update({
+        'n_frames': n_frames,
+        't1_pos': t1_pos,
+        't1': t1,
+        't2': t2,
+        't1_corr': CorrectResponses(t1),
+        't2_corr': CorrectResponses(t2),
+        'global_letters': global_letters,
+        'local_letters': local_letters,
+        'colors': colors})
+    return block
+
+def GenerateTutuBlock(rng, conditions, n_trials, target_letters,
+                      distractor_letters, n_mask_files, mask_file_prefix,
+                      mask_file_ext, stim_file_ext, fixed_t2_lag=None):
+    """Generate every trial of a TutuLG block: targets, distractors, and the
+    stimulus and mask file for each of T1 and T2. Returns a dict of arrays
+    with one row per trial.
+    """
+    n = int(n_trials)
+    condition = FullRandomOrder(rng, len(conditions), n)
+    block = {'condition': condition}
+    for k in conditions[0].keys():
+        block[k] = np.array([conditions[c][k] for c in condition])
+    if fixed_t2_lag is not None:
+        block['t2_lag'] = np.full(n, fixed_t2_lag)
+
+    t1 = rng.choice(list(target_letters), n)
+    t2 = rng.choice(list(target_letters), n)
+    d1 = rng.choice(list(distractor_letters), n)
+    d2 = rng.choice(list(distractor_letters), n)
+    block.update({
+        't1': t1,
+        't2': t2,
+        'distractor1': d1,
+        'distractor2': d2,
+        'stimfile1': NavonCompositeFiles(
+            block['t1_level'], t1, d1, stim_file_ext),
+        'stimfile2': NavonCompositeFiles(
+            block['t2_level'], t2, d2, stim_file_ext),
+        't1_corr': CorrectResponses(t1),
+        't2_corr': CorrectResponses(t2),
+        'maskfile1': MaskFiles(rng.choice(n_mask_files, n) + 1,
+                               mask_file_prefix, mask_file_ext),
+        'maskfile2': MaskFiles(rng.choice(n_mask_files, n) + 1,
+                               mask_file_prefix, mask_file_ext)})
+    return block
+
+def NavonCompositeFiles(levels, targets, distractors, ext):
+    # {global}-{local}.{ext}, with the target at the requested level
+    local = np.char.lower(levels) == 'local'
+    global_letters = np.where(local, distractors, targets)
+    local_letters = np.where(local, targets, distractors)
+    return np.char.add(np.char.add(np.char.add(
+        global_letters, '-'), local_letters), '.' + ext)
+
+def MaskFiles(numbers, prefix, ext):
+    return np.char.add(np.char.add(prefix, numbers.astype(str)), '.' + ext)
+
+def RSVPLGTrialTypes(block_type):
+    if block_type in ('Practice T1', 'Practice T2', 'Practice Both'):
+        return ['prac']
+    return ['warmup', 'exp']
+
+def RSVPLGTrialCounts(n_conditions, n_trials_per_cell, n_trials_practice,
+                      n_trials_warmup):
+    return {
+        'warmup': n_trials_warmup,
+        'prac': n_trials_practice,
+        'exp': n_trials_per_cell * n_conditions}
+
+def TutuTrialCounts(block_type, n_conditions, n_trials_per_cell,
+                    n_trials_practice, n_trials_warmup):
+    """Trial groups of a TutuLG block, in order, with their sizes"""
+    if block_type in ('Introduction', 'Practice'):
+        return {'warmup': 0, 'main': n_trials_practice}
+    return {'warmup': n_trials_warmup, 'main': n_trials_per_cell * n_conditions}
+
+def MakeRSVPLGPlan(rng, conditions, block_type, settings):
+    counts = RSVPLGTrialCounts(
+        len(conditions), settings['n_trials_per_cell'],
+        settings['n_trials_practice'], settings['n_trials_warmup'])
+    blocks = {}
+    for trial_type in RSVPLGTrialTypes(block_type):
+        blocks[trial_type] = GenerateRSVPBlock(
+            rng, conditions, counts[trial_type], settings['stream_frames'],
+            list(settings['distractor_letters']),
+            list(settings['t1_letters']), list(settings['t2_letters']),
+            settings['t1_pos_list'], settings['distractor_color'],
+            settings['t1_color'], settings['t2_color'])
+    return blocks
+
+def MakeTutuPlan(rng, conditions, block_type, settings):
+    counts = TutuTrialCounts(
+        block_type, len(conditions), settings['n_trials_per_cell'],
+        settings['n_trials_practice'], settings['n_trials_warmup'])
+    fixed_t2_lag = None
+    if block_type == 'Introduction':
+        fixed_t2_lag = settings['intro_t2_lag']
+    blocks = {}
+    for trial_type, n in counts.items():
+        if n == 0:
+            continue
+        blocks[trial_type] = GenerateTutuBlock(
+            rng, conditions, n, settings['target_letters'],
+            settings['distractor_letters'], settings['n_mask_files'],
+            settings['mask_file_prefix'], settings['mask_file_ext'],
+            settings['stim_file_ext'], fixed_t2_lag)
+    return blocks
+
+def PlanNavonKeys(blocks):
+    """The (global, local, color) images an RSVPLG plan shows"""
+    keys = set()
+    for block in blocks.values():
+        for i, n in enumerate(block['n_frames']):
+            keys.update(zip(block['global_letters'][i, :n],
+                            block['local_letters'][i, :n],
+                            block['colors'][i, :n]))
+    return sorted([(str(g), str(l), str(c)) for g, l, c in keys])
+
+def PlanImageFiles(blocks, columns=('stimfile1', 'stimfile2',
+                                    'maskfile1', 'maskfile2')):
+    """The image files a TutuLG plan shows"""
+    files = set()
+    for block in blocks.values():
+        for k in columns:
+            files.update([str(f) for f in block[k]])
+    return sorted(files)
+
+def CheckPlanSettings(info, settings):
+    """Names of the settings that differ between a plan and the script"""
+    plan_settings = info.get('settings', {})
+    return [k for k, v in settings.items()
+            if k in plan_settings and plan_settings[k] != v]
+
+def SavePlan(filename, blocks, info=None):
+    """Save a dict of blocks (trial type -> block) as one .npz file, with
+    info (task, block type, seed, settings, ...) stored as JSON
+    """
+    arrays = {}
+    for trial_type, block in blocks.items():
+        for k, v in block.items():
+            arrays['{}.{}'.format(trial_type, k)] = np.asarray(v)
+    info = dict(info) if info is not None else {}
+    info['trial_types'] = list(blocks.keys())
+    arrays['__info__'] = np.array(json.dumps(info))
+    dirname = os.path.dirname(filename)
+    if dirname != '' and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    np.savez_compressed(filename, **arrays)
+
+def LoadPlan(filename):
+    """Read a plan written by SavePlan(); returns (blocks, info), with the
+    blocks in the order they are run
+    """
+    arrays = {}
+    with np.load(filename, allow_pickle=False) as f:
+        info = json.loads(str(f['__info__']))
+        for k in f.files:
+            if k != '__info__':
+                arrays[k] = f[k]
+    blocks = {}
+    for trial_type in info['trial_types']:
+        blocks[trial_type] = {}
+    for k, v in arrays.items():
+        trial_type, name = k.split('.', 1)
+        blocks[trial_type][name] = v
+    return blocks, info
+
+def MakePlan(task, block_type, seed, conditions_file=None, settings=None):
+    """Make the plan for a whole block of the given task ('RSVPLG' or
+    'TutuLG'); returns (blocks, info) like LoadPlan()
+    """
+    s = dict(TASK_SETTINGS[task])
+    if settings is not None:
+        s.update(settings)
+    if conditions_file is not None:
+        s['conditions_file'] = conditions_file
+    conditions = ReadConditions(s['conditions_file'])
+    rng = np.random.default_rng(seed)
+    if task == 'RSVPLG':
+        blocks = MakeRSVPLGPlan(rng, conditions, block_type, s)
+    else:
+        blocks = MakeTutuPlan(rng, conditions, block_type, s)
+    info = {
+        'task': task,
+        'block_type': block_type,
+        'seed': seed,
+        'settings': s,
+        'trial_types': list(blocks.keys())}
+    return blocks, info
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Write a trial plan that RSVPLG.py or TutuLG.py can '
+        'replay with --plan')
+    parser.add_argument('task', choices=sorted(TASK_SETTINGS.keys()))
+    parser.add_argument('block_type',
+                        help="block type as in the task's dialog, e.g. "
+                        "'Experiment'")
+    parser.add_argument('--conditions', help='conditions CSV file')
+    parser.add_argument('--seed', type=int,
+                        help='random seed (default: chosen at random)')
+    parser.add_argument('-o', '--output', required=True,
+                        help='plan file to write (.npz)')
+    args = parser.parse_args()
+    seed = args.seed
+    if seed is None:
+        seed = int(np.random.default_rng().integers(2 ** 32))
+    blocks, info = MakePlan(args.task, args.block_type, seed, args.conditions)
+    SavePlan(args.output, blocks, info)
+    for trial_type, block in blocks.items():
+        print('{}: {} trials'.format(trial_type, len(block['condition'])))
+    print('seed {} written to {}'.format(seed, args.output))
@@ -27,6 +27,9 @@ par.stim_file_ext = 'png'
 par.n_mask_files = 4
 par.mask_file_prefix = 'mask-'
 par.mask_file_ext = 'png'
+par.intro_t2_lag = 750 # T2 lag on every Introduction trial
+par.use_atlas = False # draw stimuli from a prebuilt texture atlas
+par.atlas_dir = 'atlas-TutuLG'
 
 par.font = 'Arial'
 par.font_size = 24
@@ -39,6 +42,10 @@ par.foreground_color = [0, 0, 0]
 par.background_color = [150, 150, 150]
 par.cue_color = [255, 255, 255]
 par.quit_key = 'escape'
+# Speeded mode: the key for each target letter, for T1 and for T2, and how
+# long after T2 onset both responses must be in
+par.speeded_keys = [{'H': 'd', 'S': 'f'}, {'H': 'j', 'S': 'k'}]
+par.response_deadline = 1.5
 
 # timing setup
 par.dur_pre_trial = 0.5
@@ -51,17 +58,39 @@ par.dur_mask = 0.050
 par.dur_response_gap = 0.1
 par.dur_feedback = 0.5
 par.dur_post_trial = 0.5
+par.wait_spin_margin = 0.002 # sleep until this close to a deadline, then spin
+par.data_flush_every = 10 # write data to disk every X trials and at breaks
+par.data_background_writer = True # write data on a separate thread
 
 ########################################################################
 # Libraries
 ########################################################################
 
+import Startup
+import sys
+if '--headless' in sys.argv:
+    # simulated window, clock and keyboard instead of PsychoPy (Headless.py)
+    import Headless
+    Headless.Install(quit_key=par.quit_key)
 import psychopy
 psychopy.useVersion('2024.2.4')
-from psychopy import core, visual, clock, data, gui, info
-from psychopy.hardware import keyboard
+# only what the dialog needs; the graphics modules are imported in the
+# background while it is up (see StartWarmup)
+from psychopy import core, clock, gui
 import numpy as np
-import os, re, time
+import argparse, atexit, os, time
+from MachineProfile import (CheckFramePeriod, FramePeriodChangedMessage,
+                            LoadProfile)
+from BlinkMetrics import Report as BlinkReport
+from FrameTiming import FlipLog, PrecisionWaiter, TimingPlan
+from Profiling import NullProfiler, StageProfiler
+from Responses import (ACC_QUIT, ResponseCollector, ResponseKeys,
+                       ScoreResponse)
+from SessionStats import SessionStats, StatusFile
+from TrialData import (TUTU_TRIAL_FIELDS, BackgroundWriter, CSVRowWriter,
+                       TrialRecord)
+from TrialPlan import (CheckPlanSettings, LoadPlan, MakePlan, MaskFiles,
+                       ParticipantSeed, PlanImageFiles, SavePlan)
 
 ########################################################################
 # Support Classes
@@ -207,53 +236,52 @@ class Feedback:
         self.t2Box.draw()
 
 class DataHandler:
-    def __init__(self, filename, output_type="csv"):
+    """Collects the fields of each trial in a typed TrialRecord (see
+    TrialData.py) and outputs them as one CSV row per trial. Fields that are
+    not part of the trial schema are session-level values, written at the
+    start of every row. Rows are handed to a CSVRowWriter, running on a
+    background thread if background is True, so OutputLine() does no file
+    I/O on the main thread. Close() also saves the session's trials as a
+    binary columnar file (npz_filename).
+    """
+    def __init__(self, filename, fields, output_type="csv", flush_every=10,
+                 background=True, npz_filename=None):
         self.filename = filename
-        self.data = {}
+        self.npz_filename = npz_filename
+        self.record = TrialRecord(fields)
+        self.closed = False
         if output_type == "csv":
             self.sep = ','
         else:
             raise ValueError("data file output type not recognized")
-
-    def AddData(self, name, value):
-        self.data[name] = str(value)
-
-    def InitializeDataDirectory(self):
-        # check if the data directory exists, and if not create it
-        dirname = os.path.dirname(self.filename)
-        if os.path.exists(dirname) and os.path.isdir(dirname):
-            return
-        elif os.path.exists(dirname) and not os.path.isdir(dirname):
-            s = "data directory '%s' is an existing file" % dirname
-            raise NotADirectoryError(s)
+        self.writer = CSVRowWriter(filename, self.sep, flush_every)
+        if background:
+            self.writer = BackgroundWriter(self.writer)
         else:
-            os.makedirs(dirname)
-            return
+            atexit.register(self.Close)
 
-    def InitializeDataFile(self):
-        # check if the data file exists, and if not create it with its header
-        if os.path.exists(self.filename) and os.path.isfile(self.filename):
-            return
-        elif os.path.exists(self.filename) and not os.path.isfile(self.filename):
-            s = "data file '%s' is an existing directory" % self.filename
-            raise IsADirectoryError(s)
+    def Allocate(self, n_trials):
+        self.record.allocate(n_trials)
+
+    def AddData(self, name, value):
+        if name in self.record.names:
+            self.record.set(name, value)
         else:
-            header = list()
-            for k, v in self.data.items():
-                header.append(k)
-            if len(header) > 0:
-                with open(self.filename, 'w') as f:
-                    f.write(self.sep.join(header) + '\n')
+            self.record.setInfo(name, value)
 
     def OutputLine(self):
-        self.InitializeDataDirectory()
-        self.InitializeDataFile()
-        line = list()
-        for k, v in self.data.items():
-            line.append(v)
-        if len(line) > 0:
-            with open(self.filename, 'a') as f:
-                f.write(self.sep.join(line) + '\n')
+        self.writer.write(self.record.endTrial())
+
+    def Flush(self):
+        self.writer.flush()
+
+    def Close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.close()
+        if self.npz_filename != None and self.record.n > 0:
+            self.record.saveNPZ(self.npz_filename)
 
 ########################################################################
 # Initialization/Shutdown functions
@@ -261,14 +289,20 @@ class DataHandler:
 
 def Initialize():
     InitializeGeneral()
+    StartWarmup()
     PresentDialog()
     InitializeDataFile()
+    InitializeTrialPlan()
+    FinishWarmup()
     InitializeGraphics()
     InitializeStimuli()
     InitializeResponses()
+    InitializeProfiling()
+    par.startup.mark('ready')
 
 def InitializeGeneral():
     global par
+    par.startup = Startup.StartupTimer()
     par.experiment = EXPERIMENT
     par.version = VERSION
     par.runtime = time.strftime("%Y%m%d-%H%M%S")
@@ -277,25 +311,58 @@ def InitializeGeneral():
                                      time.localtime(os.path.getmtime(__file__)))
     except OSError:
         par.modtime = 'No mtime'
-    par.rng = np.random.default_rng()
+    # clock.wait with no CPU hogging is a plain sleep, but on PsychoPy's clock
+    par.waiter = PrecisionWaiter(
+        clock.getTime, par.wait_spin_margin,
+        lambda s: clock.wait(s, hogCPUperiod=0))
 
     par.end_experiment = False
 
+    # command line options
+    parser = argparse.ArgumentParser(description=EXPERIMENT)
+    parser.add_argument(
+        '--plan', help='run the trials in this plan file (see TrialPlan.py)')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='time each stage of every trial and report it at the end')
+    args, unknown_args = parser.parse_known_args()
+    par.plan_file = args.plan
+    par.profile = args.profile
+
+def StartWarmup():
+    # import the graphics modules and read the stimulus files while the
+    # experimenter fills in the dialog
+    global par
+    par.warmup = Startup.Warmup(
+        ['psychopy.visual', 'psychopy.hardware.keyboard', 'StimulusCache'],
+        [lambda: Startup.WarmDirectory(par.stim_dir)])
+    par.warmup.start()
+
+def FinishWarmup():
+    global par, visual, keyboard, ImageSchedule, LoadImagePool, LoadOrBuildAtlas
+    par.warmup_wait = par.warmup.wait()
+    from psychopy import visual
+    from psychopy.hardware import keyboard
+    from StimulusCache import ImageSchedule, LoadImagePool, LoadOrBuildAtlas
+
 def PresentDialog():
     dlg_info = {
         'Participant': '',
         'Experimenter Initials': '',
+        'Session': '1',
         'Block Type': ['Introduction', 'Practice', 'Experiment'],
         'Targets': ['T1', 'Both'],
         'Cue': 'Cue One', #['Cue One', 'Cue Both', 'No Cues'],
-        'Mode': 'Automatic', #['Automatic', 'Self Paced'],
+        'Mode': ['Automatic', 'Speeded'], #, 'Self Paced'],
         'Version': par.version
         }
+    par.startup.mark('dialog')
     dlg = gui.DlgFromDict(
         dlg_info, title=EXPERIMENT,
-        order=['Participant', 'Experimenter Initials',
-                   'Block Type', 'Targets', 'Cue'],
-        fixed=['Cue', 'Mode', 'Version'])
+        order=['Participant', 'Experimenter Initials', 'Session',
+                   'Block Type', 'Targets', 'Cue', 'Mode'],
+        fixed=['Cue', 'Version'])
+    par.startup.mark('dialog_closed')
     if not dlg.OK:
         print('Dialog box canceled')
         core.quit()
@@ -309,6 +376,12 @@ def ProcessDialog(dlg_info):
         print('\n\n***** Participant ID must be an integer ({}) *****'.format(
             dlg_info['Participant']))
         core.quit()
+    try:
+        par.session = int(dlg_info['Session'])
+    except ValueError as ve:
+        print('\n\n***** Session must be an integer ({}) *****'.format(
+            dlg_info['Session']))
+        core.quit()
     par.exp_initials = dlg_info['Experimenter Initials']
     par.block_type = dlg_info['Block Type']
     par.targets = dlg_info['Targets']
@@ -324,34 +397,24 @@ def ProcessDialog(dlg_info):
         par.self_paced = True
     else:
         par.self_paced = False
+    # responses to both targets during and right after the stream, by key,
+    # instead of a prompt for each
+    par.speeded = par.mode == 'Speeded'
 
 def GetDataFileName():
     return os.path.join('data', u'%s-Data-%03d.csv' %
                         (par.experiment,
                          par.subject))
 
-def GetExperimentHandler():
-    extraInfo = {
-        'exp': par.experiment,
-        'ver': par.version,
-        'sub': par.subject,
-        'runtime': par.runtime}
-    return data.ExperimentHandler(
-        name=par.experiment, version=par.version,
-        extraInfo=extraInfo,
-        saveWideText=True,
-        dataFileName=par.data_file_name + '-psychopy')
-
 def InitializeDataFile():
     global par
     par.data_file_name = GetDataFileName()
-    par.data_handler = DataHandler(par.data_file_name)
-    # create experiment handlers
-    par.exp_handler = GetExperimentHandler()
-    # load file with trial conditions
-    par.trial_handler_conditions = data.importConditions(par.conditions_file)
-    par.n_cells = len(par.trial_handler_conditions)
-
+    par.data_handler = DataHandler(
+        par.data_file_name, TUTU_TRIAL_FIELDS,
+        flush_every=par.data_flush_every,
+        background=par.data_background_writer,
+        npz_filename='{}-{}.npz'.format(
+            os.path.splitext(par.data_file_name)[0], par.runtime))
     # store experiment-level data
     par.data_handler.AddData('exp', par.experiment)
     par.data_handler.AddData('exp_initials', par.exp_initials)
@@ -359,42 +422,131 @@ def InitializeDataFile():
     par.data_handler.AddData('ver', par.version)
     par.data_handler.AddData('modtime', par.modtime)
     par.data_handler.AddData('sub', par.subject)
+    par.data_handler.AddData('sess', par.session)
     par.data_handler.AddData('blocktype', par.block_type)
     par.data_handler.AddData('targets', par.targets)
     par.data_handler.AddData('cuetype', par.cue_type)
     par.data_handler.AddData('mode', par.mode)
 
-def GetScreenResolution():
-    # identify screen resolution based on the computer
-    default_res = [1920, 1080]
-    rti = info.RunTimeInfo(win=False, refreshTest=None)
-    comp = rti['systemHostName']
-    if re.match('A[0-9]{6}', comp) != None or 'Yesun' in comp:
-        # this is a computer with a CSUEB asset tag, usually one of our
-        # testing computers, or my smaller work laptop
-        return default_res
-    elif 'GoldenChild' in comp:
-        # larger laptop
-        return [1792, 1120]
+def GetPlanSettings():
+    # settings that determine the trial plan (see TrialPlan.py)
+    return {
+        'conditions_file': par.conditions_file,
+        'n_trials_per_cell': par.n_trials_per_cell,
+        'n_trials_practice': par.n_trials_practice,
+        'n_trials_warmup': par.n_trials_warmup,
+        'target_letters': ''.join(par.target_letters),
+        'distractor_letters': ''.join(par.distractor_letters),
+        'n_mask_files': par.n_mask_files,
+        'mask_file_prefix': par.mask_file_prefix,
+        'mask_file_ext': par.mask_file_ext,
+        'stim_file_ext': par.stim_file_ext,
+        'intro_t2_lag': par.intro_t2_lag}
+
+def InitializeTrialPlan():
+    # generate every trial of the block up front, or load them from a plan
+    # file made with TrialPlan.py
+    global par
+    settings = GetPlanSettings()
+    if par.plan_file != None:
+        try:
+            par.trial_plan, plan_info = LoadPlan(par.plan_file)
+        except (OSError, KeyError, ValueError) as e:
+            print('Cannot read trial plan {}: {}'.format(par.plan_file, e))
+            core.quit()
+        if (plan_info['task'] != 'TutuLG' or
+                plan_info['block_type'] != par.block_type):
+            print('Trial plan {} is for {} {}, not {}'.format(
+                par.plan_file, plan_info['task'], plan_info['block_type'],
+                par.block_type))
+            core.quit()
+        changed = CheckPlanSettings(plan_info, settings)
+        if len(changed) > 0:
+            print('WARNING: trial plan was made with different settings: ' +
+                  ', '.join(changed))
+        par.seed = plan_info['seed']
     else:
+        # a new session (or a restart, with the session bumped) gets a new
+        # trial sequence, as in RSVPLG.py
+        par.seed = ParticipantSeed(
+            par.experiment, par.subject, par.session, par.block_type,
+            par.targets)
+        par.trial_plan, plan_info = MakePlan(
+            'TutuLG', par.block_type, par.seed, settings=settings)
+    SavePlan('{}-{}-plan.npz'.format(
+        os.path.splitext(par.data_file_name)[0], par.runtime),
+        par.trial_plan, plan_info)
+    par.data_handler.AddData('seed', par.seed)
+
+def LoadMachineProfile():
+    # resolution and frame period of this computer, from its calibration
+    # (see MachineProfile.py); None if it has not been calibrated
+    global par
+    try:
+        par.machine = LoadProfile(Startup.HostName())
+    except (OSError, ValueError) as e:
+        print('Cannot read machine profile: {}'.format(e))
+        core.quit()
+
+def GetScreenResolution():
+    if par.machine == None:
         # default
-        print('COMPUTER NOT IDENTIFIED: DEFAULT RESOLUTION SET')
+        print('COMPUTER NOT CALIBRATED: DEFAULT RESOLUTION SET')
         return [800, 600]
+    return par.machine['resolution']
 
 def InitializeGraphics():
     # open window and set up
     global par
+    LoadMachineProfile()
     par.win = visual.Window(
         size=GetScreenResolution(), fullscr=True, screen=0,
         winType='pyglet', allowStencil=False, monitor='Default',
         color=par.background_color, colorSpace=par.color_space,
         backgroundImage=None, backgroundFit=None,
-        blendMode='avg', useFBO=True, units='pix')
+        blendMode='avg', useFBO=True, units='pix',
+        checkTiming=(par.machine == None))
     par.win.mouseVisible = False
-
-    # update timings to get as close to frame rate as possible
-    AdjustDurationSettings()
+    if par.machine != None:
+        # use the calibrated frame period, after checking the refresh rate
+        # has not changed since
+        par.win.monitorFramePeriod = par.machine['frame_period']
+        measured = CheckFramePeriod(par.win, par.machine)
+        if measured != None:
+            par.win.close()
+            print(FramePeriodChangedMessage(measured, par.machine))
+            core.quit()
+
+    InitializeTimingPlan()
     par.pre_flip_window = par.win.monitorFramePeriod * 0.5
+    par.flip_log = FlipLog(par.win.monitorFramePeriod)
+
+def InitializeTimingPlan():
+    # every duration and T2 lag as a whole number of frames, worked out
+    # once; the dur_ settings become the durations those frames give
+    global par
+    durations = {k: getattr(par, 'dur_' + k) for k in (
+        'pre_trial', 'cue', 'fixation', 'post_fixation', 'stim', 'pre_mask',
+        'mask', 'response_gap', 'feedback', 'post_trial')}
+    if par.block_type == 'Introduction':
+        # slower stimuli for the demonstration
+        durations.update({'stim': 0.1, 'pre_mask': 0.1, 'mask': 0.1})
+    par.timing_plan = TimingPlan(par.win.monitorFramePeriod)
+    for k, d in durations.items():
+        par.timing_plan.add(k, d)
+        setattr(par, 'dur_' + k, par.timing_plan.seconds(k))
+    for lag in np.unique(np.concatenate(
+            [block['t2_lag'] for block in par.trial_plan.values()])):
+        par.timing_plan.addLag(int(lag), lag / 1000)
+    try:
+        par.timing_plan.check()
+    except ValueError as e:
+        par.win.close()
+        print('Durations too short for this display, ' + str(e))
+        core.quit()
+    print(par.timing_plan.report())
+    par.timing_plan.saveSummary('{}-{}-timing-plan.csv'.format(
+        os.path.splitext(par.data_file_name)[0], par.runtime))
 
 def InitializeStimuli():
     global par
@@ -403,18 +555,26 @@ def InitializeStimuli():
     par.target_letters = list(par.target_letters)
     par.distractor_letters = list(par.distractor_letters)
 
-    par.stim1_image = visual.ImageStim(
-        par.win, size=par.stim_size, autoLog=False)
-    par.stim2_image = visual.ImageStim(
-        par.win, size=par.stim_size, autoLog=False)
-    par.mask1_image = visual.ImageStim(
-        par.win, size=par.mask_size, autoLog=False)
-    par.mask2_image = visual.ImageStim(
-        par.win, size=par.mask_size, autoLog=False)
-    par.stim1_image.autoDraw = False
-    par.stim2_image.autoDraw = False
-    par.mask1_image.autoDraw = False
-    par.mask2_image.autoDraw = False
+    # load every composite the plan shows and every mask once; trials then
+    # just pick the cached images (see PrepareTrialStimuli)
+    stim_files = PlanImageFiles(par.trial_plan, ('stimfile1', 'stimfile2'))
+    mask_files = set(PlanImageFiles(par.trial_plan, ('maskfile1', 'maskfile2')))
+    mask_files.update(MaskFiles(np.arange(par.n_mask_files) + 1,
+                                par.mask_file_prefix, par.mask_file_ext))
+    mask_files = sorted(mask_files)
+    if par.use_atlas:
+        # just the images this session shows
+        par.atlas = LoadOrBuildAtlas(
+            par.atlas_dir, [os.path.join(par.stim_dir, str(f))
+                            for f in stim_files + mask_files], par.stim_size)
+    else:
+        par.atlas = None
+    par.stim_pool = LoadImagePool(
+        par.win, par.stim_dir, par.stim_size, stim_files, par.atlas)
+    par.mask_pool = LoadImagePool(par.win, par.stim_dir, par.mask_size,
+                                  mask_files, par.atlas)
+    par.stim_pool.preload()
+    par.mask_pool.preload()
 
     # set up other trial objects
     par.fixation = Fixation(par.win)
@@ -444,55 +604,66 @@ def InitializeResponses():
     par.kb = keyboard.Keyboard()
 
     # set up allowed responses
-    par.t1_allowed_responses = list()
-    par.t2_allowed_responses = list()
-    for c in par.target_letters:
-        if c.lower() != c.upper():
-            x = [c.lower(), c.upper()]
-        else:
-            x = [c]
-        par.t1_allowed_responses.extend(x)
-        par.t2_allowed_responses.extend(x)
+    if par.speeded:
+        for keys in par.speeded_keys:
+            missing = [c for c in par.target_letters if c not in keys]
+            if len(missing) > 0:
+                print('No Speeded mode key for target ' + ', '.join(missing))
+                core.quit()
+        par.t1_allowed_responses = list(par.speeded_keys[0].values())
+        par.t2_allowed_responses = list(par.speeded_keys[1].values())
+    else:
+        par.t1_allowed_responses = ResponseKeys(par.target_letters)
+        par.t2_allowed_responses = ResponseKeys(par.target_letters)
     par.t1_allowed_responses.append(par.quit_key)
     par.t2_allowed_responses.append(par.quit_key)
 
     par.t1_correct_count = 0
     par.t2_correct_count = 0
 
+    # running accuracy and RTs, written to a status file after every trial
+    # (see SessionStats.py)
+    par.session_stats = SessionStats(
+        {'exp': par.experiment, 'sub': par.subject, 'sess': par.session,
+         'blocktype': par.block_type, 'targets': par.targets},
+        chance=1 / len(par.target_letters))
+    par.status_writer = BackgroundWriter(StatusFile('{}-{}-status.json'.format(
+        os.path.splitext(par.data_file_name)[0], par.runtime)))
+
+def InitializeProfiling():
+    # with --profile, every stage of RunTrial() is replaced by a timed
+    # version of itself; otherwise nothing changes
+    global par
+    if not par.profile:
+        par.profiler = NullProfiler()
+        return
+    par.profiler = StageProfiler()
+    stages = ['InitializeTrial', 'PreTrialPause', 'PresentCueWithSelfPacing',
+              'PresentCue', 'PresentFixation', 'PresentStimSequence',
+              'CollectResponses', 'SaveData', 'PresentFeedback',
+              'PostTrialPause', 'CheckForBreak', 'EndTrial']
+    g = globals()
+    for name in stages:
+        g[name] = par.profiler.wrap(g[name])
+
 ########################################################################
 # Block-Level Code
 ########################################################################
 
-def CreateTrialHandler(n_reps):
-    return data.TrialHandler(par.trial_handler_conditions,
-                             nReps=n_reps, method='fullRandom')
-
 def InitializeBlock():
     global par
     par.trial = 0
     par.demo_run = False
     if par.block_type == 'Introduction':
+        # with slower stimuli (see InitializeTimingPlan)
         par.demo_run = True
-        par.warmup_trial_handler = None
-        par.main_trial_handler = CreateTrialHandler(
-            np.ceil(par.n_trials_practice / par.n_cells))
-        par.n_trials_main = par.n_trials_practice
-        par.n_trials = par.n_trials_main
-        par.dur_stim = AdjustDuration(0.1)
-        par.dur_pre_mask = AdjustDuration(0.1)
-        par.dur_mask = AdjustDuration(0.1)
-    elif par.block_type == 'Practice':
-        par.warmup_trial_handler = None
-        par.main_trial_handler = CreateTrialHandler(
-            np.ceil(par.n_trials_practice / par.n_cells))
-        par.n_trials_main = par.n_trials_practice
-        par.n_trials = par.n_trials_main
-    else:
-        par.warmup_trial_handler = CreateTrialHandler(
-            np.ceil(par.n_trials_warmup / par.n_cells))
-        par.main_trial_handler = CreateTrialHandler(par.n_trials_per_cell)
-        par.n_trials_main = par.n_trials_per_cell * par.n_cells
-        par.n_trials = par.n_trials_warmup + par.n_trials_main
+    par.warmup_trials = par.trial_plan.get('warmup')
+    par.main_trials = par.trial_plan.get('main')
+    par.n_trials = 0
+    for block in par.trial_plan.values():
+        par.n_trials += len(block['condition'])
+
+    par.data_handler.Allocate(par.n_trials)
 
     par.test_t1 = True
     par.test_t2 = True
@@ -509,16 +680,44 @@ def InitializeBlock():
     else:
         par.cue = None
 
+    if par.speeded:
+        # one collector for the keys of every tested target, started at T1
+        # onset and polled on every flip from then on (see
+        # PresentStimSequence and Flip), each target with its own deadline
+        # from its own onset
+        response_keys = []
+        if par.test_t1:
+            response_keys.append(par.t1_allowed_responses[:-1])
+        if par.test_t2:
+            response_keys.append(par.t2_allowed_responses[:-1])
+        par.speeded_collector = ResponseCollector(
+            par.kb, None, deadline=par.response_deadline,
+            quit_key=par.quit_key, response_keys=response_keys)
+
 def PresentStartMessages():
-    par.TextBox.setText('Press any button to begin %d trials' % (par.n_trials))
+    s = 'Press any button to begin %d trials' % (par.n_trials)
+    if par.speeded:
+        s = SpeededInstructions() + '\n\n\n' + s
+    par.TextBox.setText(s)
     par.win.clearBuffer()
     par.TextBox.draw()
-    par.win.flip()
+    Flip('start')
     keys = par.kb.waitKeys()
     if keys[0].name == par.quit_key:
         par.end_experiment = True
         return
 
+def SpeededInstructions():
+    lines = []
+    for n, keys, tested in ((1, par.speeded_keys[0], par.test_t1),
+                            (2, par.speeded_keys[1], par.test_t2)):
+        if tested:
+            lines.append('Target {}: '.format(n) + ', '.join(
+                ['press {} for {}'.format(k.upper(), c)
+                 for c, k in keys.items()]))
+    lines.append('Respond as quickly as you can')
+    return '\n\n'.join(lines)
+
 def PresentFinalMessages():
     performance_summary = ''
     if par.trial > 0:
@@ -534,35 +733,46 @@ def PresentFinalMessages():
     par.TextBox.setText(performance_summary)
     par.win.clearBuffer()
     par.TextBox.draw()
-    par.win.flip()
+    Flip('end')
     while True:
         keys = par.kb.waitKeys()
         if keys[0].name == par.quit_key:
             break
     par.win.clearBuffer()
-    par.win.flip()
+    Flip('end')
 
-def RunTrialGroup(trial_handler, n_trials = None):
+def RunTrialGroup(block):
     global par
-    if trial_handler == None:
+    if block == None:
         return
-    par.exp_handler.addLoop(trial_handler)
 
-    par.trial_within_phase = 0
-    for this_trial in trial_handler:
+    par.block = block
+    # the image of every trial of the block, in order
+    par.block_images = {
+        k: ImageSchedule(par.stim_pool, block[k])
+        for k in ('stimfile1', 'stimfile2')}
+    par.block_images.update({
+        k: ImageSchedule(par.mask_pool, block[k])
+        for k in ('maskfile1', 'maskfile2')})
+    par.next_trial = None
+    block_start = par.data_handler.record.n
+    for i in range(len(block['condition'])):
         par.trial += 1
-        par.trial_within_phase += 1
-        par.t1_level = this_trial['t1_level']
-        par.t2_level = this_trial['t2_level']
-        par.t2_lag = this_trial['t2_lag']
+        par.trial_within_phase = i
+        par.t1_level = block['t1_level'][i]
+        par.t2_level = block['t2_level'][i]
+        par.t2_lag = block['t2_lag'][i]
         RunTrial()
-        if n_trials != None and par.trial_within_phase >= n_trials:
-            break
         if par.end_experiment:
             break
-        par.exp_handler.nextEntry()
+    ReportBlock(block_start)
 
-    par.exp_handler.loopEnded(trial_handler)
+def ReportBlock(start):
+    record = par.data_handler.record
+    report = BlinkReport(record.data[start:record.n], lag='t2_lag',
+                         main_only=False)
+    if report != '':
+        print('{} block:\n{}'.format(record.info.get('trialtype'), report))
 
 def RunExperiment():
     InitializeBlock()
@@ -573,14 +783,15 @@ def RunExperiment():
 
     # run warmup trials
     par.data_handler.AddData('trialtype', 'warmup')
-    RunTrialGroup(par.warmup_trial_handler, par.n_trials_warmup)
+    RunTrialGroup(par.warmup_trials)
 
     if par.end_experiment:
         return
 
     # run experimental trials
     par.data_handler.AddData('trialtype', 'main')
-    RunTrialGroup(par.main_trial_handler, par.n_trials_main)
+    RunTrialGroup(par.main_trials)
+    par.data_handler.Flush()
 
     PresentFinalMessages()
 
@@ -611,80 +822,93 @@ def RunTrial():
         return
 
 def InitializeTrial():
+    par.startup.mark('first_trial')
+    par.flip_log.startTrial(par.trial)
+    # normally prepared during the last trial's feedback
+    i = par.trial_within_phase
+    if par.next_trial == None or par.next_trial['i'] != i:
+        PrepareTrial(i)
+    trial = par.next_trial
+    par.next_trial = None
     par.data_handler.AddData('trial', par.trial)
     par.data_handler.AddData('trialtime', time.strftime("%Y%m%d-%H%M%S"))
     par.data_handler.AddData('t1_level', par.t1_level)
     par.data_handler.AddData('t2_level', par.t2_level)
-    if par.demo_run:
-        par.t2_lag = 750
     par.data_handler.AddData('t2_lag', par.t2_lag)
-
-    InitializeTrialStimuli()
-    InitializeTrialMasks()
-
-def InitializeTrialStimuli():
-    global par
-    target1 = par.rng.choice(par.target_letters)
-    target2 = par.rng.choice(par.target_letters)
-    distractor1 = par.rng.choice(par.distractor_letters)
-    distractor2 = par.rng.choice(par.distractor_letters)
-
-    if par.t1_level.lower() == 'local':
-        stim1_file = '{}-{}.{}'.format(
-            distractor1, target1, par.stim_file_ext)
-    else:
-        stim1_file = '{}-{}.{}'.format(
-            target1, distractor1, par.stim_file_ext)
-
-    if par.t2_level.lower() == 'local':
-        stim2_file = '{}-{}.{}'.format(
-            distractor2, target2, par.stim_file_ext)
-    else:
-        stim2_file = '{}-{}.{}'.format(
-            target2, distractor2, par.stim_file_ext)
-
-    par.stim1_image.setImage(os.path.join(par.stim_dir, stim1_file))
-    par.stim2_image.setImage(os.path.join(par.stim_dir, stim2_file))
-
-    par.data_handler.AddData('t1', target1)
-    par.data_handler.AddData('t2', target2)
-    par.data_handler.AddData('distractor1', distractor1)
-    par.data_handler.AddData('distractor2', distractor2)
-    par.data_handler.AddData('stimfile1', stim1_file)
-    par.data_handler.AddData('stimfile2', stim2_file)
-
-    InitializeTrialResponses(target1, target2)
-
-def InitializeTrialResponses(target1, target2):
+    for k, v in trial['data']:
+        par.data_handler.AddData(k, v)
+    par.stim1_image = trial['stim1_image']
+    par.stim2_image = trial['stim2_image']
+    par.mask1_image = trial['mask1_image']
+    par.mask2_image = trial['mask2_image']
+    par.t1_correct_response = trial['t1_correct_response']
+    par.t2_correct_response = trial['t2_correct_response']
+
+def PrepareTrial(i):
+    """Set up trial i of the block in par.next_trial: its images, correct
+    responses and the values to record
+    """
     global par
+    trial = {'i': i, 'data': []}
+    PrepareTrialStimuli(trial, i)
+    PrepareTrialMasks(trial, i)
+    par.next_trial = trial
+
+def PrepareNextTrial():
+    # in the idle time of a display: set up the next trial of the block
+    i = par.trial_within_phase + 1
+    if par.next_trial == None and i < len(par.block['condition']):
+        PrepareTrial(i)
+
+def PrepareTrialStimuli(trial, i):
+    target1 = par.block['t1'][i]
+    target2 = par.block['t2'][i]
+    distractor1 = par.block['distractor1'][i]
+    distractor2 = par.block['distractor2'][i]
+    stim1_file = par.block['stimfile1'][i]
+    stim2_file = par.block['stimfile2'][i]
+
+    trial['stim1_image'] = par.block_images['stimfile1'][i]
+    trial['stim2_image'] = par.block_images['stimfile2'][i]
+
+    trial['data'] += [
+        ('t1', target1),
+        ('t2', target2),
+        ('distractor1', distractor1),
+        ('distractor2', distractor2),
+        ('stimfile1', stim1_file),
+        ('stimfile2', stim2_file)]
+
+    PrepareTrialResponses(trial, target1, target2)
+
+def PrepareTrialResponses(trial, target1, target2):
+    if par.speeded:
+        trial['t1_correct_response'] = [par.speeded_keys[0][target1]]
+        trial['t2_correct_response'] = [par.speeded_keys[1][target2]]
+        trial['data'] += [
+            ('t1_corr', trial['t1_correct_response'][0]),
+            ('t2_corr', trial['t2_correct_response'][0])]
+        return
     if target1.lower() != target1.upper():
-        par.t1_correct_response = [target1.lower(), target1.upper()]
+        trial['t1_correct_response'] = [target1.lower(), target1.upper()]
     else:
-        par.t1_correct_response = target1
+        trial['t1_correct_response'] = target1
     if target2.lower() != target2.upper():
-        par.t2_correct_response = [target2.lower(), target2.upper()]
+        trial['t2_correct_response'] = [target2.lower(), target2.upper()]
     else:
-        par.t2_correct_response = target2
-
-    par.data_handler.AddData('t1_corr', ''.join(par.t1_correct_response))
-    par.data_handler.AddData('t2_corr', ''.join(par.t2_correct_response))
+        trial['t2_correct_response'] = target2
 
-def InitializeTrialMasks():
-    global par
-    mask1_file = '{}{}.{}'.format(
-        par.mask_file_prefix,
-        par.rng.choice(par.n_mask_files) + 1,
-        par.mask_file_ext)
-    mask2_file = '{}{}.{}'.format(
-        par.mask_file_prefix,
-        par.rng.choice(par.n_mask_files) + 1,
-        par.mask_file_ext)
+    trial['data'] += [
+        ('t1_corr', ''.join(trial['t1_correct_response'])),
+        ('t2_corr', ''.join(trial['t2_correct_response']))]
 
-    par.mask1_image.setImage(os.path.join(par.stim_dir, mask1_file))
-    par.mask2_image.setImage(os.path.join(par.stim_dir, mask2_file))
+def PrepareTrialMasks(trial, i):
+    trial['mask1_image'] = par.block_images['maskfile1'][i]
+    trial['mask2_image'] = par.block_images['maskfile2'][i]
 
-    par.data_handler.AddData('maskfile1', mask1_file)
-    par.data_handler.AddData('maskfile2', mask2_file)
+    trial['data'] += [
+        ('maskfile1', par.block['maskfile1'][i]),
+        ('maskfile2', par.block['maskfile2'][i])]
 
 def DrawCue():
     if par.cue is not None:
@@ -697,7 +921,7 @@ def PresentCueWithSelfPacing():
     par.self_paced_prompt.setText(
         'Press any button to begin trial {}'.format(par.trial))
     par.self_paced_prompt.draw()
-    par.win.flip()
+    Flip('self_paced')
     keys = par.kb.waitKeys()
     if keys[0].name == par.quit_key:
         par.end_experiment = True
@@ -707,24 +931,20 @@ def PresentCue():
         return
     par.win.clearBuffer()
     DrawCue()
-    par.win.flip()
+    Flip('cue', par.dur_cue)
     clock.wait(par.dur_cue - par.pre_flip_window)
 
 def PresentFixation():
-    par.stim1_image.draw()
-    par.stim2_image.draw()
-    par.mask1_image.draw()
-    par.mask2_image.draw()
     par.win.clearBuffer()
     DrawCue()
     par.fixation.draw()
-    par.win.flip()
+    Flip('fixation', par.dur_fixation)
     par.win.clearBuffer()
     clock.wait(par.dur_fixation - par.pre_flip_window)
 
 def PresentStimSequence():
     # post fixation blank
-    par.win.flip()
+    Flip('post_fixation', par.dur_post_fixation)
 
     # set up timing
     t0 = clock.getTime()
@@ -732,7 +952,7 @@ def PresentStimSequence():
     tEndT1 = tStartT1 + par.dur_stim
     tStartMask1 = tEndT1 + par.dur_pre_mask
     tEndMask1 = tStartMask1 + par.dur_mask
-    tStartT2 = tStartT1 + AdjustDuration(par.t2_lag / 1000)
+    tStartT2 = tStartT1 + par.timing_plan.lagSeconds(par.t2_lag)
     tEndT2 = tStartT2 + par.dur_stim
     tStartMask2 = tEndT2 + par.dur_pre_mask
     tEndMask2 = tStartMask2 + par.dur_mask
@@ -741,63 +961,74 @@ def PresentStimSequence():
     par.win.clearBuffer()
     par.stim1_image.draw()
     WaitUntil(tStartT1 - par.pre_flip_window)
-    par.actual_t1_onset = par.win.flip()
+    if par.speeded:
+        # T1's keys count from T1 onset, T2's only once T2 is up
+        onsets = [0] if par.test_t1 else []
+        if par.test_t2:
+            onsets.append(None)
+        par.speeded_collector.start(par.win, onsets)
+    par.actual_t1_onset = Flip('t1', par.dur_stim)
     # clear T1
     par.win.clearBuffer()
     WaitUntil(tEndT1 - par.pre_flip_window)
-    par.actual_t1_offset = par.win.flip()
+    par.actual_t1_offset = Flip('t1_blank', par.dur_pre_mask)
     # mask1
     par.win.clearBuffer()
     par.mask1_image.draw()
     WaitUntil(tStartMask1 - par.pre_flip_window)
-    par.actual_mask1_onset = par.win.flip()
+    par.actual_mask1_onset = Flip('mask1', par.dur_mask)
     # clear mask1
     par.win.clearBuffer()
     WaitUntil(tEndMask1 - par.pre_flip_window)
-    par.win.flip()
+    Flip('lag_blank', tStartT2 - tEndMask1)
     # T2
     par.win.clearBuffer()
     par.stim2_image.draw()
     WaitUntil(tStartT2 - par.pre_flip_window)
-    par.actual_t2_onset = par.win.flip()
+    par.actual_t2_onset = Flip('t2', par.dur_stim)
+    if par.speeded and par.test_t2:
+        # T2's is the last response
+        par.speeded_collector.open(
+            -1, par.actual_t2_onset - par.actual_t1_onset)
     # clear T2
     par.win.clearBuffer()
     WaitUntil(tEndT2 - par.pre_flip_window)
-    par.actual_t2_offset = par.win.flip()
+    par.actual_t2_offset = Flip('t2_blank', par.dur_pre_mask)
     # mask2
     par.win.clearBuffer()
     par.mask2_image.draw()
     WaitUntil(tStartMask2 - par.pre_flip_window)
-    par.actual_mask2_onset = par.win.flip()
+    par.actual_mask2_onset = Flip('mask2', par.dur_mask)
     # clear mask2
     par.win.clearBuffer()
     WaitUntil(tEndMask2 - par.pre_flip_window)
-    par.win.flip()
+    Flip('response_gap', par.dur_response_gap)
     # pre-response pause
     WaitUntil(tEndStimuli - par.pre_flip_window)
 
 def CollectResponses():
     global par
-    if par.test_t1:
-        rd = CollectResponse(
-            par.t1_response_prompt,
-            par.t1_correct_response,
-            par.t1_allowed_responses)
-        par.t1_response_dict = rd
-        if rd['acc'] == 1:
-            par.t1_correct_count += 1
-    else:
-        par.t1_response_dict = ProcessResponse(None)
-    if par.test_t2:
-        rd = CollectResponse(
-            par.t2_response_prompt,
-            par.t2_correct_response,
-            par.t2_allowed_responses)
-        par.t2_response_dict = rd
-        if rd['acc'] == 1:
-            par.t2_correct_count += 1
+    if par.speeded:
+        CollectSpeededResponses()
     else:
-        par.t2_response_dict = ProcessResponse(None)
+        if par.test_t1:
+            par.t1_response_dict = CollectResponse(
+                par.t1_response_prompt,
+                par.t1_correct_response,
+                par.t1_allowed_responses)
+        else:
+            par.t1_response_dict = ProcessResponse(None)
+        if par.test_t2:
+            par.t2_response_dict = CollectResponse(
+                par.t2_response_prompt,
+                par.t2_correct_response,
+                par.t2_allowed_responses)
+        else:
+            par.t2_response_dict = ProcessResponse(None)
+    if par.t1_response_dict['acc'] == 1:
+        par.t1_correct_count += 1
+    if par.t2_response_dict['acc'] == 1:
+        par.t2_correct_count += 1
 
     par.data_handler.AddData('t1_resp', par.t1_response_dict['resp'])
     par.data_handler.AddData('t1_acc', par.t1_response_dict['acc'])
@@ -809,16 +1040,49 @@ def CollectResponses():
     if par.end_experiment:
         return
 
+def CollectSpeededResponses():
+    # keys have been collected since T1 onset; wait on a blank screen until
+    # every tested target has its first key or is past its deadline. RTs
+    # are from each target's own onset flip.
+    global par
+    collector = par.speeded_collector
+    event = 'response_wait'
+    while not collector.poll():
+        par.win.clearBuffer()
+        Flip(event)
+        event = None
+    collector.stop()
+    n = 0
+    if par.test_t1:
+        par.t1_response_dict = ProcessResponse(
+            collector.keys(n),
+            par.t1_correct_response, par.t1_allowed_responses)
+        n += 1
+    else:
+        par.t1_response_dict = ProcessResponse(None)
+    if par.test_t2:
+        par.t2_response_dict = ProcessResponse(
+            collector.keys(n),
+            par.t2_correct_response, par.t2_allowed_responses)
+    else:
+        par.t2_response_dict = ProcessResponse(None)
+
 def CollectResponse(prompt, correct_response, allowed_responses):
+    # the prompt is redrawn every frame until a key comes in, with the RT
+    # from the prompt's flip
+    collector = ResponseCollector(
+        par.kb, allowed_responses, quit_key=par.quit_key)
     par.win.clearBuffer()
     prompt.draw()
-    par.win.flip()
-    par.kb.clock.reset()
-    keys = par.kb.waitKeys(keyList=allowed_responses)
+    collector.start(par.win)
+    Flip('prompt')
+    while not collector.poll():
+        prompt.draw()
+        Flip()
     response_dict = ProcessResponse(
-        keys, correct_response, allowed_responses)
+        collector.keys(), correct_response, allowed_responses)
     par.win.clearBuffer()
-    par.win.flip()
+    Flip('response_blank')
     return response_dict
 
 def SaveData():
@@ -828,9 +1092,21 @@ def SaveData():
     par.data_handler.AddData('t1mask_soa', par.actual_mask1_onset - par.actual_t1_onset)
     par.data_handler.AddData('t2mask_soa', par.actual_mask2_onset - par.actual_t2_onset)
     par.data_handler.AddData('t1t2_soa', par.actual_t2_onset - par.actual_t1_onset)
+    par.data_handler.AddData('t1_onset', par.actual_t1_onset)
+    par.data_handler.AddData('t1_offset', par.actual_t1_offset)
+    par.data_handler.AddData('mask1_onset', par.actual_mask1_onset)
+    par.data_handler.AddData('t2_onset', par.actual_t2_onset)
+    par.data_handler.AddData('t2_offset', par.actual_t2_offset)
+    par.data_handler.AddData('mask2_onset', par.actual_mask2_onset)
+    # frame counts of this trial's displays so far (see FlipLog)
+    for k, v in par.flip_log.endTrial().items():
+        par.data_handler.AddData(k, v)
 
     # output line
     par.data_handler.OutputLine()
+    par.session_stats.add(par.t1_level, par.t2_level, par.t2_lag,
+                          par.t1_response_dict, par.t2_response_dict)
+    par.status_writer.write(par.session_stats.summary())
     # pause
     clock.wait(par.dur_response_gap - par.pre_flip_window)
 
@@ -843,32 +1119,38 @@ def PresentFeedback():
         rd2['fdbk'], rd2['fdbk_color'])
     par.win.clearBuffer()
     par.feedback.draw()
-    par.win.flip()
-    clock.wait(par.dur_feedback - par.pre_flip_window)
+    Flip('feedback', par.dur_feedback)
+    # WaitUntil() is on clock.getTime(), not on the flip times
+    t = clock.getTime()
+    PrepareNextTrial()
+    WaitUntil(t + par.dur_feedback - par.pre_flip_window)
 
 def PreTrialPause():
     par.win.clearBuffer()
-    par.win.flip()
+    Flip('pre_trial', par.dur_pre_trial)
     clock.wait(par.dur_pre_trial - par.pre_flip_window)
 
 def PostTrialPause():
     par.win.clearBuffer()
-    par.win.flip()
-    clock.wait(par.dur_post_trial - par.pre_flip_window)
+    Flip('post_trial', par.dur_post_trial)
+    t = clock.getTime()
+    PrepareNextTrial()
+    WaitUntil(t + par.dur_post_trial - par.pre_flip_window)
 
 def CheckForBreak():
     if par.trial % par.break_every == 0 and par.n_trials - par.trial > 5:
+        par.data_handler.Flush()
         s = "You have completed {} out of {} trials".format(par.trial, par.n_trials)
         s += "\n\n\nPlease take a short break\n\n\nPress any button to continue"
         par.TextBox.setText(s)
         par.win.clearBuffer()
         par.TextBox.draw()
-        par.win.flip()
+        Flip('break')
         keys = par.kb.waitKeys()
         if keys[0].name == par.quit_key:
             par.end_experiment = True
         par.win.clearBuffer()
-        par.win.flip()
+        Flip('break')
 
 def EndTrial():
     pass
@@ -877,64 +1159,62 @@ def EndTrial():
 # Support Functions
 ########################################################################
 
-def WaitUntil(t):
-    """WaitUntil(t)
+def Flip(event=None, duration=None):
+    """Flip(event=None, duration=None)
 
-    Wait until clock.getTime() gets to t. Uses clock.wait().
+    par.win.flip(), logged in par.flip_log as the start of event, which is
+    meant to stay up for duration seconds (None if it has no set duration).
+    Returns the flip time. In Speeded mode, reads the keys pressed since the
+    last flip while responses are being collected, so presses made during
+    the stream are picked up one frame at a time as they are after it.
     """
 
-    twait = t - clock.getTime()
-    clock.wait(twait)
+    if par.speeded and par.speeded_collector.running:
+        par.speeded_collector.poll()
+    frames = None
+    if duration != None:
+        frames = int(np.round(duration / par.win.monitorFramePeriod))
+    return par.flip_log.flip(par.win, event, frames)
+
+def SaveProfile():
+    par.profiler.saveSummary('{}-{}-profile.csv'.format(
+        os.path.splitext(par.data_file_name)[0], par.runtime))
+    print(par.profiler.report())
+
+def SaveStartupTimes():
+    print(par.startup.report())
+    par.startup.saveRow(
+        os.path.join('data', par.experiment + '-startup.csv'), {
+            'host': Startup.HostName(), 'runtime': par.runtime,
+            'sub': par.subject, 'blocktype': par.block_type,
+            'warmup': round(par.warmup.duration, 4),
+            'warmup_wait': round(par.warmup_wait, 4)})
+
+def SaveTimingSummary():
+    # check the displays left unchecked and save the session's summary
+    par.flip_log.endTrial()
+    par.flip_log.saveSummary('{}-{}-timing.csv'.format(
+        os.path.splitext(par.data_file_name)[0], par.runtime))
+    print(par.flip_log.report())
+
+def WaitUntil(t):
+    """WaitUntil(t)
 
-def AdjustDuration(t):
-    frame_rate = par.win.monitorFramePeriod
-    return frame_rate * np.round(t / frame_rate)
+    Wait until clock.getTime() gets to t, which must be on that clock and
+    not a Flip() time. Sleeps until par.wait_spin_margin before t and spins
+    for the rest. Returns how late it woke.
+    """
 
-def AdjustDurationSettings():
-    global par
-    frame_rate = par.win.monitorFramePeriod
-    for s in dir(par):
-        if not s.startswith('dur_'):
-            continue
-        x = getattr(par, s)
-        if x == 0:
-            continue
-        setattr(par, s, frame_rate * np.round(x / frame_rate))
+    return par.waiter.waitUntil(t)
 
 def ProcessResponse(keys=None, correct_responses=None, allowed_responses=None):
     global par
-    if keys == None:
-        return {
-            'acc': -5, 'rt': 0, 'resp': 'none',
-            'fdbk': None, 'fdbk_color': None}
-    elif keys[0].name == par.quit_key:
+    response_dict = ScoreResponse(
+        keys, correct_responses, allowed_responses, par.quit_key,
+        par.feedback_color_correct, par.feedback_color_error)
+    if response_dict['acc'] == ACC_QUIT:
         par.end_experiment = True
-        return {
-            'acc': -6, 'rt': 0, 'resp': 'none',
-            'fdbk': None, 'fdbk_color': None}
-    rt = keys[0].rt
-    resp = keys[0].name
-    fdbk_color = par.feedback_color_error
-    if len(keys) > 1:
-        # multiple keys pressed
-        acc = -2
-        resp = 'multiple'
-        fdbk = 'MULTIPLE KEYS PRESSED'
-    elif resp in correct_responses:
-        # correct
-        acc = 1
-        fdbk = 'CORRECT'
-        fdbk_color = par.feedback_color_correct
-    elif resp in allowed_responses:
-        # error
-        acc = 0
-        fdbk = 'ERROR'
-    else:
-        # some other non-allowed response
-        acc = -1
-        fdbk = 'BAD KEY PRESS'
-    return {'acc': acc, 'rt': rt, 'resp': resp,
-        'fdbk': fdbk, 'fdbk_color': fdbk_color}
+    return response_dict
 
 ########################################################################
 # Set up and run experiment, then quit cleanly
@@ -942,8 +1222,17 @@ def ProcessResponse(keys=None, correct_responses=None, allowed_responses=None):
 
 Initialize()
 RunExperiment()
-if 'exp_handler' in dir(par):
-    par.exp_handler.abort()
+if 'flip_log' in dir(par):
+    SaveTimingSummary()
+if par.profile:
+    SaveProfile()
+if 'warmup_wait' in dir(par):
+    SaveStartupTimes()
+if 'data_handler' in dir(par):
+    par.data_handler.Close()
+if 'status_writer' in dir(par):
+    par.status_writer.close()
+    print(par.session_stats.report())
 if 'win' in dir(par):
     par.win.close()
 core.quit()
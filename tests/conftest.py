@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the libraries are modules at the top of the repository
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
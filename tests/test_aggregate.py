@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import Aggregate
+from conftest import REPO
+
+SESSIONS = ['RSVPLG03-Data-701.csv', 'RSVPLG03-Data-702.csv']
+
+@pytest.fixture
+def data_dir(tmp_path):
+    d = tmp_path / 'data'
+    d.mkdir()
+    for f in SESSIONS:
+        shutil.copy(os.path.join(REPO, 'rsvplg03', 'data', f), str(d))
+    return str(d)
+
+def DataRows(filename):
+    with open(filename) as f:
+        return len([line for line in f if line.strip() != '']) - 1
+
+def DropLastRows(filename, n):
+    with open(filename) as f:
+        lines = f.readlines()
+    with open(filename, 'w') as f:
+        f.writelines(lines[:-n])
+
+def test_read_session_file(data_dir):
+    filename = os.path.join(data_dir, SESSIONS[0])
+    rows, ignored = Aggregate.ReadSessionFile(filename)
+    assert len(rows) == DataRows(filename)
+    assert rows.dtype == Aggregate.AGGREGATE_DTYPE
+    assert np.all(rows['source'] == filename)
+    assert np.all(rows['exp'] == 'RSVPLG03')
+    # lags are in ms
+    np.testing.assert_array_equal(np.unique(rows['lag']), [300, 750])
+
+def test_read_session_file_skips_other_csv_files(tmp_path):
+    filename = str(tmp_path / 'survey.csv')
+    with open(filename, 'w') as f:
+        f.write('id,answer\n1,yes\n')
+    assert Aggregate.ReadSessionFile(filename) == (None, [])
+
+def test_update_parses_only_what_changed(data_dir, tmp_path):
+    output = str(tmp_path / 'All.npz')
+    files = [os.path.join(data_dir, f) for f in SESSIONS]
+    n = [DataRows(f) for f in files]
+    data, status = Aggregate.UpdateAggregate([data_dir], output)
+    assert status['new'] == 2
+    assert len(data) == sum(n)
+
+    data, status = Aggregate.UpdateAggregate([data_dir], output)
+    assert status['unchanged'] == 2
+    assert status['new'] + status['changed'] == 0
+    assert len(data) == sum(n)
+
+    # one file loses its last 10 trials: only its rows are replaced
+    DropLastRows(files[1], 10)
+    data, status = Aggregate.UpdateAggregate([data_dir], output)
+    assert status['unchanged'] == 1
+    assert status['changed'] == 1
+    assert np.sum(data['source'] == files[0]) == n[0]
+    assert np.sum(data['source'] == files[1]) == n[1] - 10
+    # and the saved aggregate is the one returned
+    saved = Aggregate.LoadAggregate(output)
+    assert len(saved) == len(data)
+    np.testing.assert_array_equal(np.sort(saved['source']),
+                                  np.sort(data['source']))
+
+    os.remove(files[0])
+    data, status = Aggregate.UpdateAggregate([data_dir], output)
+    assert status['removed'] == 1
+    assert np.all(data['source'] == files[1])
+
+def test_update_keeps_rows_of_a_changed_file_that_fails(data_dir, tmp_path):
+    output = str(tmp_path / 'All.npz')
+    files = [os.path.join(data_dir, f) for f in SESSIONS]
+    data, status = Aggregate.UpdateAggregate([data_dir], output)
+    n = np.sum(data['source'] == files[0])
+    with open(files[0], 'a') as f:
+        f.write('RSVPLG03,km,not,a,row\n')
+    data, status = Aggregate.UpdateAggregate([data_dir], output)
+    assert status['failed'] == 1
+    assert status['stale'] == 1
+    assert np.sum(data['source'] == files[0]) == n
+
+def test_update_reparses_everything_for_another_schema(data_dir, tmp_path):
+    output = str(tmp_path / 'All.npz')
+    data, status = Aggregate.UpdateAggregate([data_dir], output)
+    manifest_file = Aggregate.ManifestFileName(output)
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    assert manifest['schema'] == Aggregate.SchemaSignature()
+    manifest['schema'] = 'not-this-schema'
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f)
+    assert Aggregate.LoadManifest(manifest_file) == None
+    again, status = Aggregate.UpdateAggregate([data_dir], output)
+    assert status['new'] == 2
+    assert status['unchanged'] == 0
+    assert len(again) == len(data)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import BlinkMetrics
+
+# qnorm() values from R
+QNORM = {0.8: 0.8416212335729143, 0.25: -0.6744897501960817,
+         0.9875: 2.241402727604947}
+
+def SDTTrials(hits, n_signal, false_alarms, n_noise):
+    # T1 trials with 'H' as the signal; the rest are 'S'
+    t1 = np.array(['H'] * n_signal + ['S'] * n_noise)
+    correct = np.concatenate([
+        np.arange(n_signal) < hits,
+        np.arange(n_noise) >= false_alarms])
+    n = n_signal + n_noise
+    return {'t1': t1, 't1_acc': correct.astype(int),
+            't2_acc': np.ones(n, dtype=int),
+            'trial_type': np.full(n, 'main')}
+
+def test_z_is_qnorm_and_nan_where_p_is():
+    z = BlinkMetrics.Z([0.8, 0.25, np.nan])
+    assert z[0] == pytest.approx(QNORM[0.8])
+    assert z[1] == pytest.approx(QNORM[0.25])
+    assert np.isnan(z[2])
+
+def test_dprime_matches_the_sdt_formula():
+    # 16/20 hits, 5/20 false alarms:
+    # d' = qnorm(hr) - qnorm(far), c = -(qnorm(hr) + qnorm(far)) / 2
+    table = BlinkMetrics.DPrime(SDTTrials(16, 20, 5, 20))
+    assert table['hits'][0] == 16
+    assert table['false_alarms'][0] == 5
+    assert table['hit_rate'][0] == pytest.approx(0.8)
+    assert table['fa_rate'][0] == pytest.approx(0.25)
+    assert table['dprime'][0] == pytest.approx(QNORM[0.8] - QNORM[0.25])
+    assert table['criterion'][0] == pytest.approx(
+        -0.5 * (QNORM[0.8] + QNORM[0.25]))
+
+def test_dprime_moves_perfect_rates_by_one_over_2n():
+    # 20/20 hits and 0/20 false alarms: rates of 1 - 1/80 and 1/80
+    table = BlinkMetrics.DPrime(SDTTrials(20, 20, 0, 20))
+    assert table['hit_rate'][0] == 1
+    assert table['fa_rate'][0] == 0
+    assert table['dprime'][0] == pytest.approx(2 * QNORM[0.9875])
+    assert table['criterion'][0] == pytest.approx(0)
+
+def test_dprime_by_group_and_main_trials_only():
+    a = SDTTrials(16, 20, 5, 20)
+    b = SDTTrials(20, 20, 0, 20)
+    data = {k: np.concatenate([a[k], b[k]]) for k in a}
+    data['sub'] = np.repeat([1, 2], 40)
+    data['trial_type'][:2] = 'practice'
+    data['t1_acc'][40] = -3
+    table = BlinkMetrics.DPrime(data, by=('sub',))
+    np.testing.assert_array_equal(table['sub'], [1, 2])
+    np.testing.assert_array_equal(table['n_signal'], [18, 19])
+    np.testing.assert_array_equal(table['hits'], [14, 19])
+
+def test_blink_from_accuracy_by_lag():
+    # T2|T1 accuracy 1/2 at lag 200 and 3/4 at lag 800; one T1 error
+    data = {
+        'lag': np.array([200] * 3 + [800] * 4),
+        't1_acc': np.array([1, 1, 0, 1, 1, 1, 1]),
+        't2_acc': np.array([1, 0, 1, 1, 1, 1, 0]),
+        'trial_type': np.full(7, 'exp'),
+        'block_type': np.full(7, 'Experiment')}
+    accuracy = BlinkMetrics.AccuracyByLag(data)
+    np.testing.assert_array_equal(accuracy['lag'], [200, 800])
+    np.testing.assert_array_equal(accuracy['n'], [3, 4])
+    assert accuracy['t1_acc'] == pytest.approx([2 / 3, 1])
+    assert accuracy['t2t1_acc'] == pytest.approx([0.5, 0.75])
+    blink = BlinkMetrics.BlinkMagnitude(accuracy)
+    assert blink['short_lag'][0] == 200
+    assert blink['long_lag'][0] == 800
+    assert blink['blink'][0] == pytest.approx(0.25)
+    # other blocks do not count
+    data['block_type'][:] = 'Practice'
+    assert BlinkMetrics.AccuracyByLag(data)['n'].sum() == 0
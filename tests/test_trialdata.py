@@ -0,0 +1,87 @@
+import csv
+
+import numpy as np
+import pytest
+
+import TrialData
+
+FIELDS = [('trial', 'i4'), ('t1', 'U1'), ('t1_rt', 'f8')]
+
+def test_record_grows_past_its_allocation():
+    record = TrialData.TrialRecord(FIELDS, n_trials=2, info={'sub': 7})
+    for i in range(5):
+        record.set('trial', i + 1)
+        record.set('t1', 'HS'[i % 2])
+        if i != 3:
+            record.set('t1_rt', 0.5 + i)
+        record.endTrial()
+    assert record.n == 5
+    # doubled, not grown by one
+    assert len(record.data) == 8
+    np.testing.assert_array_equal(record.data['trial'][:5], [1, 2, 3, 4, 5])
+    assert np.isnan(record.data['t1_rt'][3])
+    assert record.row(3) == {'sub': 7, 'trial': 4, 't1': 'S', 't1_rt': ''}
+    assert record.row(4)['t1_rt'] == 4.5
+
+def test_columns_and_rows_follow_info_first():
+    record = TrialData.TrialRecord(FIELDS, info={'sub': 7},
+                                   info_first=False)
+    assert record.columns() == ['trial', 't1', 't1_rt', 'sub']
+    record.set('trial', 1)
+    assert list(record.endTrial().keys()) == record.columns()
+
+def test_set_rejects_values_too_long_for_the_column():
+    record = TrialData.TrialRecord(FIELDS)
+    with pytest.raises(ValueError):
+        record.set('t1', 'HS')
+
+def test_npz_round_trip(tmp_path):
+    record = TrialData.TrialRecord(FIELDS, info={'sub': 7, 'exp': 'X'})
+    for i in range(3):
+        record.set('trial', i + 1)
+        record.set('t1', 'H')
+        record.set('t1_rt', 0.25 * i)
+        record.endTrial()
+    filename = str(tmp_path / 'data' / 'x.npz')
+    record.saveNPZ(filename)
+    columns, info = TrialData.LoadTrialRecord(filename)
+    assert info == {'sub': 7, 'exp': 'X'}
+    for name in record.names:
+        np.testing.assert_array_equal(columns[name], record.data[name][:3])
+        assert columns[name].dtype == record.dtype[name]
+
+def test_csv_round_trip_appends_under_the_existing_header(tmp_path):
+    filename = str(tmp_path / 'data' / 'x.csv')
+    record = TrialData.TrialRecord(FIELDS, info={'sub': 7})
+    rows = []
+    for i in range(3):
+        record.set('trial', i + 1)
+        record.set('t1', 'S')
+        record.set('t1_rt', 0.5)
+        rows.append(record.endTrial())
+    writer = TrialData.CSVRowWriter(filename, flush_every=2)
+    for row in rows:
+        writer.write(row)
+    assert writer.n_written == 2
+    writer.close()
+    assert writer.n_written == 3
+    # a later block writes its columns in another order: they go under the
+    # file's header
+    writer = TrialData.CSVRowWriter(filename)
+    writer.write({'t1_rt': 0.75, 't1': 'H', 'trial': 4, 'sub': 7})
+    writer.close()
+    with open(filename, newline='') as f:
+        lines = list(csv.reader(f))
+    assert lines[0] == ['sub', 'trial', 't1', 't1_rt']
+    assert lines[1:] == [['7', '1', 'S', '0.5'], ['7', '2', 'S', '0.5'],
+                         ['7', '3', 'S', '0.5'], ['7', '4', 'H', '0.75']]
+
+def test_background_writer_writes_every_row(tmp_path):
+    filename = str(tmp_path / 'x.csv')
+    writer = TrialData.BackgroundWriter(TrialData.CSVRowWriter(filename))
+    for i in range(25):
+        writer.write({'trial': i + 1})
+    writer.close()
+    with open(filename, newline='') as f:
+        lines = list(csv.reader(f))
+    assert lines == [['trial']] + [[str(i + 1)] for i in range(25)]
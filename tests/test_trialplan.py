@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+
+import TrialPlan
+from conftest import REPO
+
+def MakeRSVPLG(seed, block_type='Experiment'):
+    return TrialPlan.MakePlan(
+        'RSVPLG', block_type, seed,
+        conditions_file=os.path.join(REPO, 'RSVPLGTrials.csv'))
+
+def test_participant_seed_depends_on_every_identifier():
+    seed = TrialPlan.ParticipantSeed('RSVPLG03', 701, 1, 'Experiment')
+    assert seed == TrialPlan.ParticipantSeed('RSVPLG03', 701, 1, 'Experiment')
+    assert seed != TrialPlan.ParticipantSeed('RSVPLG03', 701, 2, 'Experiment')
+    assert 0 <= seed < 2 ** 32
+
+def test_plan_is_reproducible_from_its_seed():
+    a, _ = MakeRSVPLG(1234)
+    b, _ = MakeRSVPLG(1234)
+    c, _ = MakeRSVPLG(1235)
+    for trial_type in a:
+        for k in a[trial_type]:
+            np.testing.assert_array_equal(a[trial_type][k], b[trial_type][k])
+    assert any(not np.array_equal(a[t]['t1'], c[t]['t1']) for t in a)
+
+def test_plan_round_trips_through_save_and_load(tmp_path):
+    blocks, info = MakeRSVPLG(42)
+    filename = str(tmp_path / 'plans' / 's42.npz')
+    TrialPlan.SavePlan(filename, blocks, info)
+    loaded, loaded_info = TrialPlan.LoadPlan(filename)
+    assert list(loaded.keys()) == list(blocks.keys())
+    for trial_type, block in blocks.items():
+        assert set(loaded[trial_type].keys()) == set(block.keys())
+        for k, v in block.items():
+            np.testing.assert_array_equal(loaded[trial_type][k], v)
+            assert loaded[trial_type][k].dtype == np.asarray(v).dtype
+    assert loaded_info['seed'] == 42
+    assert loaded_info['settings'] == info['settings']
+    assert TrialPlan.CheckPlanSettings(loaded_info, info['settings']) == []
+
+def test_rsvp_block_puts_targets_in_the_stream():
+    conditions = TrialPlan.ReadConditions(
+        os.path.join(REPO, 'RSVPLGTrials.csv'))
+    rng = np.random.default_rng(0)
+    n = 200
+    block = TrialPlan.GenerateRSVPBlock(
+        rng, conditions, n, 12, list('ACEFLMNPTUXYZ'), list('HS'),
+        list('HS'), [4, 5, 6], 'black', 'white', 'white')
+    rows = np.arange(n)
+    t1_index = block['t1_pos'] - 1
+    t2_index = t1_index + block['t2_lag'].astype(int)
+    assert block['global_letters'].shape == (n, 12)
+    assert np.all(np.isin(block['t1_pos'], [4, 5, 6]))
+    g = block['t1_level'] == 'global'
+    letters = np.where(g[:, None], block['global_letters'],
+                       block['local_letters'])
+    np.testing.assert_array_equal(letters[rows, t1_index], block['t1'])
+    g = block['t2_level'] == 'global'
+    letters = np.where(g[:, None], block['global_letters'],
+                       block['local_letters'])
+    np.testing.assert_array_equal(letters[rows, t2_index], block['t2'])
+    assert np.all(block['colors'][rows, t1_index] == 'white')
+    assert np.all(block['colors'][rows, t2_index] == 'white')
+    assert np.sum(block['colors'] == 'black') == n * 10
+    # every condition is used equally often
+    counts = np.bincount(block['condition'], minlength=len(conditions))
+    assert counts.max() - counts.min() <= 1
+
+def test_rsvp_block_rejects_t2_past_the_stream():
+    conditions = [{'row': 1, 't1_level': 'local', 't2_level': 'local',
+                   't2_lag': 8}]
+    with pytest.raises(ValueError):
+        TrialPlan.GenerateRSVPBlock(
+            np.random.default_rng(0), conditions, 10, 12,
+            list('ACEFLMNPTUXYZ'), list('HS'), list('HS'), [6], 'black',
+            'white', 'white')